@@ -1,11 +1,10 @@
-import os
 import logging
 from django.contrib import admin
 from django.utils.html import format_html
 from django.urls import reverse
 
 from .models import Invoice, InvoiceItem, Customer, TaskStatus
-from .tasks import generate_pdf
+from .triggers import enqueue_pdf_renders
 
 logger = logging.getLogger(__name__)
 
@@ -25,14 +24,18 @@ class InvoiceAdmin(admin.ModelAdmin):
         "company_name",
         "address",
         "created_at",
+        "item_count",
+        "total",
         "latest_task_status_badge",
         "latest_task_duration",
         "pdf_link",
     ]
-    readonly_fields = ["pdf_link"]
+    readonly_fields = ["pdf_link", "render_hash", "has_pdf", "item_count", "total", "latest_status"]
+    exclude = ["latest_task"]
     inlines = [InvoiceItemInline]
     actions = ["generate_pdf_action"]
-    list_filter = ["created_at"]
+    list_filter = ["created_at", "has_pdf", "latest_status"]
+    list_select_related = ["customer", "latest_task"]
     search_fields = ["company_name", "customer__name"]
     ordering = ["-created_at"]
 
@@ -44,50 +47,49 @@ class InvoiceAdmin(admin.ModelAdmin):
         # Поддержка S3 и локального режима
         if obj.pdf_url:
             return format_html('<a href="{}" target="_blank">📄 View PDF</a>', obj.pdf_url)
-        pdf_file_path = obj.get_pdf_path()
-        if os.path.exists(pdf_file_path):
+        if obj.has_pdf:
             url = reverse("download_pdf", args=[obj.id])
             return format_html('<a href="{}" target="_blank">📄 View PDF</a>', url)
         return format_html('<span style="color:red;">❌ No PDF found</span>')
     pdf_link.short_description = "PDF File"
 
     def latest_task_status_badge(self, obj):
-        task = obj.tasks.first()
-        if not task:
+        # latest_status и latest_task денормализованы на Invoice — без запроса на строку
+        task_status = obj.latest_status
+        if not task_status:
             return format_html('<span style="color:gray;">—</span>')
         color = {
             "queued": "gray",
             "running": "orange",
             "completed": "green",
             "failed": "red"
-        }.get(task.status, "black")
+        }.get(task_status, "black")
         return format_html(
             '<span style="color:{}; font-weight:bold;">{}</span>',
             color,
-            task.status.capitalize()
+            task_status.capitalize()
         )
     latest_task_status_badge.short_description = "PDF Status"
 
     def latest_task_duration(self, obj):
-        task = obj.tasks.first()
+        task = obj.latest_task
         if task and task.duration_seconds:
             return f"{task.duration_seconds:.2f} s"
         return "—"
     latest_task_duration.short_description = "Generation Time"
 
     def generate_pdf_action(self, request, queryset):
-        started = []
-        for invoice in queryset:
-            if invoice.items.exists():
-                try:
-                    result = generate_pdf.delay(invoice.id)
-                    started.append(str(invoice.id))
-                except Exception as e:
-                    logger.exception("❌ Error starting PDF task")
-                    self.message_user(request, f"❌ Error for Invoice #{invoice.id}: {e}", level="error")
+        invoice_ids = list(queryset.values_list("id", flat=True))
+        try:
+            # Инвойсы без позиций и уже стоящие в очереди пропускаются
+            task_ids = enqueue_pdf_renders(invoice_ids)
+        except Exception as e:
+            logger.exception("❌ Error starting PDF task")
+            self.message_user(request, f"❌ Error starting PDF tasks: {e}", level="error")
+            return
         self.message_user(
             request,
-            f"{len(started)} PDF task(s) started. Invoices: {', '.join(started)}"
+            f"{len(task_ids)} PDF task(s) started for {len(invoice_ids)} selected invoice(s)."
         )
     generate_pdf_action.short_description = "📄 Generate PDF via Celery"
 
@@ -105,11 +107,14 @@ class TaskStatusAdmin(admin.ModelAdmin):
         "duration_seconds", "short_error"
     ]
     list_filter = ["status", "created_at"]
+    list_select_related = ["invoice"]
     search_fields = ["task_id", "invoice__company_name", "invoice__customer__name"]
     readonly_fields = ["error_message", "heartbeat_at"]
     ordering = ["-created_at"]
 
     def invoice_link(self, obj):
+        if obj.invoice_id is None:
+            return "—"
         url = reverse("admin:api_invoice_change", args=[obj.invoice.id])
         return format_html('<a href="{}">Invoice #{}</a>', url, obj.invoice.id)
     invoice_link.short_description = "Invoice"
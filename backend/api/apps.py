@@ -6,3 +6,4 @@ class ApiConfig(AppConfig):
 
     def ready(self):
         import backend.api.signals  # noqa: F401
+        import backend.api.instrumentation  # noqa: F401  (хуки task_prerun / task_postrun)
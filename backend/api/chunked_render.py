@@ -0,0 +1,413 @@
+"""
+Chunked rendering of very large invoices.
+
+One WeasyPrint document for tens of thousands of line items keeps the whole
+box tree of every page in one process: memory grows with the item count and
+only one core works. Invoices with at least ``PDF_CHUNK_MIN_ITEMS`` items are
+rendered in parts instead:
+
+1. ``chunk_contexts`` splits the items into runs of ``PDF_CHUNK_ITEMS`` rows.
+   Only the first part gets the header (company, customer, logo) and only the
+   last one the grand total and footer; the total is the invoice's, not a sum
+   over the part.
+2. Every part is rendered into its own temp file with ``render_to_files`` —
+   in parallel on the renderer pool (``PDF_RENDER_POOL_SIZE``), or one after
+   another where there is no pool, which still bounds memory to one part.
+3. ``merge_parts`` streams the parts into one PDF, a part at a time: pypdf
+   reads a part, its pages and the objects they use are renumbered and
+   written out immediately, and every page gets a "Page X of N" content
+   stream. The template's own page counter would restart in every part, so
+   parts are rendered without it. The number is set in the standard
+   Helvetica font, which needs no embedding and has Arial's metrics; the
+   template's Arial is a subset embedded per part and may lack the glyphs.
+
+Every part starts on a new page, so the last page of a part may be partly
+empty.
+
+From the parts' catalogs only the page tree, the bookmarks (``/Outlines``,
+chained in part order) and the named destinations of internal links
+(``/Dests`` and the ``/Dests`` name tree; on a name clash the earlier part
+wins) are carried over. Other catalog entries and the document info
+(``/Metadata``, ``/PageLabels``, other ``/Names`` trees, the title) are
+dropped.
+"""
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from pypdf import PdfReader
+from pypdf.generic import (
+    ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject, PdfObject, StreamObject,
+)
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+from .metrics import PDF_SIZE_BYTES, render_phase
+from .renderer import render_to_files
+
+logger = logging.getLogger(__name__)
+
+# Как у @bottom-right в report_template.html: поле страницы WeasyPrint по умолчанию — 75px
+PAGE_MARGIN_PT = 56.25
+PAGE_NUMBER_FONT = ("Helvetica", 9)
+PAGE_NUMBER_GREY = 0x88 / 0xFF
+PAGE_NUMBER_FONT_RESOURCE = "/FPageNumber"
+
+
+def is_chunked(context: Dict[str, Any]) -> bool:
+    threshold = getattr(settings, "PDF_CHUNK_MIN_ITEMS", 5000)
+    return bool(threshold) and len(context["items"]) >= threshold
+
+
+def chunk_contexts(context: Dict[str, Any], chunk_items: int) -> List[Dict[str, Any]]:
+    """Template contexts of the parts; the header goes to the first, the total to the last."""
+    items = context["items"]
+    starts = range(0, max(len(items), 1), chunk_items)
+    return [
+        {
+            **context,
+            "items": items[start:start + chunk_items],
+            "chunked": True,
+            "continuation": start > 0,
+            "has_more": start + chunk_items < len(items),
+        }
+        for start in starts
+    ]
+
+
+class _PDFOutput:
+    """Writes numbered objects straight to ``target`` and remembers their offsets for the xref table."""
+
+    # 1 — Catalog, 2 — Pages (пишется последним, когда известны все страницы), 3 — шрифт номеров, 4 — "q"
+    CATALOG, PAGES, FONT, SAVE_STATE = 1, 2, 3, 4
+
+    def __init__(self, target: BinaryIO):
+        self.target = target
+        self.position = 0
+        self.offsets: Dict[int, int] = {}
+        self.last_number = self.SAVE_STATE
+
+    def write(self, data: bytes) -> None:
+        self.target.write(data)
+        self.position += len(data)
+
+    def allocate(self) -> int:
+        self.last_number += 1
+        return self.last_number
+
+    def write_object(self, number: int, obj: PdfObject) -> None:
+        self.offsets[number] = self.position
+        self.write(b"%d 0 obj\n" % number)
+        obj.write_to_stream(self)
+        self.write(b"\nendobj\n")
+
+    def write_xref(self) -> None:
+        size = self.last_number + 1
+        xref_at = self.position
+        self.write(b"xref\n0 %d\n0000000000 65535 f \n" % size)
+        for number in range(1, size):
+            self.write(b"%010d 00000 n \n" % self.offsets[number])
+        self.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, self.CATALOG, xref_at))
+
+
+class _PartCopier:
+    """
+    Copies the pages of one part and every object they reach, renumbered,
+    into ``_PDFOutput``. Objects are written as soon as they are read, so
+    only the current part is ever held in memory.
+    """
+
+    def __init__(self, reader: PdfReader, output: _PDFOutput):
+        self.reader = reader
+        self.output = output
+        self.numbers: Dict[tuple, int] = {}
+        self.pending: List[IndirectObject] = []
+        # Ссылки, которых нет в самой части: закладки соседних частей (/Prev, /Next)
+        self.links: Dict[tuple, Dict[str, int]] = {}
+        # Ссылки на дерево страниц и каталог части ведут в общие объекты результата
+        root = reader.trailer.raw_get("/Root")
+        self.numbers[(root.idnum, root.generation)] = output.CATALOG
+        pages = reader.root_object.raw_get("/Pages")
+        self.numbers[(pages.idnum, pages.generation)] = output.PAGES
+
+    def ref(self, obj: IndirectObject) -> IndirectObject:
+        key = (obj.idnum, obj.generation)
+        if key not in self.numbers:
+            self.numbers[key] = self.output.allocate()
+            self.pending.append(obj)
+        return IndirectObject(self.numbers[key], 0, None)
+
+    def copy(self, obj: PdfObject) -> PdfObject:
+        if isinstance(obj, IndirectObject):
+            return self.ref(obj)
+        if isinstance(obj, StreamObject):
+            stream = StreamObject()
+            # Сырые (сжатые) данные с их /Filter; /Length пересчитывается при записи.
+            # Публичного доступа к сырым данным у pypdf нет — версия закреплена в requirements.txt
+            stream.set_data(obj._data)
+            for key, value in obj.items():
+                if key != "/Length":
+                    stream[NameObject(key)] = self.copy(value)
+            return stream
+        if isinstance(obj, DictionaryObject):
+            return DictionaryObject({NameObject(key): self.copy(value) for key, value in obj.items()})
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self.copy(value) for value in obj)
+        return obj
+
+    def copy_pages(self, first_number: int, total: int) -> List[int]:
+        """Writes the part's pages numbered from ``first_number`` of ``total``; returns their object numbers."""
+        pages = self.reader.pages
+        page_numbers = [self.ref(page.indirect_reference).idnum for page in pages]
+        # Страницы пишем сами (с номером внизу), а не из очереди
+        self.pending.clear()
+
+        for offset, page in enumerate(pages):
+            self.output.write_object(page_numbers[offset], self._numbered_page(page, first_number + offset, total))
+            self.flush()
+        return page_numbers
+
+    def copy_outlines(self, root_number: int, first_number: int, previous: Optional[int],
+                      following: Optional[int]) -> Tuple[int, int]:
+        """
+        Writes the part's bookmarks under the outline root ``root_number``, the
+        first one as ``first_number`` (reserved by ``merge_parts``), chained
+        between the last bookmark of the previous part and the first of the
+        next one. Returns the number of the last top-level bookmark and the
+        part's ``/Count``.
+        """
+        root = self.reader.root_object.raw_get("/Outlines")
+        outlines = root.get_object()
+        first, last = outlines.raw_get("/First"), outlines.raw_get("/Last")
+        if isinstance(root, IndirectObject):
+            self.numbers[(root.idnum, root.generation)] = root_number
+        self.numbers[(first.idnum, first.generation)] = first_number
+        self.pending.append(first)
+        last_number = self.ref(last).idnum
+        if previous:
+            self.links.setdefault((first.idnum, first.generation), {})["/Prev"] = previous
+        if following:
+            self.links.setdefault((last.idnum, last.generation), {})["/Next"] = following
+        self.flush()
+        return last_number, int(outlines.get("/Count", 0))
+
+    def copy_destinations(self, named: Dict[str, Tuple[PdfObject, PdfObject]], legacy: Dict[str, PdfObject]) -> None:
+        """Adds the part's named destinations to ``named`` (name tree) and ``legacy`` (catalog ``/Dests``)."""
+        catalog = self.reader.root_object
+        names = catalog.get("/Names")
+        tree = names.get_object().get("/Dests") if names is not None else None
+        if tree is not None:
+            for key, value in _name_tree(tree):
+                if str(key) not in named:
+                    named[str(key)] = (key, self.copy(value))
+        dests = catalog.get("/Dests")
+        if dests is not None:
+            for key, value in dests.get_object().items():
+                if key not in legacy:
+                    legacy[key] = self.copy(value)
+        self.flush()
+
+    def flush(self) -> None:
+        while self.pending:
+            obj = self.pending.pop()
+            key = (obj.idnum, obj.generation)
+            copied = self.copy(obj.get_object())
+            for name, number in self.links.pop(key, {}).items():
+                copied[NameObject(name)] = IndirectObject(number, 0, None)
+            self.output.write_object(self.numbers[key], copied)
+
+    def _numbered_page(self, page, number: int, total: int) -> DictionaryObject:
+        new_page = DictionaryObject({
+            NameObject(key): self.copy(value)
+            for key, value in page.items()
+            if key not in ("/Parent", "/Contents", "/Resources")
+        })
+        new_page[NameObject("/Parent")] = IndirectObject(self.output.PAGES, 0, None)
+
+        # Ресурсы страницы копируем в саму страницу: общий словарь части не трогаем
+        resources = page.get("/Resources")
+        resources = resources.get_object() if resources is not None else DictionaryObject()
+        new_resources = DictionaryObject({
+            NameObject(key): self.copy(value) for key, value in resources.items() if key != "/Font"
+        })
+        fonts = resources.get("/Font")
+        fonts = self.copy(fonts.get_object()) if fonts is not None else DictionaryObject()
+        fonts[NameObject(PAGE_NUMBER_FONT_RESOURCE)] = IndirectObject(self.output.FONT, 0, None)
+        new_resources[NameObject("/Font")] = fonts
+        new_page[NameObject("/Resources")] = new_resources
+
+        contents = page.get("/Contents")
+        if contents is None:
+            contents = []
+        elif isinstance(contents.get_object(), ArrayObject):
+            contents = list(contents.get_object())
+        else:
+            contents = [contents]
+        page_number = self.output.allocate()
+        self.output.write_object(page_number, _page_number_stream(float(page.mediabox.width), number, total))
+        new_page[NameObject("/Contents")] = ArrayObject([
+            IndirectObject(self.output.SAVE_STATE, 0, None),
+            *(self.copy(part) for part in contents),
+            IndirectObject(page_number, 0, None),
+        ])
+        return new_page
+
+
+def _stream(data: bytes) -> StreamObject:
+    stream = StreamObject()
+    stream.set_data(data)
+    return stream
+
+
+def _name_tree(node: PdfObject) -> Iterator[Tuple[PdfObject, PdfObject]]:
+    """``(key, raw value)`` pairs of a name tree, leaves in order."""
+    node = node.get_object()
+    names = node.get("/Names")
+    if names is not None:
+        names = names.get_object()
+        for index in range(0, len(names) - 1, 2):
+            yield names[index].get_object(), names[index + 1]
+    for kid in node.get_object().get("/Kids", ArrayObject()).get_object():
+        yield from _name_tree(kid)
+
+
+def _has_outlines(reader: PdfReader) -> bool:
+    outlines = reader.root_object.get("/Outlines")
+    return outlines is not None and "/First" in outlines.get_object()
+
+
+def _has_name_tree_dests(reader: PdfReader) -> bool:
+    names = reader.root_object.get("/Names")
+    return names is not None and "/Dests" in names.get_object()
+
+
+def _page_number_stream(width: float, number: int, total: int) -> StreamObject:
+    # Как drawRightString у reportlab: правый край текста — на поле страницы
+    text = f"Page {number} of {total}"
+    x = width - PAGE_MARGIN_PT - stringWidth(text, *PAGE_NUMBER_FONT)
+    y = PAGE_MARGIN_PT / 2 - 3
+    return _stream(
+        f"\nQ\nq {PAGE_NUMBER_GREY:.4f} g BT {PAGE_NUMBER_FONT_RESOURCE} {PAGE_NUMBER_FONT[1]} Tf "
+        f"{x:.2f} {y:.2f} Td ({text}) Tj ET Q\n".encode("ascii")
+    )
+
+
+def merge_parts(paths: List[str], target: BinaryIO) -> int:
+    """
+    Concatenates part PDFs into ``target``, numbers the pages and returns the
+    page count. Parts are streamed one at a time: memory is bounded by the
+    largest part, not by the whole document.
+    """
+    output = _PDFOutput(target)
+    total = 0
+    # Номер первой закладки каждой части резервируем заранее: на него ссылается /Next предыдущей
+    outline_firsts: List[Optional[int]] = []
+    has_named = has_legacy = False
+    for path in paths:
+        reader = PdfReader(path)
+        total += len(reader.pages)
+        outline_firsts.append(output.allocate() if _has_outlines(reader) else None)
+        has_named = has_named or _has_name_tree_dests(reader)
+        has_legacy = has_legacy or "/Dests" in reader.root_object
+
+    catalog = DictionaryObject({
+        NameObject("/Type"): NameObject("/Catalog"),
+        NameObject("/Pages"): IndirectObject(output.PAGES, 0, None),
+    })
+    outlines_number = names_number = dests_number = None
+    if any(outline_firsts):
+        outlines_number = output.allocate()
+        catalog[NameObject("/Outlines")] = IndirectObject(outlines_number, 0, None)
+    if has_named:
+        names_number = output.allocate()
+        catalog[NameObject("/Names")] = IndirectObject(names_number, 0, None)
+    if has_legacy:
+        dests_number = output.allocate()
+        catalog[NameObject("/Dests")] = IndirectObject(dests_number, 0, None)
+
+    output.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+    output.write_object(output.CATALOG, catalog)
+    output.write_object(output.FONT, DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/" + PAGE_NUMBER_FONT[0]),
+        NameObject("/Encoding"): NameObject("/WinAnsiEncoding"),
+    }))
+    output.write_object(output.SAVE_STATE, _stream(b"q\n"))
+
+    kids: List[int] = []
+    last_outline: Optional[int] = None
+    outline_count = 0
+    named: Dict[str, Tuple[PdfObject, PdfObject]] = {}
+    legacy: Dict[str, PdfObject] = {}
+    for index, path in enumerate(paths):
+        copier = _PartCopier(PdfReader(path), output)
+        kids += copier.copy_pages(len(kids) + 1, total)
+        if outline_firsts[index]:
+            following = next((number for number in outline_firsts[index + 1:] if number), None)
+            last_outline, count = copier.copy_outlines(outlines_number, outline_firsts[index], last_outline, following)
+            outline_count += count
+        copier.copy_destinations(named, legacy)
+
+    output.write_object(output.PAGES, DictionaryObject({
+        NameObject("/Type"): NameObject("/Pages"),
+        NameObject("/Kids"): ArrayObject(IndirectObject(number, 0, None) for number in kids),
+        NameObject("/Count"): NumberObject(len(kids)),
+    }))
+    if outlines_number:
+        output.write_object(outlines_number, DictionaryObject({
+            NameObject("/Type"): NameObject("/Outlines"),
+            NameObject("/First"): IndirectObject(next(number for number in outline_firsts if number), 0, None),
+            NameObject("/Last"): IndirectObject(last_outline, 0, None),
+            NameObject("/Count"): NumberObject(outline_count),
+        }))
+    if names_number:
+        # Ключи дерева имён должны идти по порядку
+        entries = ArrayObject()
+        for name in sorted(named):
+            entries += named[name]
+        output.write_object(names_number, DictionaryObject({
+            NameObject("/Dests"): DictionaryObject({NameObject("/Names"): entries}),
+        }))
+    if dests_number:
+        output.write_object(dests_number, DictionaryObject(
+            {NameObject(key): value for key, value in legacy.items()}
+        ))
+    output.write_xref()
+    return len(kids)
+
+
+def render_chunked_to_file(template, context: Dict[str, Any], target: BinaryIO) -> int:
+    """Renders ``context`` part by part and writes the merged PDF to ``target``; returns the page count."""
+    chunk_items = getattr(settings, "PDF_CHUNK_ITEMS", 2000)
+    parts = chunk_contexts(context, chunk_items)
+    with tempfile.TemporaryDirectory(dir=getattr(settings, "PDF_SPOOL_DIR", None), prefix="pdf-parts-") as directory:
+        paths = [os.path.join(directory, f"part-{n:05d}.pdf") for n in range(len(parts))]
+
+        def jobs():
+            # HTML следующей части строится, пока пул рендерит предыдущие (время — в фазе weasyprint)
+            for part, path in zip(parts, paths):
+                yield template.render(part), path
+
+        with render_phase("weasyprint"):
+            render_to_files(jobs())
+        with render_phase("merge"):
+            pages = merge_parts(paths, target)
+
+    logger.info(
+        "🧩 Invoice #%s: %s позиций отрисованы частями (%s × до %s), %s страниц.",
+        context.get("invoice_id"), len(context["items"]), len(parts), chunk_items, pages,
+    )
+    return pages
+
+
+@contextmanager
+def rendered_pdf_chunked(template, context: Dict[str, Any]) -> Iterator[BinaryIO]:
+    """Like ``renderer.rendered_pdf``: yields the merged PDF in a temp file rewound to the start."""
+    with tempfile.TemporaryFile(dir=getattr(settings, "PDF_SPOOL_DIR", None), suffix=".pdf") as spool:
+        render_chunked_to_file(template, context, spool)
+        PDF_SIZE_BYTES.observe(spool.tell())
+        spool.seek(0)
+        yield spool
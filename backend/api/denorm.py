@@ -0,0 +1,42 @@
+"""
+Set-based expressions for the denormalised columns on ``Invoice``.
+
+They take model classes as arguments so the same SQL serves the models and
+the ``sync_invoice_denorm`` command. Migrations keep their own frozen copy.
+"""
+from decimal import Decimal
+from typing import Any, Dict
+
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+
+def item_totals(item_model) -> Dict[str, Any]:
+    """``item_count`` and ``total`` (exact Decimal) computed from the invoice's items."""
+    items = item_model.objects.filter(invoice=OuterRef("pk")).order_by().values("invoice")
+    line_total = ExpressionWrapper(F("quantity") * F("unit_price"), output_field=MONEY)
+    return {
+        "item_count": Coalesce(Subquery(items.annotate(n=Count("pk")).values("n")), 0),
+        "total": Coalesce(
+            Subquery(items.annotate(s=Sum(line_total)).values("s"), output_field=MONEY),
+            Value(Decimal("0.00")),
+            output_field=MONEY,
+        ),
+    }
+
+
+def latest_task(task_model) -> Dict[str, Any]:
+    """``latest_task`` and ``latest_status`` taken from the newest TaskStatus row."""
+    latest = task_model.objects.filter(invoice=OuterRef("pk")).order_by("-created_at", "-id")
+    return {
+        "latest_task": Subquery(latest.values("pk")[:1]),
+        "latest_status": Subquery(latest.values("status")[:1]),
+    }
+
+
+def refresh(invoice_model, item_model, task_model, queryset=None) -> int:
+    """Recomputes every denormalised column for ``queryset`` (all invoices by default)."""
+    queryset = invoice_model.objects.all() if queryset is None else queryset
+    return queryset.update(**item_totals(item_model), **latest_task(task_model))
@@ -0,0 +1,52 @@
+"""
+Presigned S3 download URLs.
+
+Whether a PDF exists is taken from ``Invoice.has_pdf`` rather than a HEAD
+request to S3, and the presigned URL is signed locally with the shared
+client from ``pdf_s3_client``. The URL is cached per invoice until
+``PDF_URL_CACHE_MARGIN`` seconds before it expires, so a cache hit costs
+neither an S3 call nor a DB query. ``_store_pdf`` drops the cached URL after
+every upload, so browsers never get a URL whose cached body predates a re-render.
+"""
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+from backend.storage_backends import pdf_s3_client
+from .models import Invoice
+
+CACHE_PREFIX = "pdf-download-url:"
+
+
+def _cache_key(invoice_id: int) -> str:
+    return f"{CACHE_PREFIX}{invoice_id}"
+
+
+def presigned_pdf_url(invoice_id: int) -> Optional[str]:
+    """Presigned GET URL of the invoice's PDF, or None if it was never stored."""
+    url = cache.get(_cache_key(invoice_id))
+    if url:
+        return url
+
+    invoice = Invoice.objects.filter(pk=invoice_id, has_pdf=True).only("id").first()
+    if invoice is None:
+        return None
+
+    expires = getattr(settings, "PDF_URL_EXPIRES", 3600)
+    url = pdf_s3_client().generate_presigned_url(
+        "get_object",
+        Params={
+            "Bucket": settings.AWS_STORAGE_BUCKET_NAME,
+            "Key": f"{settings.PDFFILES_LOCATION}/{invoice.get_pdf_filename()}",
+        },
+        ExpiresIn=expires,
+    )
+    ttl = expires - getattr(settings, "PDF_URL_CACHE_MARGIN", 300)
+    if ttl > 0:
+        cache.set(_cache_key(invoice_id), url, ttl)
+    return url
+
+
+def invalidate_pdf_url(invoice_id: int) -> None:
+    cache.delete(_cache_key(invoice_id))
@@ -0,0 +1,154 @@
+"""
+Push notifications for ``TaskStatus`` transitions.
+
+``TaskStatus.mark_started/mark_completed/mark_failed`` call
+``notify_tasks_changed`` after commit: the cached status payload is dropped
+and the task ID is published on a Redis channel. The SSE and long-poll views
+wait on that channel instead of making the client poll.
+
+Every ASGI process keeps a single pattern subscription and fans messages out
+to its local waiters, so 1k open streams cost one Redis connection, not 1k.
+Messages carry only the task ID; waiters re-read the payload through
+``status_lookup``, where the first one refills the cache for the rest.
+
+Without ``REDIS_URL`` waiters fall back to re-reading the status every
+``PDF_EVENTS_POLL_INTERVAL`` seconds.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set
+from weakref import WeakKeyDictionary
+
+import redis
+import redis.asyncio
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = "pdf-status:"
+
+_client: Optional[redis.Redis] = None
+
+
+def _redis_url() -> Optional[str]:
+    return getattr(settings, "REDIS_URL", None)
+
+
+def _related_task_ids(task_id: str) -> List[str]:
+    # Строка batch-задачи "<batch id>:<invoice id>" меняет и статус самого batch
+    task_ids = [task_id]
+    if ":" in task_id:
+        task_ids.append(task_id.rsplit(":", 1)[0])
+    return task_ids
+
+
+def notify_tasks_changed(task_ids: Iterable[str]) -> None:
+    """Drops cached status payloads and wakes everyone waiting on these tasks."""
+    from .status_lookup import CACHE_PREFIX
+
+    global _client
+    changed = list(dict.fromkeys(related for task_id in task_ids for related in _related_task_ids(task_id)))
+    if not changed:
+        return
+    cache.delete_many([CACHE_PREFIX + task_id for task_id in changed])
+
+    if not _redis_url():
+        return
+    try:
+        if _client is None:
+            _client = redis.Redis.from_url(_redis_url())
+        pipe = _client.pipeline(transaction=False)
+        for task_id in changed:
+            pipe.publish(CHANNEL_PREFIX + task_id, task_id)
+        pipe.execute()
+    except redis.RedisError:
+        logger.warning("📡 Не удалось опубликовать статусы задач %s", changed[:10], exc_info=True)
+
+
+class Subscription:
+    """Handle returned by ``subscribe``; ``wait`` resolves on the next change."""
+
+    def __init__(self, event: Optional[asyncio.Event]):
+        self._event = event
+
+    async def wait(self, timeout: float) -> bool:
+        """True when the status may have changed, False on timeout."""
+        if self._event is None:
+            await asyncio.sleep(min(timeout, getattr(settings, "PDF_EVENTS_POLL_INTERVAL", 2)))
+            return True
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self._event.clear()
+        return True
+
+
+class _Hub:
+    """One pattern subscription per event loop, fanned out to local waiters."""
+
+    def __init__(self):
+        self._waiters: Dict[str, Set[asyncio.Event]] = defaultdict(set)
+        self._reader: Optional[asyncio.Task] = None
+        self._ready = asyncio.Event()
+
+    async def _ensure_reader(self) -> None:
+        if self._reader is None or self._reader.done():
+            self._ready.clear()
+            self._reader = asyncio.create_task(self._listen())
+        # Подписка должна быть активна до того, как вызывающий прочитает текущий статус
+        await self._ready.wait()
+
+    async def _listen(self) -> None:
+        client = redis.asyncio.Redis.from_url(_redis_url())
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.psubscribe(CHANNEL_PREFIX + "*")
+            self._ready.set()
+            async for message in pubsub.listen():
+                task_id = message["channel"].decode()[len(CHANNEL_PREFIX):]
+                for event in self._waiters.get(task_id, ()):
+                    event.set()
+        except Exception:
+            logger.warning("📡 Подписка на статусы задач оборвалась", exc_info=True)
+        finally:
+            # Будим всех: они перечитают статус, следующая подписка поднимет reader заново
+            self._ready.set()
+            for events in self._waiters.values():
+                for event in events:
+                    event.set()
+            await pubsub.aclose()
+            await client.aclose()
+
+    @asynccontextmanager
+    async def subscribe(self, task_id: str) -> AsyncIterator[Subscription]:
+        event = asyncio.Event()
+        self._waiters[task_id].add(event)
+        try:
+            await self._ensure_reader()
+            yield Subscription(event)
+        finally:
+            self._waiters[task_id].discard(event)
+            if not self._waiters[task_id]:
+                del self._waiters[task_id]
+
+
+_hubs: "WeakKeyDictionary[asyncio.AbstractEventLoop, _Hub]" = WeakKeyDictionary()
+
+
+@asynccontextmanager
+async def subscribe(task_id: str) -> AsyncIterator[Subscription]:
+    """Listens for changes of ``task_id`` for the duration of the block."""
+    if not _redis_url():
+        yield Subscription(None)
+        return
+
+    loop = asyncio.get_running_loop()
+    hub = _hubs.get(loop)
+    if hub is None:
+        hub = _hubs[loop] = _Hub()
+    async with hub.subscribe(task_id) as subscription:
+        yield subscription
@@ -0,0 +1,62 @@
+"""
+Time-based heartbeat for running render tasks.
+
+``Heartbeat`` runs a daemon thread next to the render and bumps
+``TaskStatus.heartbeat_at`` with a single UPDATE every
+``PDF_HEARTBEAT_INTERVAL`` seconds, holding a database connection only for
+that UPDATE. A long WeasyPrint render keeps its row alive for
+``check_stuck_tasks``; a render shorter than the interval writes nothing at
+all.
+"""
+import logging
+import threading
+from typing import Optional
+
+from django.conf import settings
+from django.db import connection
+from django.utils.timezone import now
+
+from .models import TaskStatus
+
+logger = logging.getLogger(__name__)
+
+
+class Heartbeat:
+    """Context manager: ``with Heartbeat(task_status): render()``."""
+
+    def __init__(self, task_status: TaskStatus, interval: Optional[float] = None):
+        self.task_status_id = task_status.pk
+        self.interval = interval or getattr(settings, "PDF_HEARTBEAT_INTERVAL", 30)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "Heartbeat":
+        self._thread = threading.Thread(
+            target=self._run, name=f"heartbeat-{self.task_status_id}", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def beat(self) -> int:
+        # Только RUNNING: строку, уже помеченную stale/failed, не «оживляем»
+        return TaskStatus.objects.filter(
+            pk=self.task_status_id, status=TaskStatus.Status.RUNNING
+        ).update(heartbeat_at=now())
+
+    def _run(self) -> None:
+        try:
+            while not self._stop.wait(self.interval):
+                try:
+                    self.beat()
+                except Exception:
+                    logger.warning("💓 Не удалось обновить heartbeat для TaskStatus #%s", self.task_status_id, exc_info=True)
+                finally:
+                    # У потока своё соединение — отдаём его в пул сразу после UPDATE,
+                    # а не держим слот всё время рендера
+                    connection.close()
+        finally:
+            connection.close()
@@ -0,0 +1,163 @@
+"""
+Per-request and per-task DB instrumentation.
+
+``instrument()`` installs an ``execute_wrapper`` on every database connection
+of the current thread and counts queries, total SQL time and the slowest
+query. ``QueryMetricsMiddleware`` wraps each sync request with it, and the
+Celery ``task_prerun``/``task_postrun`` hooks below wrap each task. Results go
+to the ``backend.api.instrumentation`` logger as structured fields (JSON lines,
+see ``LOGGING`` in settings) and, for requests, to a ``Server-Timing`` header.
+
+A ``QUERY_METRICS_DUMP_SAMPLE_RATE`` share of requests and tasks also keep the
+full query list. When such a request takes longer than ``SLOW_REQUEST_MS`` (or a
+task longer than ``SLOW_TASK_MS``), the list is logged as a warning.
+"""
+import logging
+import random
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Any, Dict, Iterator, List, Tuple
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+SQL_PREVIEW = 500
+
+
+class QueryStats:
+    def __init__(self, capture: bool = False):
+        self.count = 0
+        self.sql_ms = 0.0
+        self.slowest_ms = 0.0
+        self.slowest_sql = ""
+        self.capture = capture
+        self.queries: List[Tuple[str, float]] = []
+        self.started = time.perf_counter()
+        self.wall_ms = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            self.count += 1
+            self.sql_ms += elapsed
+            if elapsed > self.slowest_ms:
+                self.slowest_ms, self.slowest_sql = elapsed, sql
+            if self.capture and len(self.queries) < getattr(settings, "QUERY_METRICS_DUMP_MAX", 200):
+                self.queries.append((sql, elapsed))
+
+    def fields(self) -> Dict[str, Any]:
+        return {
+            "db_queries": self.count,
+            "db_ms": round(self.sql_ms, 2),
+            "db_slowest_ms": round(self.slowest_ms, 2),
+            "db_slowest_sql": self.slowest_sql[:SQL_PREVIEW],
+            "wall_ms": round(self.wall_ms, 2),
+        }
+
+    def server_timing(self) -> str:
+        return (
+            f'db;dur={self.sql_ms:.1f};desc="{self.count} queries", '
+            f"db-slowest;dur={self.slowest_ms:.1f}, "
+            f"app;dur={self.wall_ms:.1f}"
+        )
+
+
+@contextmanager
+def instrument() -> Iterator[QueryStats]:
+    """Collects query stats for every connection of this thread until the block exits."""
+    stats = QueryStats(capture=random.random() < getattr(settings, "QUERY_METRICS_DUMP_SAMPLE_RATE", 0.1))
+    with ExitStack() as stack:
+        for conn in connections.all():
+            stack.enter_context(conn.execute_wrapper(stats))
+        try:
+            yield stats
+        finally:
+            stats.wall_ms = (time.perf_counter() - stats.started) * 1000
+
+
+def _dump_if_slow(kind: str, name: str, stats: QueryStats, threshold_ms: int, fields: Dict[str, Any]) -> None:
+    if not stats.capture or stats.wall_ms < threshold_ms:
+        return
+    logger.warning(
+        "🐢 Медленно: %s %s — %.0f ms, %d запросов к БД",
+        kind, name, stats.wall_ms, stats.count,
+        extra={
+            **fields,
+            "slow": True,
+            "queries": [{"sql": sql[:SQL_PREVIEW], "ms": round(ms, 2)} for sql, ms in stats.queries],
+        },
+    )
+
+
+class QueryMetricsMiddleware:
+    """
+    Logs query count, SQL time, the slowest query and wall time per view and
+    adds them as a ``Server-Timing`` header.
+
+    Async requests (SSE / long-poll on the ASGI server) pass through untouched:
+    their wall time is how long the client waited, and their queries run in
+    ``sync_to_async`` threads that a per-thread wrapper does not see.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async or not getattr(settings, "QUERY_METRICS_ENABLED", True):
+            return self.get_response(request)
+
+        with instrument() as stats:
+            response = self.get_response(request)
+
+        match = request.resolver_match
+        view = match.view_name if match else "unresolved"
+        fields = {
+            "view": view,
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            **stats.fields(),
+        }
+        logger.info("⏱ %s %s", request.method, view, extra=fields)
+        if getattr(settings, "SERVER_TIMING_HEADER", True):
+            response["Server-Timing"] = stats.server_timing()
+        _dump_if_slow("request", view, stats, getattr(settings, "SLOW_REQUEST_MS", 500), fields)
+        return response
+
+
+# task_id -> (ExitStack с обёртками соединений, статистика)
+_running_tasks: Dict[str, Tuple[ExitStack, QueryStats]] = {}
+
+
+@task_prerun.connect
+def _start_task_metrics(task_id=None, task=None, **kwargs):
+    if not getattr(settings, "QUERY_METRICS_ENABLED", True):
+        return
+    stack = ExitStack()
+    _running_tasks[task_id] = (stack, stack.enter_context(instrument()))
+
+
+@task_postrun.connect
+def _finish_task_metrics(task_id=None, task=None, state=None, **kwargs):
+    entry = _running_tasks.pop(task_id, None)
+    if entry is None:
+        return
+    stack, stats = entry
+    stack.close()
+
+    name = getattr(task, "name", "unknown")
+    fields = {"task": name, "task_id": task_id, "state": state, **stats.fields()}
+    logger.info("⏱ task %s", name, extra=fields)
+    _dump_if_slow("task", name, stats, getattr(settings, "SLOW_TASK_MS", 60000), fields)
@@ -0,0 +1,92 @@
+"""
+Serving PDFs from ``PDF_OUTPUT_DIR`` in local (non-S3) mode.
+
+With ``PDF_ACCEL_REDIRECT_LOCATION`` set, Django only checks that the invoice
+has a stored PDF and hands the transfer to nginx through ``X-Accel-Redirect``;
+nginx sends the file from an ``internal`` location with sendfile and handles
+Range, ETag and Last-Modified itself.
+
+Without it (runserver, no nginx in front) Django serves the file and honours
+conditional GET and single-range requests. The ETag has nginx's format
+(``"<mtime hex>-<size hex>"``), so a client's cached validator keeps working
+whichever side answers.
+"""
+import os
+import re
+from typing import Iterator
+
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+CHUNK_SIZE = 64 * 1024
+
+
+def accel_redirect_response(location: str, filename: str) -> HttpResponse:
+    response = HttpResponse(content_type="application/pdf")
+    response["X-Accel-Redirect"] = location.rstrip("/") + "/" + filename
+    response["Content-Disposition"] = f'inline; filename="{filename}"'
+    return response
+
+
+def _read_range(path: str, start: int, length: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+
+
+def _parse_range(header: str, size: int):
+    """(start, end) of a single satisfiable byte range, None to ignore, or False if unsatisfiable."""
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":
+        # bytes=-N — последние N байт
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def file_response(request, path: str, filename: str) -> HttpResponse:
+    """Serves ``path`` with ETag/Last-Modified validators and single-range support."""
+    stat = os.stat(path)
+    mtime, size = int(stat.st_mtime), stat.st_size
+    etag = '"%x-%x"' % (mtime, size)
+
+    response = get_conditional_response(request, etag=etag, last_modified=mtime)
+    if response is None:
+        byte_range = None
+        range_header = request.headers.get("Range")
+        if_range = request.headers.get("If-Range")
+        if range_header and (not if_range or if_range in (etag, http_date(mtime))):
+            byte_range = _parse_range(range_header, size)
+
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+        elif byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                _read_range(path, start, end - start + 1), status=206, content_type="application/pdf"
+            )
+            response["Content-Length"] = str(end - start + 1)
+            response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        else:
+            response = FileResponse(open(path, "rb"), content_type="application/pdf")
+        response["Content-Disposition"] = f'inline; filename="{filename}"'
+
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(mtime)
+    response["Accept-Ranges"] = "bytes"
+    return response
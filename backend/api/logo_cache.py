@@ -0,0 +1,194 @@
+"""
+Worker-side cache of invoice logos.
+
+Templates reference a logo as ``logo:<storage name>`` instead of its public
+S3 URL. ``WarmRenderer.url_fetcher`` resolves these through ``LogoCache``:
+
+1. an in-process LRU of the last ``LOGO_CACHE_MEMORY_ITEMS`` logos;
+2. files under ``LOGO_CACHE_DIR``, shared by every worker process on the host
+   and evicted least-recently-used once they exceed ``LOGO_CACHE_MAX_BYTES``;
+3. a GetObject from the logo bucket.
+
+An entry is the logo's storage name plus the S3 ETag it was downloaded with.
+``LogoStorage`` never overwrites names, so an entry normally stays valid for
+good. After ``LOGO_CACHE_REVALIDATE_SECONDS`` it is still revalidated with a
+conditional GET (``If-None-Match``), which costs no body transfer when the
+object is unchanged.
+
+Hits, downloads and the bytes that did not have to be downloaded are exported
+as Prometheus counters (``logo_cache_*``).
+"""
+import hashlib
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import quote, unquote
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+
+from backend.storage_backends import pdf_s3_client
+from .metrics import LOGO_CACHE_BYTES_DOWNLOADED, LOGO_CACHE_BYTES_SAVED, LOGO_CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+LOGO_SCHEME = "logo:"
+
+
+def logo_url(name: str) -> str:
+    """URL to put into the template for a logo stored under ``name``."""
+    return LOGO_SCHEME + quote(name)
+
+
+class LogoCache:
+    def __init__(self, directory: Path, max_bytes: int, memory_items: int, revalidate_after: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.revalidate_after = revalidate_after
+        # name -> (etag, данные, mime_type)
+        self._memory: "OrderedDict[str, Tuple[str, bytes, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"memory": 0, "disk": 0, "revalidated": 0, "download": 0, "bytes_saved": 0}
+
+    def fetch(self, url: str) -> Dict[str, Any]:
+        """WeasyPrint ``url_fetcher`` result for a ``logo:`` URL."""
+        name = unquote(url[len(LOGO_SCHEME):])
+        _, data, mime_type = self.get(name)
+        return {"string": data, "mime_type": mime_type, "redirected_url": url}
+
+    def get(self, name: str) -> Tuple[str, bytes, str]:
+        with self._lock:
+            entry = self._memory.get(name)
+            if entry is not None:
+                self._memory.move_to_end(name)
+        if entry is not None:
+            self._count("memory", len(entry[1]))
+            return entry
+
+        entry = self._from_disk(name)
+        if entry is None:
+            entry = self._download(name)
+
+        with self._lock:
+            self._memory[name] = entry
+            self._memory.move_to_end(name)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+        return entry
+
+    # --- диск ---
+
+    def _paths(self, name: str) -> Tuple[Path, Path]:
+        key = hashlib.sha256(name.encode("utf-8")).hexdigest()
+        return self.directory / f"{key}.bin", self.directory / f"{key}.etag"
+
+    def _from_disk(self, name: str) -> Optional[Tuple[str, bytes, str]]:
+        data_path, etag_path = self._paths(name)
+        try:
+            etag = etag_path.read_text()
+            data = data_path.read_bytes()
+            validated_at = etag_path.stat().st_mtime
+        except OSError:
+            return None
+
+        if time.time() - validated_at > self.revalidate_after:
+            fresh = self._download(name, etag=etag)
+            if fresh is not None:
+                return fresh
+            self._count("revalidated", len(data))
+            etag_path.touch()
+        else:
+            self._count("disk", len(data))
+
+        # Время доступа для LRU-вытеснения
+        os.utime(data_path)
+        return etag, data, _mime_type(name)
+
+    def _store(self, name: str, etag: str, data: bytes) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        data_path, etag_path = self._paths(name)
+        # Запись во временный файл и os.replace: другие процессы не увидят половину файла
+        for path, content in ((data_path, data), (etag_path, etag.encode("utf-8"))):
+            fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.replace(tmp, path)
+        self._evict()
+
+    def _evict(self) -> None:
+        files = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".bin"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            for victim in (path, path[:-len(".bin")] + ".etag"):
+                try:
+                    os.remove(victim)
+                except FileNotFoundError:
+                    pass
+            total -= size
+
+    # --- S3 ---
+
+    def _download(self, name: str, etag: Optional[str] = None) -> Optional[Tuple[str, bytes, str]]:
+        """GetObject; with ``etag`` returns None if the stored copy is still current (304)."""
+        params = {"Bucket": settings.AWS_STORAGE_BUCKET_NAME, "Key": f"{settings.LOGOFILES_LOCATION}/{name}"}
+        if etag:
+            params["IfNoneMatch"] = etag
+        try:
+            response = pdf_s3_client().get_object(**params)
+        except ClientError as e:
+            if etag and e.response.get("Error", {}).get("Code") in ("304", "NotModified"):
+                return None
+            raise
+
+        data = response["Body"].read()
+        new_etag = response.get("ETag", "")
+        self._count("download", 0)
+        LOGO_CACHE_BYTES_DOWNLOADED.inc(len(data))
+        self._store(name, new_etag, data)
+        logger.info("🖼️ Логотип %s загружен в кэш (%s байт)", name, len(data))
+        return new_etag, data, response.get("ContentType") or _mime_type(name)
+
+    def _count(self, result: str, saved: int) -> None:
+        LOGO_CACHE_REQUESTS.labels(result).inc()
+        self.stats[result] += 1
+        if saved:
+            LOGO_CACHE_BYTES_SAVED.inc(saved)
+            self.stats["bytes_saved"] += saved
+
+    def hit_rate(self) -> float:
+        hits = self.stats["memory"] + self.stats["disk"] + self.stats["revalidated"]
+        total = hits + self.stats["download"]
+        return hits / total if total else 0.0
+
+
+def _mime_type(name: str) -> str:
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+_cache: Optional[LogoCache] = None
+
+
+def get_logo_cache() -> LogoCache:
+    global _cache
+    if _cache is None:
+        _cache = LogoCache(
+            Path(getattr(settings, "LOGO_CACHE_DIR", None) or Path(tempfile.gettempdir()) / "invoice-logo-cache"),
+            max_bytes=getattr(settings, "LOGO_CACHE_MAX_BYTES", 256 * 1024 * 1024),
+            memory_items=getattr(settings, "LOGO_CACHE_MEMORY_ITEMS", 32),
+            revalidate_after=getattr(settings, "LOGO_CACHE_REVALIDATE_SECONDS", 86400),
+        )
+    return _cache
@@ -0,0 +1,115 @@
+"""
+Render-ready logo variants.
+
+The report shows the logo at ``max-height: 80px`` (report_template.css), but
+uploads are arbitrary JPEG/PNG/SVG files, often thousands of pixels wide.
+``ensure_logo_variant`` reads the original once and stores a copy for the
+renderer next to it in ``LogoStorage`` (``render/<name>-<height>h.<ext>``):
+
+* rasters are decoded at reduced scale where the format allows it (JPEG
+  draft mode), EXIF-rotated and downscaled to at most
+  ``LOGO_RENDER_HEIGHT`` x ``LOGO_RENDER_MAX_WIDTH`` (2x the displayed size,
+  so print stays sharp); images are never upscaled;
+* SVGs are rasterised with cairosvg at the same height;
+* transparent images are written as optimised PNG, opaque ones as whichever of
+  optimised PNG and JPEG is smaller (flat-colour logos compress better as PNG).
+
+The variant's name, size and the original it was made from are recorded on
+the invoice; ``Invoice.render_logo()`` falls back to the original until the
+variant matches the current upload. Variants are only built by the
+``preprocess_logo`` task, never on the render path; a logo that cannot be
+processed is recorded with an empty variant and is not retried until a new
+logo is uploaded.
+"""
+import io
+import logging
+from pathlib import PurePosixPath
+from typing import Tuple
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from .models import Invoice
+
+logger = logging.getLogger(__name__)
+
+
+def _target_size() -> Tuple[int, int]:
+    return getattr(settings, "LOGO_RENDER_MAX_WIDTH", 640), getattr(settings, "LOGO_RENDER_HEIGHT", 160)
+
+
+def _rasterise_svg(data: bytes, height: int) -> bytes:
+    import cairosvg
+
+    return cairosvg.svg2png(bytestring=data, output_height=height)
+
+
+def build_variant(data: bytes, name: str) -> Tuple[bytes, str, int, int]:
+    """Returns (encoded image, extension, width, height) of the render-ready variant."""
+    max_width, max_height = _target_size()
+    if name.lower().endswith(".svg"):
+        data = _rasterise_svg(data, max_height)
+
+    image = Image.open(io.BytesIO(data))
+    # JPEG декодируется сразу в уменьшенном масштабе (1/2, 1/4, 1/8) — без полного декодирования
+    image.draft("RGB", (max(max_width, max_height),) * 2)
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
+
+    has_alpha = image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+    if not has_alpha and image.mode not in ("RGB", "L", "P"):
+        image = image.convert("RGB")
+
+    candidates = []
+    png = io.BytesIO()
+    image.save(png, "PNG", optimize=True)
+    candidates.append((png.getvalue(), "png"))
+    if not has_alpha:
+        jpeg = io.BytesIO()
+        image.convert("RGB").save(jpeg, "JPEG", quality=getattr(settings, "LOGO_RENDER_JPEG_QUALITY", 85), optimize=True)
+        candidates.append((jpeg.getvalue(), "jpg"))
+
+    encoded, ext = min(candidates, key=lambda candidate: len(candidate[0]))
+    return encoded, ext, image.width, image.height
+
+
+def variant_name(original: str, height: int, ext: str) -> str:
+    path = PurePosixPath(original)
+    return str(PurePosixPath("render") / f"{path.stem}-{height}h.{ext}")
+
+
+def ensure_logo_variant(invoice: Invoice) -> bool:
+    """Builds and stores the variant unless the current logo was already processed. True if built."""
+    if not invoice.logo or not invoice.logo.name or invoice.logo_render_source == invoice.logo.name:
+        return False
+
+    source = invoice.logo.name
+    with invoice.logo.open("rb") as f:
+        original = f.read()
+    encoded, ext, width, height = build_variant(original, source)
+
+    storage = Invoice._meta.get_field("logo_render").storage
+    name = storage.save(variant_name(source, _target_size()[1], ext), ContentFile(encoded))
+
+    # UPDATE только если логотип не сменили, пока строили вариант; без post_save
+    Invoice.objects.filter(pk=invoice.pk, logo=source).update(
+        logo_render=name, logo_render_source=source, logo_width=width, logo_height=height
+    )
+    invoice.logo_render.name = name
+    invoice.logo_render_source, invoice.logo_width, invoice.logo_height = source, width, height
+    logger.info(
+        "🖼️ Invoice #%s: логотип %s → %s (%sx%s, %s → %s байт)",
+        invoice.pk, source, name, width, height, len(original), len(encoded),
+    )
+    return True
+
+
+def record_variant_failure(invoice: Invoice) -> None:
+    """Marks the current logo as processed without a variant: renders use the original."""
+    source = invoice.logo.name
+    Invoice.objects.filter(pk=invoice.pk, logo=source).update(
+        logo_render="", logo_render_source=source, logo_width=None, logo_height=None
+    )
+    invoice.logo_render.name = ""
+    invoice.logo_render_source, invoice.logo_width, invoice.logo_height = source, None, None
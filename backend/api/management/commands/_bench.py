@@ -0,0 +1,89 @@
+"""Helpers shared by the benchmark management commands."""
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, List
+
+from django.core.management.base import CommandError
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def measure(fn: Callable[[], object], iterations: int) -> List[float]:
+    """Runs ``fn`` ``iterations`` times and returns latencies in milliseconds."""
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+def latency_row(label: str, latencies: List[float]) -> str:
+    return (
+        f"{label:<24} n={len(latencies):<5} "
+        f"p50={percentile(latencies, 50):9.1f} ms  p95={percentile(latencies, 95):9.1f} ms"
+    )
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, process: subprocess.Popen, name: str, timeout: float = 15) -> None:
+    """Blocks until ``process`` accepts connections on ``port``."""
+    deadline = time.monotonic() + timeout
+    while True:
+        if process.poll() is not None:
+            raise CommandError(f"{name} exited with code {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise CommandError(f"{name} did not start")
+            time.sleep(0.1)
+
+
+@contextmanager
+def moto_s3_server(bucket: str) -> Iterator[str]:
+    """
+    Runs a moto S3 server in a subprocess and yields its endpoint URL.
+
+    A separate process keeps moto's own copies of uploaded objects out of the
+    benchmarked process, so memory measurements only see the client side.
+    """
+    try:
+        import boto3
+        import moto.server  # noqa: F401
+    except ImportError:
+        raise CommandError("moto is required for this benchmark: pip install 'moto[server]'")
+
+    for var in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        os.environ.setdefault(var, "testing")
+
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "moto.server", "-H", "127.0.0.1", "-p", str(port)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    endpoint_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_for_port(port, server, "moto server")
+        boto3.client("s3", region_name="us-east-1", endpoint_url=endpoint_url).create_bucket(Bucket=bucket)
+        yield endpoint_url
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
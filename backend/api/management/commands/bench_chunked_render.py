@@ -0,0 +1,95 @@
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.template.loader import get_template
+from django.test import override_settings
+
+from .bench_render import sample_context
+
+MODES = ("single", "chunked")
+
+
+def _max_rss_mb(who: int) -> float:
+    # ru_maxrss в килобайтах (Linux); для RUSAGE_CHILDREN — самый большой из завершённых потомков
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares one WeasyPrint document with the chunked render (parts on the "
+        "renderer pool, merged with pypdf) for invoices with 1k/10k/50k items. "
+        "Every measurement runs in a fresh process; prints wall time and peak RSS "
+        "of the task process and of the largest renderer process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--items", type=int, nargs="+", default=[1000, 10000, 50000])
+        parser.add_argument("--pool-size", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--chunk-items", type=int, default=None, help="Default: PDF_CHUNK_ITEMS")
+        parser.add_argument("--measure", choices=MODES, help="Internal: run one measurement in this process")
+
+    def handle(self, *args, **options):
+        chunk_items = options["chunk_items"] or getattr(settings, "PDF_CHUNK_ITEMS", 2000)
+        if options["measure"]:
+            self._measure(options["measure"], options["items"][0], options["pool_size"], chunk_items)
+            return
+
+        self.stdout.write(
+            f"pool of {options['pool_size']} renderer process(es), {chunk_items} items per part\n"
+            f"{'items':>7}  {'mode':<8} {'pages':>6} {'wall':>9} {'task RSS':>10} {'renderer RSS':>13}"
+        )
+        for items in options["items"]:
+            for mode in MODES:
+                command = [
+                    sys.executable, str(settings.BASE_DIR.parent / "manage.py"), "bench_chunked_render",
+                    "--measure", mode, "--items", str(items),
+                    "--pool-size", str(options["pool_size"]), "--chunk-items", str(chunk_items),
+                ]
+                done = subprocess.run(command, capture_output=True, text=True)
+                if done.returncode:
+                    raise CommandError(f"{mode} render of {items} items failed:\n{done.stderr[-2000:]}")
+                result = json.loads(done.stdout.strip().splitlines()[-1])
+                renderer_rss = f"{result['renderer_rss_mb']:10.0f} MB" if result["renderer_rss_mb"] else f"{'—':>13}"
+                self.stdout.write(
+                    f"{items:>7}  {mode:<8} {result['pages']:>6} {result['wall_s']:8.1f}s "
+                    f"{result['task_rss_mb']:7.0f} MB {renderer_rss}"
+                )
+
+    def _measure(self, mode: str, items: int, pool_size: int, chunk_items: int) -> None:
+        from pypdf import PdfReader
+
+        from backend.api.chunked_render import render_chunked_to_file
+        from backend.api.renderer import get_pool, get_renderer, shutdown_pool
+        from backend.api.tasks import REPORT_TEMPLATE
+
+        template = get_template(REPORT_TEMPLATE)
+        context = sample_context(items)
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as output:
+            started = time.perf_counter()
+            if mode == "single":
+                get_renderer().render(template.render(context), target=output.name)
+            else:
+                with override_settings(PDF_RENDER_POOL_SIZE=pool_size, PDF_CHUNK_ITEMS=chunk_items):
+                    pool = get_pool()
+                    render_chunked_to_file(template, context, output)
+                    output.flush()
+                if pool is not None:
+                    # Дождаться выхода процессов пула, чтобы их пик попал в RUSAGE_CHILDREN
+                    pool.shutdown(wait=True)
+                    shutdown_pool()
+            wall = time.perf_counter() - started
+            pages = len(PdfReader(output.name).pages)
+
+        self.stdout.write(json.dumps({
+            "wall_s": wall,
+            "pages": pages,
+            "task_rss_mb": _max_rss_mb(resource.RUSAGE_SELF),
+            "renderer_rss_mb": _max_rss_mb(resource.RUSAGE_CHILDREN),
+        }))
@@ -0,0 +1,153 @@
+import http.client
+import os
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+from typing import Dict, Iterator, List
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ._bench import free_port, latency_row, percentile, wait_for_port
+
+SERVERS = ("runserver", "gunicorn")
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-tests GET /api/invoices/ over keep-alive connections against "
+        "`manage.py runserver` and against gunicorn with gunicorn.conf.py, each "
+        "started as a subprocess on a free port, and reports RPS and latency "
+        "percentiles. Seeded invoices are deleted afterwards. The load generator "
+        "runs on the same machine, so compare servers with each other, not with production."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--invoices", type=int, default=200)
+        parser.add_argument("--items", type=int, default=5, help="Items per invoice")
+        parser.add_argument("--concurrency", type=int, default=16, help="Client threads")
+        parser.add_argument("--duration", type=float, default=15, help="Seconds of load per server")
+        parser.add_argument("--warmup", type=float, default=2, help="Seconds of unmeasured load first")
+        parser.add_argument("--path", default="/api/invoices/?page_size=20")
+        parser.add_argument("--servers", default=",".join(SERVERS))
+        parser.add_argument("--workers", type=int, help="Overrides GUNICORN_WORKERS")
+
+    def handle(self, *args, **options):
+        servers = [name for name in options["servers"].split(",") if name]
+        unknown = set(servers) - set(SERVERS)
+        if unknown:
+            raise CommandError(f"Unknown servers: {', '.join(sorted(unknown))}")
+
+        invoice_ids = self._seed(options["invoices"], options["items"])
+        try:
+            results = {}
+            for name in servers:
+                with self._server(name, options) as port:
+                    self._load(port, options, options["warmup"])
+                    results[name] = self._load(port, options, options["duration"])
+                self._report(name, results[name], options["duration"])
+            if len(results) == len(SERVERS) and results["runserver"]["latencies"]:
+                base, tuned = (len(results[name]["latencies"]) for name in SERVERS)
+                self.stdout.write(f"gunicorn / runserver RPS: {tuned / base:.2f}x")
+        finally:
+            self._cleanup(invoice_ids)
+
+    def _seed(self, invoices: int, items: int) -> List[int]:
+        from ... import denorm
+        from ...models import Customer, Invoice, InvoiceItem, TaskStatus
+
+        # Данные коммитятся: серверы в подпроцессах должны их видеть
+        customer = Customer.objects.create(name="HTTP benchmark")
+        created = Invoice.objects.bulk_create(
+            Invoice(customer=customer, company_name="Benchmark Sp. z o.o.", address="ul. Testowa 1")
+            for _ in range(invoices)
+        )
+        InvoiceItem.objects.bulk_create(
+            InvoiceItem(invoice=invoice, name=f"Item {n}", quantity=n + 1, unit_price=Decimal("19.99"))
+            for invoice in created
+            for n in range(items)
+        )
+        ids = [invoice.id for invoice in created]
+        denorm.refresh(Invoice, InvoiceItem, TaskStatus, Invoice.objects.filter(id__in=ids))
+        return ids
+
+    def _cleanup(self, invoice_ids: List[int]) -> None:
+        from ...models import Customer, Invoice
+
+        Invoice.objects.filter(id__in=invoice_ids).delete()
+        Customer.objects.filter(name="HTTP benchmark", invoices__isnull=True).delete()
+
+    @contextmanager
+    def _server(self, name: str, options) -> Iterator[int]:
+        root = settings.BASE_DIR.parent
+        port = free_port()
+        env = dict(os.environ)
+        if name == "runserver":
+            command = [sys.executable, str(root / "manage.py"), "runserver", "--noreload", f"127.0.0.1:{port}"]
+        else:
+            command = [
+                sys.executable, "-m", "gunicorn", "-c", str(root / "gunicorn.conf.py"),
+                "--bind", f"127.0.0.1:{port}", "backend.wsgi:application",
+            ]
+            if options["workers"]:
+                env["GUNICORN_WORKERS"] = str(options["workers"])
+
+        process = subprocess.Popen(
+            command, cwd=root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            wait_for_port(port, process, name, timeout=30)
+            yield port
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=35)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+    def _load(self, port: int, options, duration: float) -> Dict[str, object]:
+        latencies: List[float] = []
+        errors = {"n": 0}
+        lock = threading.Lock()
+        deadline = time.monotonic() + duration
+
+        def client():
+            # Одно keep-alive соединение на поток; http.client переоткрывает его сам после Connection: close
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            local, failed = [], 0
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    conn.request("GET", options["path"], headers={"Host": "localhost"})
+                    response = conn.getresponse()
+                    response.read()
+                    ok = response.status == 200
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    ok = False
+                if ok:
+                    local.append((time.perf_counter() - started) * 1000)
+                else:
+                    failed += 1
+            conn.close()
+            with lock:
+                latencies.extend(local)
+                errors["n"] += failed
+
+        threads = [threading.Thread(target=client) for _ in range(options["concurrency"])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return {"latencies": latencies, "errors": errors["n"]}
+
+    def _report(self, name: str, result: Dict[str, object], duration: float) -> None:
+        latencies = result["latencies"]
+        self.stdout.write(
+            f"{latency_row(name, latencies)}  p99={percentile(latencies, 99):9.1f} ms  "
+            f"rps={len(latencies) / duration:8.1f}  errors={result['errors']}"
+        )
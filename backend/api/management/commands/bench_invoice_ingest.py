@@ -0,0 +1,64 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.test import APIClient
+
+
+def sample_invoice(n: int, items: int) -> dict:
+    return {
+        "company_name": "Benchmark Sp. z o.o.",
+        "address": "ul. Testowa 1, Warszawa",
+        "customer": {
+            "name": f"Customer {n % 50}",
+            "email": f"customer{n % 50}@example.com",
+            "phone": "",
+            "address": "",
+        },
+        "items": [{"name": f"Item {i}", "quantity": i + 1, "unit_price": "19.99"} for i in range(items)],
+    }
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures invoices/sec for POST /api/invoices/ (one invoice per request) vs "
+        "POST /api/invoices/bulk/. Every run is rolled back, so no rows or renders are left behind."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--invoices", type=int, default=500)
+        parser.add_argument("--items", type=int, default=5, help="Items per invoice")
+        parser.add_argument("--chunk", type=int, default=500, help="Invoices per bulk request")
+
+    def handle(self, *args, **options):
+        payload = [sample_invoice(n, options["items"]) for n in range(options["invoices"])]
+        client = APIClient()
+
+        def single():
+            for invoice in payload:
+                response = client.post("/api/invoices/", invoice, format="json")
+                assert response.status_code == 201, response.content
+
+        def bulk():
+            chunk = options["chunk"]
+            for start in range(0, len(payload), chunk):
+                response = client.post("/api/invoices/bulk/", payload[start:start + chunk], format="json")
+                assert response.status_code == 201, response.content
+
+        for label, fn in (("POST /api/invoices/", single), ("POST /api/invoices/bulk/", bulk)):
+            elapsed = self._timed_and_rolled_back(fn)
+            self.stdout.write(f"{label:<26} {len(payload) / elapsed:10.1f} invoices/sec  ({elapsed:.2f} s)")
+
+    def _timed_and_rolled_back(self, fn) -> float:
+        started = time.perf_counter()
+        try:
+            with transaction.atomic():
+                fn()
+                elapsed = time.perf_counter() - started
+                raise _Rollback
+        except _Rollback:
+            return elapsed
@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from weasyprint import default_url_fetcher
+
+from ._bench import latency_row, measure, moto_s3_server
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares fetching an invoice logo the old way (WeasyPrint's default fetcher "
+        "on the public S3 URL) with LogoCache (memory, disk in a new process, "
+        "download), against a local moto S3 server. Prints hit rate and bytes saved."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--logo-kb", type=int, default=300, help="Size of the test logo")
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--bucket", default="bench-logos")
+
+    def handle(self, *args, **options):
+        import boto3
+
+        from backend import storage_backends
+        from ...logo_cache import LogoCache, logo_url
+
+        directory = Path(tempfile.mkdtemp(prefix="logo-cache-bench-"))
+        with moto_s3_server(options["bucket"]) as endpoint_url, override_settings(
+            AWS_STORAGE_BUCKET_NAME=options["bucket"],
+            AWS_S3_REGION_NAME="us-east-1",
+            AWS_S3_ENDPOINT_URL=endpoint_url,
+        ):
+            storage_backends._pdf_client = None
+            name = "acme.png"
+            key = f"invoices/logos/{name}"
+            boto3.client("s3", region_name="us-east-1", endpoint_url=endpoint_url).put_object(
+                Bucket=options["bucket"], Key=key, Body=os.urandom(options["logo_kb"] * 1024),
+                ContentType="image/png", ACL="public-read",
+            )
+            public_url = f"{endpoint_url}/{options['bucket']}/{key}"
+            url = logo_url(name)
+            n = options["requests"]
+
+            def old_path():
+                result = default_url_fetcher(public_url)
+                result["file_obj"].read()
+                result["file_obj"].close()
+
+            def make_cache():
+                return LogoCache(directory, max_bytes=64 * 1024 * 1024, memory_items=32, revalidate_after=86400)
+
+            def download():
+                shutil.rmtree(directory, ignore_errors=True)
+                make_cache().fetch(url)
+
+            try:
+                self.stdout.write(latency_row("public URL (before)", measure(old_path, n)))
+                self.stdout.write(latency_row("cache miss (download)", measure(download, n)))
+                # Новый экземпляр на каждый вызов — как первый рендер в свежем процессе
+                self.stdout.write(latency_row("disk hit", measure(lambda: make_cache().fetch(url), n)))
+
+                cache = make_cache()
+                self.stdout.write(latency_row("memory hit", measure(lambda: cache.fetch(url), n)))
+                stats = cache.stats
+                self.stdout.write(
+                    f"steady state: hit rate {cache.hit_rate():.1%}, "
+                    f"{stats['bytes_saved'] / 1024 / 1024:.1f} MB not downloaded "
+                    f"({stats['download']} download(s), {stats['disk']} disk, {stats['memory']} memory hits)"
+                )
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
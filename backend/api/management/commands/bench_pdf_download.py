@@ -0,0 +1,99 @@
+from unittest import mock
+
+from botocore.endpoint import Endpoint
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory, override_settings
+
+from ._bench import latency_row, measure, moto_s3_server
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares GET /api/download-pdf/<id>/ in S3 mode: the old path (new PDFStorage, "
+        "HEAD + presign per request) vs presigned URLs cached per invoice, against a "
+        "local moto S3 server. Counts S3 HTTP calls per request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--invoices", type=int, default=50)
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--bucket", default="bench-pdfs")
+
+    def handle(self, *args, **options):
+        with moto_s3_server(options["bucket"]) as endpoint_url, override_settings(
+            USE_S3=True,
+            AWS_STORAGE_BUCKET_NAME=options["bucket"],
+            AWS_S3_REGION_NAME="us-east-1",
+            AWS_S3_ENDPOINT_URL=endpoint_url,
+        ):
+            try:
+                with transaction.atomic():
+                    self._run(options)
+                    raise _Rollback
+            except _Rollback:
+                pass
+
+    def _run(self, options) -> None:
+        from backend import storage_backends
+        from backend.storage_backends import PDFStorage
+        from ...models import Customer, Invoice
+        from ...views import download_pdf_view
+
+        storage_backends._pdf_client = None
+        storage = PDFStorage()
+        customer = Customer.objects.create(name="Benchmark")
+        invoices = Invoice.objects.bulk_create(
+            Invoice(customer=customer, company_name="Benchmark", address="-", has_pdf=True)
+            for _ in range(options["invoices"])
+        )
+        for invoice in invoices:
+            storage.save(invoice.get_pdf_filename(), ContentFile(b"%PDF-1.7 benchmark"))
+
+        ids = [invoices[n % len(invoices)].id for n in range(options["requests"])]
+        factory = RequestFactory()
+
+        def old_path(report_id):
+            # Прежний download_pdf_view: новый PDFStorage, HEAD и подпись на каждый запрос
+            storage = PDFStorage()
+            filename = f"report_{report_id}.pdf"
+            assert storage.exists(filename)
+            return storage.url(filename)
+
+        def new_path(report_id):
+            response = download_pdf_view(factory.get(f"/api/download-pdf/{report_id}/"), report_id)
+            assert response.status_code == 302
+            return response["Location"]
+
+        calls = {"n": 0}
+        send = Endpoint._send
+
+        def counting_send(endpoint, request):
+            calls["n"] += 1
+            return send(endpoint, request)
+
+        with mock.patch.object(Endpoint, "_send", counting_send):
+            for label, fn, cached in (
+                ("PDFStorage + HEAD", old_path, False),
+                ("presigned, cache miss", new_path, False),
+                ("presigned, cache hit", new_path, True),
+            ):
+                cache.clear()
+                for report_id in set(ids):
+                    new_path(report_id)
+                calls["n"] = 0
+                queue = iter(ids)
+
+                def request():
+                    if not cached:
+                        cache.clear()
+                    fn(next(queue))
+
+                latencies = measure(request, len(ids))
+                self.stdout.write(f"{latency_row(label, latencies)}  s3_calls/request={calls['n'] / len(ids):.2f}")
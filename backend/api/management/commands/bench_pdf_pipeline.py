@@ -0,0 +1,172 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, Optional
+
+from django.core.files.base import File
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+
+from backend.api.tasks import REPORT_TEMPLATE
+
+from ._bench import moto_s3_server
+from .bench_render import sample_context
+
+# Состояние процесса рендера/загрузки: тёплый рендерер и клиент S3 создаются один раз
+_state: Dict[str, object] = {}
+
+
+def _init(endpoint_url: str, bucket: str, upload_latency_ms: int, synthetic_render_ms: int) -> None:
+    _state.update(
+        endpoint_url=endpoint_url, bucket=bucket,
+        upload_latency=upload_latency_ms / 1000, synthetic_render=synthetic_render_ms / 1000,
+    )
+
+
+def _render(html: str, path: str) -> None:
+    if _state["synthetic_render"]:
+        # Замена WeasyPrint там, где его нет: столько же CPU, файл того же порядка размера
+        deadline = time.process_time() + _state["synthetic_render"]
+        while time.process_time() < deadline:
+            pass
+        Path(path).write_bytes(os.urandom(64 * 1024))
+        return
+
+    from backend.api.renderer import get_renderer
+
+    get_renderer().render(html, target=path)
+
+
+def _upload(path: str, name: str) -> None:
+    from backend.storage_backends import PDFStorage
+
+    storage = _state.get("storage")
+    if storage is None:
+        storage = _state["storage"] = PDFStorage(
+            bucket_name=_state["bucket"], endpoint_url=_state["endpoint_url"], region_name="us-east-1"
+        )
+    # moto на localhost отвечает за ~1 мс; задержка — сетевой путь до настоящего S3
+    time.sleep(_state["upload_latency"])
+    with open(path, "rb") as f:
+        storage.save(name, File(f, name=name))
+
+
+def _render_and_upload(html: str, directory: str, n: int) -> None:
+    """generate_pdf: render and upload one after another in the same process."""
+    path = os.path.join(directory, f"{n}.pdf")
+    _render(html, path)
+    _upload(path, f"bench_{n}.pdf")
+    os.remove(path)
+
+
+def _render_only(html: str, directory: str, n: int) -> str:
+    """render_pdf: render into the hand-off directory."""
+    path = os.path.join(directory, f"{n}.pdf")
+    _render(html, path)
+    return path
+
+
+def _store(path: str, n: int) -> None:
+    """store_pdf: upload from the hand-off directory."""
+    _upload(path, f"bench_{n}.pdf")
+    os.remove(path)
+
+
+def _cpu_count() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures invoices/minute per vCPU of generate_pdf (render then upload in the "
+        "same prefork process) against the render_pdf -> store_pdf pipeline (prefork "
+        "renderers hand files to an upload thread pool), against a local moto S3 server."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--invoices", type=int, default=200)
+        parser.add_argument("--items", type=int, default=30, help="Line items per invoice")
+        parser.add_argument("--render-processes", type=int, default=0, help="Prefork concurrency (default: vCPUs)")
+        parser.add_argument("--store-threads", type=int, default=16, help="Threads of the store_pdf worker")
+        parser.add_argument(
+            "--upload-latency-ms", type=int, default=40,
+            help="Added to every upload to stand in for the round trip to a real S3 region",
+        )
+        parser.add_argument(
+            "--synthetic-render-ms", type=int, default=0,
+            help="Burn this much CPU instead of calling WeasyPrint (0: real renders)",
+        )
+        parser.add_argument("--bucket", default="bench-pipeline")
+
+    def handle(self, *args, **options):
+        cpus = _cpu_count()
+        processes = options["render_processes"] or cpus
+        n = options["invoices"]
+        html = render_to_string(REPORT_TEMPLATE, sample_context(options["items"]))
+        directory = tempfile.mkdtemp(prefix="pdf-handoff-bench-")
+
+        with moto_s3_server(options["bucket"]) as endpoint_url:
+            initargs = (endpoint_url, options["bucket"], options["upload_latency_ms"], options["synthetic_render_ms"])
+
+            def run(pipeline: bool) -> float:
+                renderers = ProcessPoolExecutor(
+                    processes, mp_context=multiprocessing.get_context("fork"), initializer=_init, initargs=initargs
+                )
+                uploaders: Optional[ThreadPoolExecutor] = None
+                try:
+                    # Прогрев: шрифты, CSS и клиент S3 в каждом процессе до замера
+                    wait([renderers.submit(_render_and_upload, html, directory, -p - 1) for p in range(processes)])
+                    if pipeline:
+                        _init(*initargs)
+                        uploaders = self._warm_uploaders(options["store_threads"], html, directory)
+
+                    started = time.perf_counter()
+                    if not pipeline:
+                        wait([renderers.submit(_render_and_upload, html, directory, i) for i in range(n)])
+                    else:
+                        stored = []
+                        rendered = [renderers.submit(_render_only, html, directory, i) for i in range(n)]
+                        for i, future in enumerate(rendered):
+                            stored.append(uploaders.submit(_store, future.result(), i))
+                        wait(stored)
+                    return time.perf_counter() - started
+                finally:
+                    renderers.shutdown()
+                    if uploaders is not None:
+                        uploaders.shutdown()
+
+            try:
+                self.stdout.write(
+                    f"{n} invoices, {cpus} vCPU, {processes} render process(es), "
+                    f"{options['store_threads']} store threads, +{options['upload_latency_ms']} ms per upload"
+                    + (f", synthetic {options['synthetic_render_ms']} ms renders" if options["synthetic_render_ms"] else "")
+                )
+                for label, pipeline in (("generate_pdf", False), ("render_pdf -> store_pdf", True)):
+                    elapsed = run(pipeline)
+                    per_minute = n / elapsed * 60
+                    self.stdout.write(
+                        f"{label:<24} {elapsed:7.2f} s  {per_minute:8.0f} invoices/min  "
+                        f"{per_minute / cpus:8.0f} invoices/min/vCPU"
+                    )
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+
+    def _warm_uploaders(self, threads: int, html: str, directory: str) -> ThreadPoolExecutor:
+        """Thread pool in which every thread already has its own S3 connection (they are thread-local)."""
+        pool = ThreadPoolExecutor(threads)
+        barrier = threading.Barrier(threads)
+
+        def warm(n: int) -> None:
+            _store(_render_only(html, directory, n), n)
+            barrier.wait()
+
+        wait([pool.submit(warm, -1000 - t) for t in range(threads)])
+        return pool
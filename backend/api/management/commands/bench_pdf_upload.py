@@ -0,0 +1,65 @@
+import io
+import os
+import shutil
+import tempfile
+import tracemalloc
+from typing import Callable
+
+from django.conf import settings
+from django.core.files.base import ContentFile, File
+from django.core.management.base import BaseCommand
+
+from ._bench import moto_s3_server
+
+CHUNK = 1024 * 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares peak Python memory of the buffered (BytesIO + ContentFile) and the "
+        "streaming (spooled temp file) PDF upload paths against a local moto S3 server."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes-mb", type=int, nargs="+", default=[1, 16, 64])
+        parser.add_argument("--bucket", default="bench-pdfs")
+
+    def handle(self, *args, **options):
+        from backend.storage_backends import PDFStorage
+
+        with moto_s3_server(options["bucket"]) as endpoint_url:
+            storage = PDFStorage(bucket_name=options["bucket"], endpoint_url=endpoint_url, region_name="us-east-1")
+
+            self.stdout.write(f"{'size':>8}  {'buffered peak':>14}  {'streaming peak':>15}")
+            for size_mb in options["sizes_mb"]:
+                with tempfile.TemporaryFile() as rendered:
+                    # Имитация вывода WeasyPrint: size_mb мегабайт на диске
+                    for _ in range(size_mb):
+                        rendered.write(os.urandom(CHUNK))
+
+                    buffered = self._peak_mb(lambda: self._buffered_upload(storage, rendered))
+                    streaming = self._peak_mb(lambda: self._streaming_upload(storage, rendered))
+                self.stdout.write(f"{size_mb:>6} MB  {buffered:>11.1f} MB  {streaming:>12.1f} MB")
+
+    def _peak_mb(self, fn: Callable[[], None]) -> float:
+        tracemalloc.start()
+        try:
+            fn()
+            return tracemalloc.get_traced_memory()[1] / CHUNK
+        finally:
+            tracemalloc.stop()
+
+    def _buffered_upload(self, storage, rendered) -> None:
+        # Старый путь generate_pdf: BytesIO -> read() -> ContentFile
+        rendered.seek(0)
+        pdf_buffer = io.BytesIO()
+        shutil.copyfileobj(rendered, pdf_buffer)
+        pdf_buffer.seek(0)
+        storage.save("bench_buffered.pdf", ContentFile(pdf_buffer.read()))
+
+    def _streaming_upload(self, storage, rendered) -> None:
+        rendered.seek(0)
+        with tempfile.SpooledTemporaryFile(max_size=settings.PDF_SPOOL_MAX_MEMORY) as spool:
+            shutil.copyfileobj(rendered, spool)
+            spool.seek(0)
+            storage.save("bench_streaming.pdf", File(spool, name="bench_streaming.pdf"))
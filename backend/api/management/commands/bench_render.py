@@ -0,0 +1,59 @@
+from concurrent.futures import wait
+
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+
+from backend.api.renderer import WarmRenderer, _render_in_pool_worker, create_pool, get_renderer
+from backend.api.tasks import REPORT_TEMPLATE
+
+from ._bench import latency_row, measure
+
+
+def sample_context(items: int, logo_url: str = "") -> dict:
+    rows = [
+        {"name": f"Item {n}", "qty": n % 7 + 1, "price": 19.99, "total": round((n % 7 + 1) * 19.99, 2)}
+        for n in range(1, items + 1)
+    ]
+    return {
+        "invoice_id": 1,
+        "company": "Benchmark Sp. z o.o.",
+        "address": "ul. Testowa 1, Warszawa",
+        "date": "12:00:00, 01.01.2025",
+        "items": rows,
+        "total": round(sum(row["total"] for row in rows), 2),
+        "customer": {"name": "Jan Kowalski", "email": "jan@example.com", "phone": "", "address": ""},
+        "logo_path": logo_url,
+    }
+
+
+class Command(BaseCommand):
+    help = "Benchmarks cold vs warm WeasyPrint renders and prints p50/p95 latency."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=20)
+        parser.add_argument("--items", type=int, default=30, help="Line items per invoice")
+        parser.add_argument("--pool-size", type=int, default=2)
+        parser.add_argument("--logo-url", default="", help="Logo URL to exercise the fetcher cache")
+
+    def handle(self, *args, **options):
+        iterations = options["iterations"]
+        html = render_to_string(REPORT_TEMPLATE, sample_context(options["items"], options["logo_url"]))
+
+        # Холодный рендер: новые шрифты, CSS и кэш URL на каждый вызов
+        cold = measure(lambda: WarmRenderer().render(html), iterations)
+        self.stdout.write(latency_row("cold", cold))
+
+        renderer = get_renderer()
+        renderer.render(html)
+        warm = measure(lambda: renderer.render(html), iterations)
+        self.stdout.write(latency_row("warm (in-process)", warm))
+
+        pool_size = options["pool_size"]
+        if pool_size > 0:
+            pool = create_pool(pool_size)
+            try:
+                wait([pool.submit(_render_in_pool_worker, html, None) for _ in range(pool_size)])
+                pooled = measure(lambda: pool.submit(_render_in_pool_worker, html, None).result(), iterations)
+                self.stdout.write(latency_row(f"warm (pool x{pool_size})", pooled))
+            finally:
+                pool.shutdown()
@@ -0,0 +1,101 @@
+import heapq
+import math
+import random
+from typing import List, Tuple
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.api.render_cost import fit_cost_model
+
+from ._bench import percentile
+
+# (время поступления, позиции, логотип, фактическая длительность рендера)
+Job = Tuple[float, int, bool, float]
+
+
+def _waits(jobs: List[Job], workers: int) -> List[float]:
+    """Wait before start of every job on a FIFO queue served by ``workers`` workers."""
+    free_at = [0.0] * workers
+    heapq.heapify(free_at)
+    waits = []
+    for arrival, _, _, duration in jobs:
+        start = max(arrival, heapq.heappop(free_at))
+        heapq.heappush(free_at, start + duration)
+        waits.append(start - arrival)
+    return waits
+
+
+def _wait_row(label: str, waits: List[float]) -> str:
+    if not waits:
+        return f"{label:<30} n=0"
+    return (
+        f"{label:<30} n={len(waits):<6} p50={percentile(waits, 50):8.1f} s  "
+        f"p95={percentile(waits, 95):8.1f} s  p99={percentile(waits, 99):8.1f} s"
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulates mixed load (many small invoices, a few with thousands of items) and "
+        "prints small-invoice wait times for one shared queue vs fast/bulk routing by "
+        "the render cost estimate. No renders are run; durations are drawn from a "
+        "model with noise and the estimator is fitted on a simulated history."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--invoices", type=int, default=20000)
+        parser.add_argument("--workers", type=int, default=3, help="Render processes in total")
+        parser.add_argument("--bulk-workers", type=int, default=1, help="Of those, serving the bulk queue")
+        parser.add_argument("--load", type=float, default=0.7, help="Average utilisation of all workers")
+        parser.add_argument("--huge-share", type=float, default=0.01, help="Share of invoices with 1000-5000 items")
+        parser.add_argument("--fast-max-seconds", type=float, default=None)
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        if not 0 < options["bulk_workers"] < options["workers"]:
+            raise CommandError("--bulk-workers must be at least 1 and less than --workers")
+        rng = random.Random(options["seed"])
+        threshold = options["fast_max_seconds"] or getattr(settings, "PDF_FAST_MAX_SECONDS", 10)
+
+        def invoice() -> Tuple[int, bool, float]:
+            if rng.random() < options["huge_share"]:
+                items = rng.randint(1000, 5000)
+            else:
+                items = max(1, int(rng.lognormvariate(math.log(20), 0.8)))
+            has_logo = rng.random() < 0.6
+            # «Истинная» стоимость WeasyPrint с разбросом ±25%
+            duration = (0.4 + 0.015 * items + (0.15 if has_logo else 0.0)) * rng.lognormvariate(0, 0.25)
+            return items, has_logo, duration
+
+        model = fit_cost_model(invoice() for _ in range(2000))
+        self.stdout.write(f"fitted on simulated history: {model!r}")
+
+        sample = [invoice() for _ in range(options["invoices"])]
+        mean_duration = sum(duration for _, _, duration in sample) / len(sample)
+        rate = options["load"] * options["workers"] / mean_duration
+        jobs: List[Job] = []
+        clock = 0.0
+        for items, has_logo, duration in sample:
+            clock += rng.expovariate(rate)
+            jobs.append((clock, items, has_logo, duration))
+
+        is_bulk = [model.estimate(items, has_logo) > threshold for _, items, has_logo, _ in jobs]
+        is_small = [duration <= threshold for *_, duration in jobs]
+        misrouted = sum(bulk == small for bulk, small in zip(is_bulk, is_small))
+        self.stdout.write(
+            f"{len(jobs)} invoices, {sum(not small for small in is_small)} take > {threshold:g} s, "
+            f"{misrouted} routed to the wrong queue; {options['workers']} workers at {options['load']:.0%} load"
+        )
+
+        shared = _waits(jobs, options["workers"])
+        routed = [0.0] * len(jobs)
+        for bulk, workers in ((False, options["workers"] - options["bulk_workers"]), (True, options["bulk_workers"])):
+            indexes = [i for i, routed_bulk in enumerate(is_bulk) if routed_bulk == bulk]
+            for i, wait_seconds in zip(indexes, _waits([jobs[i] for i in indexes], workers)):
+                routed[i] = wait_seconds
+
+        for label, waits in (("one queue", shared), ("fast/bulk routing", routed)):
+            self.stdout.write(f"{label}:")
+            self.stdout.write("  " + _wait_row("small invoices", [w for w, s in zip(waits, is_small) if s]))
+            self.stdout.write("  " + _wait_row("large invoices", [w for w, s in zip(waits, is_small) if not s]))
@@ -0,0 +1,183 @@
+import asyncio
+import random
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.backends.signals import connection_created
+
+from ...models import Customer, Invoice, TaskStatus
+from ._bench import latency_row
+
+TERMINAL = (b'"SUCCESS"', b'"FAILURE"')
+
+
+class _QueryCounter:
+    """execute_wrapper that counts queries issued by the app, not by the task driver."""
+
+    def __init__(self):
+        self.count = 0
+        self.excluded: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        if threading.current_thread() is not self.excluded:
+            with self._lock:
+                self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+async def _asgi_get(app, path: str, headers=(), on_chunk=None) -> int:
+    """Minimal in-process ASGI client; returns the HTTP status."""
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "headers": [(b"host", b"localhost"), *headers],
+        "client": ("127.0.0.1", 50000),
+        "server": ("localhost", 80),
+    }
+    request_sent = False
+    never = asyncio.get_running_loop().create_future()
+    status = 0
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        return await never
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body" and on_chunk:
+            on_chunk(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares requests/sec and DB queries of 2s polling vs SSE for N concurrent "
+        "status waiters, driven in-process through the ASGI application. "
+        "Set REDIS_URL for the pub/sub path; without it SSE waiters poll the cache/DB."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--waiters", type=int, default=1000)
+        parser.add_argument("--window", type=float, default=20.0, help="Seconds over which tasks complete")
+        parser.add_argument("--poll-interval", type=float, default=2.0, help="Frontend polling interval")
+
+    def handle(self, *args, **options):
+        if not getattr(settings, "REDIS_URL", None):
+            self.stdout.write(self.style.WARNING("REDIS_URL is not set: SSE falls back to periodic re-reads."))
+
+        self.app = get_asgi_application()
+        self.counter = _QueryCounter()
+        connection_created.connect(self.counter.install)
+        self.counter.install(connection=connection)
+
+        prefix = f"bench-{uuid.uuid4().hex[:8]}"
+        customer = Customer.objects.create(name="Benchmark")
+        invoices = Invoice.objects.bulk_create(
+            Invoice(customer=customer, company_name="Benchmark", address="-") for _ in range(options["waiters"])
+        )
+        self.invoice_ids = [invoice.pk for invoice in invoices]
+        self.task_ids = [f"{prefix}-{n}" for n in range(len(invoices))]
+        try:
+            for label, client in (("polling", self._poller), ("sse", self._sse_client)):
+                self._run_mode(label, client, options)
+        finally:
+            connection_created.disconnect(self.counter.install)
+            Invoice.objects.filter(pk__in=self.invoice_ids).delete()
+            customer.delete()
+
+    def _run_mode(self, label: str, client, options) -> None:
+        TaskStatus.objects.filter(task_id__in=self.task_ids).delete()
+        TaskStatus.objects.bulk_create(
+            TaskStatus(invoice_id=invoice_id, task_id=task_id, status=TaskStatus.Status.RUNNING)
+            for invoice_id, task_id in zip(self.invoice_ids, self.task_ids)
+        )
+        cache.clear()
+
+        self.completed_at: Dict[str, float] = {}
+        self.seen_at: Dict[str, float] = {}
+        self.requests = 0
+        self.counter.count = 0
+
+        driver = threading.Thread(
+            target=self._complete_tasks, args=(options["window"], options["poll_interval"]), name="task-driver"
+        )
+        self.counter.excluded = driver
+
+        async def run():
+            started = time.perf_counter()
+            driver.start()
+            await asyncio.gather(*(client(task_id, options) for task_id in self.task_ids))
+            return time.perf_counter() - started
+
+        elapsed = asyncio.run(run())
+        driver.join()
+
+        latencies = [(self.seen_at[t] - self.completed_at[t]) * 1000 for t in self.task_ids if t in self.seen_at]
+        self.stdout.write(
+            f"{label:<8} waiters={len(self.task_ids)}  requests={self.requests:<6} "
+            f"({self.requests / elapsed:7.1f} req/s)  db_queries={self.counter.count:<6} "
+            f"({self.counter.count / elapsed:7.1f} q/s)  elapsed={elapsed:.1f}s"
+        )
+        self.stdout.write("         " + latency_row("completion -> client", latencies))
+
+    def _complete_tasks(self, window: float, warmup: float) -> None:
+        # Задачи завершаются равномерно в окне, как после пачки рендеров;
+        # первые warmup секунд клиенты успевают подключиться
+        schedule = sorted((warmup + random.uniform(0, window), task_id) for task_id in self.task_ids)
+        started = time.perf_counter()
+        try:
+            for at, task_id in schedule:
+                time.sleep(max(0.0, at - (time.perf_counter() - started)))
+                task = TaskStatus.objects.get(task_id=task_id)
+                self.completed_at[task_id] = time.perf_counter()
+                task.mark_completed()
+        finally:
+            connection.close()
+
+    async def _poller(self, task_id: str, options) -> None:
+        await asyncio.sleep(random.uniform(0, options["poll_interval"]))
+        body = bytearray()
+        while True:
+            body.clear()
+            self.requests += 1
+            await _asgi_get(self.app, f"/api/pdf-status/{task_id}/", on_chunk=body.extend)
+            if any(state in body for state in TERMINAL):
+                self.seen_at[task_id] = time.perf_counter()
+                return
+            await asyncio.sleep(options["poll_interval"])
+
+    async def _sse_client(self, task_id: str, options) -> None:
+        def on_chunk(chunk: bytes) -> None:
+            if any(state in chunk for state in TERMINAL):
+                self.seen_at.setdefault(task_id, time.perf_counter())
+
+        while task_id not in self.seen_at:
+            # Сервер закрывает поток по PDF_EVENTS_MAX_SECONDS — переподключаемся, как EventSource
+            self.requests += 1
+            await _asgi_get(self.app, f"/api/pdf-status/{task_id}/events/", on_chunk=on_chunk)
@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+
+from backend.api import denorm
+from backend.api.models import Invoice, InvoiceItem, TaskStatus
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfills and verifies the denormalised Invoice columns "
+        "(latest_task, latest_status, item_count, total) in id-range batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--verify-only",
+            action="store_true",
+            help="Only report invoices whose stored values differ from the computed ones",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        verify_only = options["verify_only"]
+        last_id = Invoice.objects.order_by("-id").values_list("id", flat=True).first() or 0
+
+        updated = mismatched = 0
+        for start in range(0, last_id, batch_size):
+            batch = Invoice.objects.filter(id__gt=start, id__lte=start + batch_size)
+            stale = self._mismatched(batch)
+            mismatched += len(stale)
+            if stale and not verify_only:
+                with transaction.atomic():
+                    updated += denorm.refresh(Invoice, InvoiceItem, TaskStatus, Invoice.objects.filter(id__in=stale))
+            self.stdout.write(f"ids {start + 1}-{min(start + batch_size, last_id)}: {len(stale)} mismatched")
+
+        if verify_only:
+            self.stdout.write(self.style.WARNING(f"{mismatched} invoice(s) out of sync") if mismatched
+                              else self.style.SUCCESS("All denormalised columns are in sync"))
+            return
+
+        remaining = sum(
+            len(self._mismatched(Invoice.objects.filter(id__gt=start, id__lte=start + batch_size)))
+            for start in range(0, last_id, batch_size)
+        )
+        style = self.style.SUCCESS if remaining == 0 else self.style.ERROR
+        self.stdout.write(style(f"Updated {updated} invoice(s); {remaining} still out of sync"))
+
+    def _mismatched(self, batch):
+        # Сравнение в SQL; NULL != значение обрабатываем отдельными условиями
+        computed = {f"computed_{name}": expr for name, expr in denorm.item_totals(InvoiceItem).items()}
+        computed.update({f"computed_{name}": expr for name, expr in denorm.latest_task(TaskStatus).items()})
+        return list(
+            batch.annotate(**computed)
+            .filter(
+                ~Q(item_count=F("computed_item_count"))
+                | ~Q(total=F("computed_total"))
+                | ~Q(latest_task=F("computed_latest_task"))
+                | ~Q(latest_status=F("computed_latest_status"))
+                | Q(latest_task__isnull=True, computed_latest_task__isnull=False)
+                | Q(latest_task__isnull=False, computed_latest_task__isnull=True)
+                | Q(latest_status__isnull=True, computed_latest_status__isnull=False)
+                | Q(latest_status__isnull=False, computed_latest_status__isnull=True)
+            )
+            .values_list("id", flat=True)
+        )
@@ -0,0 +1,178 @@
+"""
+Prometheus metrics for the PDF render pipeline.
+
+Render phases (``html`` template, ``weasyprint``, ``merge`` of the parts of a
+chunked render, ``upload``), PDF sizes, enqueue-to-start latency and Celery
+task durations are recorded where they happen. The number
+of tasks in every ``TaskStatus.Status`` is read from the database at scrape
+time by ``TaskStatusCollector``, so it is exact regardless of which process
+changed a row.
+
+With ``PROMETHEUS_MULTIPROC_DIR`` set (gunicorn workers, Celery prefork
+children) every process writes its samples to files in that directory and
+``registry()`` aggregates them. The directory must be empty when the server
+starts: ``gunicorn.conf.py`` (``on_starting``) and the Celery ``worker_init``
+hook below clear it, and dead processes are marked on exit. The Celery parent
+process serves the worker's metrics on ``CELERY_METRICS_PORT``; web processes
+serve theirs on ``/metrics``.
+"""
+import logging
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+from celery.signals import task_failure, task_postrun, task_prerun, worker_init, worker_process_shutdown
+from django.conf import settings
+from prometheus_client import CollectorRegistry, Counter, Histogram, multiprocess, start_http_server
+from prometheus_client.core import GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    # Метрики без меток открывают свой файл уже при создании — каталог нужен до этого
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+RENDER_PHASE_SECONDS = Histogram(
+    "pdf_render_phase_seconds",
+    "Time spent in each phase of a PDF render.",
+    ["phase"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+PDF_SIZE_BYTES = Histogram(
+    "pdf_size_bytes",
+    "Size of rendered PDFs.",
+    buckets=(16 * 1024, 64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2),
+)
+ENQUEUE_TO_START_SECONDS = Histogram(
+    "pdf_task_enqueue_to_start_seconds",
+    "Time from TaskStatus.created_at (enqueued) to started_at.",
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900, 3600),
+)
+RENDERS_TOTAL = Counter(
+    "pdf_renders_total",
+    "Finished invoice renders by outcome.",
+    ["outcome"],
+)
+CELERY_TASK_SECONDS = Histogram(
+    "celery_task_duration_seconds",
+    "Wall time of Celery tasks.",
+    ["task", "state"],
+    buckets=(0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900),
+)
+CELERY_TASK_FAILURES = Counter(
+    "celery_task_failures_total",
+    "Celery tasks that raised.",
+    ["task"],
+)
+LOGO_CACHE_REQUESTS = Counter(
+    "logo_cache_requests_total",
+    "Logo lookups by where they were served from (memory, disk, revalidated, download).",
+    ["result"],
+)
+LOGO_CACHE_BYTES_SAVED = Counter(
+    "logo_cache_bytes_saved_total",
+    "Logo bytes served from the worker cache instead of being downloaded.",
+)
+LOGO_CACHE_BYTES_DOWNLOADED = Counter(
+    "logo_cache_bytes_downloaded_total",
+    "Logo bytes downloaded from storage.",
+)
+
+
+@contextmanager
+def render_phase(phase: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        RENDER_PHASE_SECONDS.labels(phase).observe(time.perf_counter() - started)
+
+
+class TaskStatusCollector:
+    """Tasks per TaskStatus.Status, counted with one GROUP BY per scrape."""
+
+    def collect(self):
+        from django.db.models import Count
+
+        from .models import TaskStatus
+
+        gauge = GaugeMetricFamily("pdf_tasks", "TaskStatus rows in each status.", labels=["status"])
+        counts = dict(TaskStatus.objects.order_by().values_list("status").annotate(n=Count("id")))
+        for status in TaskStatus.Status.values:
+            gauge.add_metric([status], counts.get(status, 0))
+        yield gauge
+
+
+def multiprocess_dir() -> str:
+    return os.environ.get("PROMETHEUS_MULTIPROC_DIR", "")
+
+
+PIPELINE_METRICS = (
+    RENDER_PHASE_SECONDS,
+    PDF_SIZE_BYTES,
+    ENQUEUE_TO_START_SECONDS,
+    RENDERS_TOTAL,
+    CELERY_TASK_SECONDS,
+    CELERY_TASK_FAILURES,
+    LOGO_CACHE_REQUESTS,
+    LOGO_CACHE_BYTES_SAVED,
+    LOGO_CACHE_BYTES_DOWNLOADED,
+)
+
+
+def registry(include_task_status: bool = True) -> CollectorRegistry:
+    """Registry to expose: samples of every process sharing the directory, or of this process only."""
+    target = CollectorRegistry()
+    if multiprocess_dir():
+        multiprocess.MultiProcessCollector(target)
+    else:
+        for collector in PIPELINE_METRICS:
+            target.register(collector)
+    if include_task_status:
+        target.register(TaskStatusCollector())
+    return target
+
+
+# --- Celery ---
+
+# task_id -> perf_counter() на старте; prerun и postrun выполняются в одном процессе
+_task_started: Dict[str, float] = {}
+
+
+@task_prerun.connect
+def _task_started_at(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def _observe_task_duration(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        CELERY_TASK_SECONDS.labels(getattr(task, "name", "unknown"), state or "UNKNOWN").observe(
+            time.perf_counter() - started
+        )
+
+
+@task_failure.connect
+def _count_task_failure(sender=None, **kwargs):
+    CELERY_TASK_FAILURES.labels(getattr(sender, "name", "unknown")).inc()
+
+
+@worker_init.connect
+def _serve_worker_metrics(**kwargs):
+    # Родительский процесс воркера: чистим каталог до запуска потомков и отдаём их метрики
+    if multiprocess_dir():
+        shutil.rmtree(multiprocess_dir(), ignore_errors=True)
+        os.makedirs(multiprocess_dir(), exist_ok=True)
+    port = getattr(settings, "CELERY_METRICS_PORT", 0)
+    if port:
+        start_http_server(port, registry=registry(include_task_status=False))
+        logger.info("📈 Метрики Celery на :%s/metrics", port)
+
+
+@worker_process_shutdown.connect
+def _mark_worker_process_dead(pid=None, **kwargs):
+    if multiprocess_dir():
+        multiprocess.mark_process_dead(pid or os.getpid())
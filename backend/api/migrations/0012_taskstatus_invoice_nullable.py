@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-18 11:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_invoice_pdf_url'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='taskstatus',
+            name='invoice',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tasks', to='api.invoice'),
+        ),
+    ]
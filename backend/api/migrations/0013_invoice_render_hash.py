@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_taskstatus_invoice_nullable'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='render_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_invoice_render_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customer',
+            name='email',
+            field=models.EmailField(blank=True, db_index=True, max_length=254, null=True),
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def dedupe_customer_emails(apps, schema_editor):
+    Customer = apps.get_model("api", "Customer")
+    Invoice = apps.get_model("api", "Invoice")
+
+    # Пустые email -> NULL: под уникальный индекс попадают только заполненные
+    Customer.objects.filter(email="").update(email=None)
+
+    # Дубли от параллельных импортов: инвойсы переезжают на самого старого клиента
+    duplicates = (
+        Customer.objects.exclude(email__isnull=True)
+        .values("email")
+        .annotate(keep_id=Min("id"), count=Count("id"))
+        .filter(count__gt=1)
+    )
+    for row in duplicates:
+        others = Customer.objects.filter(email=row["email"]).exclude(id=row["keep_id"])
+        Invoice.objects.filter(customer__in=others).update(customer_id=row["keep_id"])
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_alter_customer_email'),
+    ]
+
+    # Уникальный индекс — отдельной миграцией: ALTER TABLE в одной транзакции
+    # с отложенными FK-проверками после UPDATE/DELETE падает на PostgreSQL
+    operations = [
+        migrations.RunPython(dedupe_customer_emails, migrations.RunPython.noop),
+    ]
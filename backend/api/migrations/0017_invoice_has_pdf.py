@@ -0,0 +1,39 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:24
+
+import os
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_has_pdf(apps, schema_editor):
+    Invoice = apps.get_model("api", "Invoice")
+    Invoice.objects.exclude(pdf_url__isnull=True).exclude(pdf_url="").update(has_pdf=True)
+
+    # Локальный режим: один listdir вместо stat на каждый инвойс
+    output_dir = getattr(settings, "PDF_OUTPUT_DIR", None)
+    if not output_dir or not os.path.isdir(output_dir):
+        return
+    ids = [
+        int(name[len("report_"):-len(".pdf")])
+        for name in os.listdir(output_dir)
+        if name.startswith("report_") and name.endswith(".pdf") and name[len("report_"):-len(".pdf")].isdigit()
+    ]
+    for start in range(0, len(ids), 500):
+        Invoice.objects.filter(id__in=ids[start:start + 500]).update(has_pdf=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_customer_email_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='has_pdf',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(backfill_has_pdf, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:25
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_denormalised_columns(apps, schema_editor):
+    # Выражения заморожены здесь, а не импортированы из backend.api.denorm:
+    # миграция не должна меняться вместе с кодом приложения.
+    # Один UPDATE с подзапросами; для проверки и ремонта — manage.py sync_invoice_denorm
+    Invoice = apps.get_model("api", "Invoice")
+    InvoiceItem = apps.get_model("api", "InvoiceItem")
+    TaskStatus = apps.get_model("api", "TaskStatus")
+
+    money = models.DecimalField(max_digits=14, decimal_places=2)
+    items = InvoiceItem.objects.filter(invoice=OuterRef("pk")).order_by().values("invoice")
+    line_total = ExpressionWrapper(F("quantity") * F("unit_price"), output_field=money)
+    latest = TaskStatus.objects.filter(invoice=OuterRef("pk")).order_by("-created_at", "-id")
+
+    Invoice.objects.update(
+        item_count=Coalesce(Subquery(items.annotate(n=Count("pk")).values("n")), 0),
+        total=Coalesce(
+            Subquery(items.annotate(s=Sum(line_total)).values("s"), output_field=money),
+            Value(Decimal("0.00")),
+            output_field=money,
+        ),
+        latest_task=Subquery(latest.values("pk")[:1]),
+        latest_status=Subquery(latest.values("status")[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_invoice_has_pdf'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='latest_status',
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='latest_task',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.taskstatus'),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14),
+        ),
+        migrations.RunPython(backfill_denormalised_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_invoice_item_count_invoice_latest_status_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='taskstatus',
+            index=models.Index(fields=['status', 'heartbeat_at'], name='api_tasksta_status_f387bc_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_taskstatus_status_heartbeat_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='taskstatus',
+            name='task_id',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+    ]
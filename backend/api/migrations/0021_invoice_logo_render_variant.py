@@ -0,0 +1,34 @@
+# Generated by Django 5.2.1 on 2026-10-18 11:09
+
+import backend.storage_backends
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_taskstatus_task_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='logo_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='logo_render',
+            field=models.ImageField(blank=True, editable=False, null=True, storage=backend.storage_backends.LogoStorage(), upload_to=''),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='logo_render_source',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='logo_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
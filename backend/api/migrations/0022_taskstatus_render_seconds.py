@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 11:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_invoice_logo_render_variant'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taskstatus',
+            name='render_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
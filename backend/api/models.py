@@ -1,23 +1,74 @@
 import os
-from typing import Optional
+from decimal import Decimal
+from functools import partial
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
 from django.utils.html import format_html
 from django.utils.timezone import now
 from django.core.validators import FileExtensionValidator
 from backend.storage_backends import LogoStorage
+from . import denorm, events, metrics
 
 
 class Customer(models.Model):
     """Represents a customer that can be attached to multiple invoices."""
     name = models.CharField(max_length=100)
-    email = models.EmailField(blank=True, null=True)
+    # Пустой email хранится как NULL: уникальность действует только на заполненные
+    email = models.EmailField(blank=True, null=True, unique=True)
     phone = models.CharField(max_length=20, blank=True)
     address = models.TextField(blank=True)
 
     def __str__(self) -> str:
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.email = self.email or None
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def upsert_many(cls, rows: List[Dict[str, Any]]) -> List["Customer"]:
+        """
+        Returns one customer per row, upserted by email in a single
+        INSERT ... ON CONFLICT (email) DO UPDATE, so concurrent imports of the
+        same email converge on one row. Rows without email keep the old
+        full-field get_or_create matching.
+
+        A customer is shared by all its invoices, so new name, phone or
+        address change the rendered content of the existing ones too: their
+        invoices are marked dirty and rendered again after commit.
+        """
+        by_email: Dict[str, Customer] = {}
+        result: List[Any] = []
+        for row in rows:
+            email = row.get("email")
+            if not email:
+                result.append(cls.objects.get_or_create(**{**row, "email": None})[0])
+                continue
+            # Один email дважды в одном INSERT ON CONFLICT недопустим — побеждает последняя строка
+            by_email[email] = cls(**row)
+            result.append(email)
+
+        if by_email:
+            fields = ["name", "phone", "address"]
+            stored = {row[0]: row[1:] for row in cls.objects.filter(email__in=by_email).values_list("email", *fields)}
+            cls.objects.bulk_create(
+                by_email.values(),
+                update_conflicts=True,
+                unique_fields=["email"],
+                update_fields=fields,
+            )
+            changed = [
+                email for email, customer in by_email.items()
+                if email in stored and stored[email] != tuple(getattr(customer, field) for field in fields)
+            ]
+            if changed:
+                from .triggers import mark_invoice_dirty
+
+                for invoice_id in Invoice.objects.filter(customer__email__in=changed).values_list("id", flat=True):
+                    mark_invoice_dirty(invoice_id)
+        return [by_email[item] if isinstance(item, str) else item for item in result]
+
 
 class Invoice(models.Model):
     """Represents an invoice containing customer, items, and optional logo."""
@@ -36,8 +87,27 @@ class Invoice(models.Model):
         blank=True,
         validators=[FileExtensionValidator(allowed_extensions=["jpg", "jpeg", "png", "svg"])]
     )
+    # Уменьшенная копия логотипа для рендера (logo_variants.py) и имя оригинала, из которого она сделана
+    logo_render = models.ImageField(upload_to='', storage=LogoStorage(), null=True, blank=True, editable=False)
+    logo_render_source = models.CharField(max_length=255, blank=True, default="", editable=False)
+    logo_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    logo_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     pdf_url = models.URLField(null=True, blank=True)  # ссылка на PDF (S3)
+    render_hash = models.CharField(max_length=64, null=True, blank=True)  # sha256 контекста последнего рендера
+    has_pdf = models.BooleanField(default=False)  # PDF сохранён (S3 или локально), без stat/HEAD
+
+    # Денормализация: поддерживается TaskStatus.mark_* и записью позиций
+    latest_task = models.ForeignKey(
+        "TaskStatus",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    latest_status = models.CharField(max_length=20, null=True, blank=True)  # TaskStatus.Status
+    item_count = models.PositiveIntegerField(default=0)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
 
     class Meta:
         indexes = [
@@ -48,6 +118,21 @@ class Invoice(models.Model):
     def __str__(self) -> str:
         return f"Invoice #{self.id} - {self.customer or self.company_name}"
 
+    @classmethod
+    def refresh_totals(cls, invoice_ids: Iterable[int]) -> None:
+        """Recomputes item_count and total in SQL with a single UPDATE."""
+        cls.objects.filter(pk__in=list(invoice_ids)).update(**denorm.item_totals(InvoiceItem))
+
+    def has_logo_variant(self) -> bool:
+        """True if ``logo_render`` was built from the logo currently uploaded."""
+        return bool(self.logo and self.logo_render and self.logo_render_source == self.logo.name)
+
+    def render_logo(self):
+        """The logo file to embed in the PDF: the render-ready variant when it is current."""
+        if not self.logo or not self.logo.name:
+            return None
+        return self.logo_render if self.has_logo_variant() else self.logo
+
     def get_pdf_filename(self) -> str:
         return f"report_{self.id}.pdf"
 
@@ -59,18 +144,19 @@ class Invoice(models.Model):
             return self.pdf_url
         return f"/api/download-pdf/{self.id}/"
 
+    def has_stored_pdf(self) -> bool:
+        # В продакшене — по ссылке на S3, в деве — проверяем локально
+        if getattr(settings, "USE_S3", False):
+            return bool(self.pdf_url)
+        return os.path.exists(self.get_pdf_path())
+
     def pdf_link(self) -> str:
         url = self.get_pdf_url()
 
+        if self.has_stored_pdf():
+            return format_html('<a href="{}" target="_blank">📄 View PDF</a>', url)
         if getattr(settings, "USE_S3", False):
-            # В продакшене — показываем ссылку, если есть
-            if self.pdf_url:
-                return format_html('<a href="{}" target="_blank">📄 View PDF</a>', url)
             return format_html('<span style="color:red;">❌ No PDF uploaded</span>')
-
-        # В деве — проверяем локально
-        if os.path.exists(self.get_pdf_path()):
-            return format_html('<a href="{}" target="_blank">📄 View PDF</a>', url)
         return format_html('<span style="color:red;">❌ No PDF found</span>')
 
     pdf_link.short_description = "PDF File"
@@ -88,13 +174,26 @@ class InvoiceItem(models.Model):
     quantity = models.IntegerField()
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
 
-    def total(self) -> float:
-        return self.quantity * float(self.unit_price)
+    def total(self) -> Decimal:
+        return self.quantity * self.unit_price
 
     def __str__(self) -> str:
         return f"{self.name} x {self.quantity} ({self.invoice})"
 
 
+class Epoch(models.Func):
+    """Seconds since the Unix epoch for a datetime column, computed in SQL."""
+    template = "CAST(EXTRACT(EPOCH FROM %(expressions)s) AS double precision)"
+    output_field = models.FloatField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template="((julianday(%(expressions)s) - 2440587.5) * 86400.0)",
+            **extra_context,
+        )
+
+
 class TaskStatus(models.Model):
     """Tracks Celery task status for a given Invoice."""
     class Status(models.TextChoices):
@@ -103,13 +202,16 @@ class TaskStatus(models.Model):
         COMPLETED = "completed", "Completed"
         FAILED = "failed", "Failed"
 
-    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name="tasks")
-    task_id = models.CharField(max_length=100)
+    # NULL — инвойс не найден: строка FAILED остаётся видна в статусе задачи
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, null=True, blank=True, related_name="tasks")
+    task_id = models.CharField(max_length=100, db_index=True)
     heartbeat_at = models.DateTimeField(blank=True, null=True)
     status = models.CharField(max_length=20, choices=Status.choices, default=Status.QUEUED)
     started_at = models.DateTimeField(blank=True, null=True)
     finished_at = models.DateTimeField(blank=True, null=True)
     duration_seconds = models.FloatField(blank=True, null=True)
+    # Только рендер (HTML + PDF), без очереди store_pdf и загрузки; NULL — PDF взят из кэша
+    render_seconds = models.FloatField(blank=True, null=True)
     error_message = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -119,35 +221,96 @@ class TaskStatus(models.Model):
             models.Index(fields=["status"]),
             models.Index(fields=["invoice"]),
             models.Index(fields=["created_at"]),
+            models.Index(fields=["status", "heartbeat_at"]),
         ]
 
+    STALE_MESSAGE = "Task marked as stale (no heartbeat)"
+
     def __str__(self):
         return f"Task {self.task_id} ({self.invoice}) - {self.status}"
 
+    @transaction.atomic
     def mark_started(self):
         self.status = self.Status.RUNNING
-        self.started_at = now()
-        self.save(update_fields=["status", "started_at"])
+        self.started_at = self.heartbeat_at = now()
+        self.save(update_fields=["status", "started_at", "heartbeat_at"])
+        if self.created_at:
+            # created_at — момент постановки в очередь (create_queued)
+            metrics.ENQUEUE_TO_START_SECONDS.observe((self.started_at - self.created_at).total_seconds())
+        self._sync_invoice()
+        self._notify()
 
-    def mark_completed(self):
+    @transaction.atomic
+    def mark_completed(self, render_seconds: Optional[float] = None):
         self.status = self.Status.COMPLETED
         self.finished_at = now()
         self.duration_seconds = self._calculate_duration()
-        self.save(update_fields=["status", "finished_at", "duration_seconds"])
+        if render_seconds is not None:
+            self.render_seconds = render_seconds
+        self.save(update_fields=["status", "finished_at", "duration_seconds", "render_seconds"])
+        self._sync_invoice()
+        self._notify()
 
+    @transaction.atomic
     def mark_failed(self, error: str):
         self.status = self.Status.FAILED
         self.finished_at = now()
         self.duration_seconds = self._calculate_duration()
         self.error_message = error
         self.save(update_fields=["status", "finished_at", "duration_seconds", "error_message"])
+        self._sync_invoice()
+        self._notify()
 
+    @transaction.atomic
     def mark_stale(self):
         self.status = self.Status.FAILED
         self.finished_at = now()
         self.duration_seconds = self._calculate_duration()
-        self.error_message = "Task marked as stale (no heartbeat)"
+        self.error_message = self.STALE_MESSAGE
         self.save(update_fields=["status", "finished_at", "duration_seconds", "error_message"])
+        self._sync_invoice()
+        self._notify()
+
+    @classmethod
+    @transaction.atomic
+    def sweep_stale(cls, older_than) -> Tuple[int, List[int]]:
+        """
+        Marks every RUNNING task whose heartbeat is older than ``older_than``
+        as failed with one UPDATE and returns the number of swept tasks and
+        the IDs of invoices whose latest task was swept.
+        """
+        swept_at = now()
+        count = cls.objects.filter(status=cls.Status.RUNNING, heartbeat_at__lt=older_than).update(
+            status=cls.Status.FAILED,
+            finished_at=swept_at,
+            duration_seconds=models.Value(swept_at.timestamp()) - Epoch("started_at"),
+            error_message=cls.STALE_MESSAGE,
+        )
+        if not count:
+            return 0, []
+
+        # Строки этого прохода узнаём по finished_at — без списка ID в памяти
+        swept = cls.objects.filter(
+            status=cls.Status.FAILED, finished_at=swept_at, error_message=cls.STALE_MESSAGE
+        )
+        invoices = Invoice.objects.filter(latest_task__in=swept)
+        invoice_ids = list(invoices.values_list("id", flat=True))
+        invoices.update(latest_status=cls.Status.FAILED)
+        transaction.on_commit(partial(events.notify_tasks_changed, list(swept.values_list("task_id", flat=True))))
+        return count, invoice_ids
+
+    def _notify(self) -> None:
+        # Подписчики SSE/long-poll узнают о переходе только после коммита
+        transaction.on_commit(partial(events.notify_tasks_changed, [self.task_id]))
+
+    def _sync_invoice(self, claim: bool = False) -> None:
+        # claim=True — эта задача становится последней для инвойса;
+        # иначе обновляем статус, только если новее задачи ещё не было
+        invoices = Invoice.objects.filter(pk=self.invoice_id)
+        if claim:
+            invoices.update(latest_task=self, latest_status=self.status)
+        else:
+            invoices.filter(latest_task=self).update(latest_status=self.status)
 
     def _calculate_duration(self) -> Optional[float]:
         if self.started_at and self.finished_at:
@@ -155,6 +318,7 @@ class TaskStatus(models.Model):
         return None
 
     @classmethod
+    @transaction.atomic
     def start_or_update(cls, invoice: Invoice, task_id: str) -> "TaskStatus":
         obj, _ = cls.objects.update_or_create(
             task_id=task_id,
@@ -163,6 +327,21 @@ class TaskStatus(models.Model):
                 "status": cls.Status.QUEUED,
                 "started_at": now(),
                 "heartbeat_at": now(),
+                "render_seconds": None,
             }
         )
+        obj._sync_invoice(claim=True)
         return obj
+
+    @classmethod
+    @transaction.atomic
+    def create_queued(cls, task_ids: Dict[int, str]) -> List["TaskStatus"]:
+        """Bulk-creates QUEUED rows ({invoice_id: task_id}) and points the invoices at them."""
+        tasks = cls.objects.bulk_create(
+            cls(invoice_id=invoice_id, task_id=task_id) for invoice_id, task_id in task_ids.items()
+        )
+        Invoice.objects.bulk_update(
+            [Invoice(pk=task.invoice_id, latest_task=task, latest_status=task.status) for task in tasks],
+            ["latest_task", "latest_status"],
+        )
+        return tasks
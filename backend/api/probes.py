@@ -0,0 +1,143 @@
+"""
+Background health probes.
+
+A daemon thread checks the database, the Celery broker and Redis every
+``HEALTH_PROBE_INTERVAL`` seconds and keeps the latest result of each probe
+in memory. The database probe borrows a pooled connection per check; the
+broker and Redis probes reuse long-lived connections. ``/api/health/`` only reads
+that snapshot, so a load balancer polling it never waits on a dependency and
+never puts anything on the task queue.
+
+Every result carries ``checked_at`` and ``age_seconds``; a probe whose last
+result is older than ``HEALTH_PROBE_STALE_AFTER`` seconds is reported as
+stale (the probe thread itself is stuck or dead).
+"""
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import redis
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+def _timeout() -> float:
+    return getattr(settings, "HEALTH_PROBE_TIMEOUT", 2)
+
+
+def probe_db() -> None:
+    # Сломанное (например, после failover) соединение выбрасываем до проверки,
+    # а после — закрываем: с пулом это возврат слота, поток его не держит
+    connection.close_if_unusable_or_obsolete()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+    finally:
+        connection.close()
+
+
+def probe_broker() -> None:
+    from backend.celery import app as celery_app
+
+    with celery_app.pool.acquire(block=True, timeout=_timeout()) as conn:
+        conn.ensure_connection(max_retries=1, timeout=_timeout())
+        # Открываем канал: у части транспортов само соединение ленивое
+        conn.default_channel  # noqa: B018
+
+
+_redis_pool: Optional[redis.ConnectionPool] = None
+
+
+def probe_redis() -> Optional[str]:
+    global _redis_pool
+    redis_url = getattr(settings, "REDIS_URL", None)
+    if not redis_url:
+        return "skipped: REDIS_URL is not set"
+    if _redis_pool is None:
+        _redis_pool = redis.ConnectionPool.from_url(
+            redis_url, socket_timeout=_timeout(), socket_connect_timeout=_timeout()
+        )
+    redis.Redis(connection_pool=_redis_pool).ping()
+    return None
+
+
+PROBES: Dict[str, Callable[[], Optional[str]]] = {
+    "db": probe_db,
+    "broker": probe_broker,
+    "redis": probe_redis,
+}
+
+
+class ProbeRunner:
+    def __init__(self, probes: Dict[str, Callable[[], Optional[str]]], interval: float):
+        self.probes = probes
+        self.interval = interval
+        self._results: Dict[str, Dict[str, Any]] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="health-probes", daemon=True)
+        self._thread.start()
+
+    def is_alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def run_once(self) -> None:
+        for name, probe in self.probes.items():
+            started = time.perf_counter()
+            try:
+                note = probe()
+                result = {"ok": True, "error": None, "note": note}
+            except Exception as e:
+                result = {"ok": False, "error": str(e), "note": None}
+            result["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            result["checked_at"] = time.time()
+            # Словарь заменяется целиком — читатели видят согласованный снимок без блокировок
+            self._results = {**self._results, name: result}
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("🩺 Ошибка в потоке health-проверок")
+            time.sleep(self.interval)
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.time()
+        stale_after = getattr(settings, "HEALTH_PROBE_STALE_AFTER", 3 * self.interval)
+        probes = {}
+        for name in self.probes:
+            result = self._results.get(name)
+            if result is None:
+                probes[name] = {"ok": False, "error": "not checked yet", "stale": True}
+                continue
+            age = now - result["checked_at"]
+            probes[name] = {**result, "age_seconds": round(age, 3), "stale": age > stale_after}
+        return {
+            "ok": all(probe["ok"] and not probe["stale"] for probe in probes.values()),
+            "probes": probes,
+        }
+
+
+_runner: Optional[ProbeRunner] = None
+_runner_pid: Optional[int] = None
+_start_lock = threading.Lock()
+
+
+def get_runner() -> ProbeRunner:
+    """Probe runner of this process, started on first use (and again after fork)."""
+    global _runner, _runner_pid
+    if _runner is not None and _runner_pid == os.getpid() and _runner.is_alive():
+        return _runner
+    with _start_lock:
+        if _runner is None or _runner_pid != os.getpid() or not _runner.is_alive():
+            _runner = ProbeRunner(PROBES, getattr(settings, "HEALTH_PROBE_INTERVAL", 10))
+            _runner_pid = os.getpid()
+            _runner.start()
+    return _runner
@@ -0,0 +1,36 @@
+import hashlib
+import json
+from functools import lru_cache
+from typing import Any, Dict
+
+from django.template.loader import get_template
+
+from .models import Invoice
+from .renderer import STYLESHEET_PATH
+
+
+@lru_cache(maxsize=None)
+def template_version(template_name: str) -> str:
+    """Hash of the template and stylesheet source, so edits invalidate cached PDFs."""
+    digest = hashlib.sha256(get_template(template_name).template.source.encode("utf-8"))
+    digest.update(STYLESHEET_PATH.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def compute_render_hash(invoice: Invoice, context: Dict[str, Any], template_name: str) -> str:
+    """
+    Stable sha256 of everything that ends up in the PDF: invoice fields,
+    items, customer, logo identity and template version.
+    """
+    payload = {
+        "context": context,
+        "logo": invoice.logo.name if invoice.logo else "",
+        "template": template_version(template_name),
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def is_cached(invoice: Invoice, render_hash: str) -> bool:
+    """True if the stored PDF was rendered from an identical context."""
+    return invoice.render_hash == render_hash and invoice.has_stored_pdf()
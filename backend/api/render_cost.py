@@ -0,0 +1,143 @@
+"""
+Render cost estimate and size-aware queue routing.
+
+A render's duration grows with the number of line items (WeasyPrint lays out
+every table row) and with a logo. ``CostModel`` predicts it as
+``base + per_item * items + logo``; the coefficients are fitted by least
+squares on ``TaskStatus.render_seconds`` of the last ``PDF_COST_HISTORY``
+rendered tasks (cache hits, the store queue and uploads are not part of it)
+and refitted every ``PDF_COST_MODEL_TTL`` seconds per process. Until there
+are ``PDF_COST_MIN_SAMPLES`` rows the ``PDF_COST_*_SECONDS`` defaults are used.
+
+With ``PDF_SIZE_ROUTING`` a task whose estimate (the sum over its invoices for
+a batch) exceeds ``PDF_FAST_MAX_SECONDS`` goes to ``PDF_BULK_QUEUE``, served by
+its own low-concurrency worker, so one huge invoice cannot hold up the
+interactive renders queued behind it on the fast (default) queue.
+"""
+import logging
+import threading
+import time
+from typing import Iterable, Optional, Tuple
+
+from django.conf import settings
+
+from .models import Invoice, TaskStatus
+
+logger = logging.getLogger(__name__)
+
+
+class CostModel:
+    """Predicted render seconds: ``base + per_item * item_count (+ logo)``."""
+
+    def __init__(self, base: float, per_item: float, logo: float, samples: int = 0):
+        self.base = base
+        self.per_item = per_item
+        self.logo = logo
+        self.samples = samples
+
+    def estimate(self, item_count: int, has_logo: bool) -> float:
+        return self.base + self.per_item * (item_count or 0) + (self.logo if has_logo else 0.0)
+
+    def __repr__(self) -> str:
+        return (
+            f"CostModel(base={self.base:.3f}s, per_item={self.per_item * 1000:.2f}ms, "
+            f"logo={self.logo:.3f}s, samples={self.samples})"
+        )
+
+
+def default_cost_model() -> CostModel:
+    return CostModel(
+        base=getattr(settings, "PDF_COST_BASE_SECONDS", 0.5),
+        per_item=getattr(settings, "PDF_COST_PER_ITEM_SECONDS", 0.02),
+        logo=getattr(settings, "PDF_COST_LOGO_SECONDS", 0.2),
+    )
+
+
+def fit_cost_model(rows: Iterable[Tuple[int, bool, float]]) -> Optional[CostModel]:
+    """
+    Least-squares fit on ``(item_count, has_logo, render_seconds)`` rows.
+    Returns None if there are too few rows or the item counts do not vary.
+    """
+    rows = list(rows)
+    if len(rows) < getattr(settings, "PDF_COST_MIN_SAMPLES", 20):
+        return None
+
+    n = len(rows)
+    mean_x = sum(items for items, _, _ in rows) / n
+    mean_y = sum(duration for _, _, duration in rows) / n
+    variance = sum((items - mean_x) ** 2 for items, _, _ in rows)
+    if not variance:
+        return None
+    per_item = max(0.0, sum((items - mean_x) * (duration - mean_y) for items, _, duration in rows) / variance)
+    base = max(0.0, mean_y - per_item * mean_x)
+
+    # Надбавка за логотип — разница средних остатков с логотипом и без
+    residuals = {True: [], False: []}
+    for items, has_logo, duration in rows:
+        residuals[bool(has_logo)].append(duration - base - per_item * items)
+    logo = 0.0
+    if residuals[True] and residuals[False]:
+        logo = max(0.0, sum(residuals[True]) / len(residuals[True]) - sum(residuals[False]) / len(residuals[False]))
+    return CostModel(base=base, per_item=per_item, logo=logo, samples=n)
+
+
+def _history() -> Iterable[Tuple[int, bool, float]]:
+    rows = (
+        TaskStatus.objects.filter(status=TaskStatus.Status.COMPLETED, render_seconds__isnull=False)
+        .order_by("-finished_at")
+        .values_list("invoice__item_count", "invoice__logo", "render_seconds")[
+            :getattr(settings, "PDF_COST_HISTORY", 2000)
+        ]
+    )
+    return [(items or 0, bool(logo), duration) for items, logo, duration in rows]
+
+
+_model: Optional[CostModel] = None
+_model_fitted_at = 0.0
+_model_lock = threading.Lock()
+
+
+def cost_model() -> CostModel:
+    """Model fitted on recent history, cached per process for ``PDF_COST_MODEL_TTL`` seconds."""
+    global _model, _model_fitted_at
+    ttl = getattr(settings, "PDF_COST_MODEL_TTL", 600)
+    if _model is not None and time.monotonic() - _model_fitted_at < ttl:
+        return _model
+
+    with _model_lock:
+        if _model is None or time.monotonic() - _model_fitted_at >= ttl:
+            fitted = fit_cost_model(_history())
+            _model = fitted or default_cost_model()
+            _model_fitted_at = time.monotonic()
+            logger.info("📐 Модель стоимости рендера: %r", _model)
+    return _model
+
+
+def reset_cost_model() -> None:
+    global _model
+    _model = None
+
+
+def queue_for_seconds(seconds: float) -> Optional[str]:
+    """Queue for a task estimated at ``seconds``; None means the default (fast) queue."""
+    if not getattr(settings, "PDF_SIZE_ROUTING", False):
+        return None
+    if seconds > getattr(settings, "PDF_FAST_MAX_SECONDS", 10):
+        return getattr(settings, "PDF_BULK_QUEUE", "pdf-bulk")
+    return getattr(settings, "PDF_FAST_QUEUE", None)
+
+
+def render_queue(invoices: Iterable[Tuple[int, bool]]) -> Optional[str]:
+    """Queue for a task rendering invoices given as ``(item_count, has_logo)`` pairs."""
+    if not getattr(settings, "PDF_SIZE_ROUTING", False):
+        return None
+    model = cost_model()
+    return queue_for_seconds(sum(model.estimate(items, has_logo) for items, has_logo in invoices))
+
+
+def render_queue_for_ids(invoice_ids: Iterable[int]) -> Optional[str]:
+    """``render_queue`` for invoices by ID (one query)."""
+    if not getattr(settings, "PDF_SIZE_ROUTING", False):
+        return None
+    rows = Invoice.objects.filter(id__in=list(invoice_ids)).values_list("item_count", "logo")
+    return render_queue((items, bool(logo)) for items, logo in rows)
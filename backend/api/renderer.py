@@ -0,0 +1,246 @@
+"""
+Warm WeasyPrint renderer.
+
+A cold ``HTML(string=html).write_pdf()`` pays for fontconfig lookup, parsing
+of the report stylesheet and fetching/decoding of the logo on every call.
+``WarmRenderer`` keeps all three for the lifetime of the process:
+
+* one shared ``FontConfiguration``;
+* ``report_template.css`` parsed once into a ``CSS`` object;
+* an LRU cache of fetched URLs, used as WeasyPrint's ``url_fetcher``; invoice
+  logos (``logo:`` URLs) go to the worker's ``LogoCache`` instead.
+
+``render_pdf``, ``rendered_pdf`` and ``render_pdf_to_file`` submit HTML to a
+pool of long-lived renderer processes when ``PDF_RENDER_POOL_SIZE > 0``.
+Processes that are not allowed to have children (Celery prefork workers are
+daemonic) render in-process with the warm
+renderer instead — prefork children are long-lived, so the state still stays
+warm between tasks.
+"""
+import atexit
+import logging
+import multiprocessing
+import os
+import tempfile
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, BinaryIO, Deque, Dict, Iterable, Iterator, Optional, Tuple
+
+from celery.signals import worker_process_init
+from django.conf import settings
+from weasyprint import CSS, HTML, default_url_fetcher
+from weasyprint.text.fonts import FontConfiguration
+
+from .logo_cache import LOGO_SCHEME, get_logo_cache
+from .metrics import PDF_SIZE_BYTES, render_phase
+
+logger = logging.getLogger(__name__)
+
+STYLESHEET_PATH = Path(__file__).resolve().parent / "templates" / "report_template.css"
+
+
+class WarmRenderer:
+    """Long-lived WeasyPrint state shared by every render in this process."""
+
+    def __init__(self, fetch_cache_size: int = 64):
+        self.font_config = FontConfiguration()
+        self.stylesheet = CSS(filename=str(STYLESHEET_PATH), font_config=self.font_config)
+        self.fetch_cache_size = fetch_cache_size
+        self._fetch_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def url_fetcher(self, url: str, *args, **kwargs) -> Dict[str, Any]:
+        if url.startswith(LOGO_SCHEME):
+            # Логотипы — из кэша воркера (память → диск → S3), без HTTP-запроса к публичному URL
+            return get_logo_cache().fetch(url)
+
+        cached = self._fetch_cache.get(url)
+        if cached is not None:
+            self._fetch_cache.move_to_end(url)
+            return dict(cached)
+
+        result = default_url_fetcher(url, *args, **kwargs)
+        if url.startswith("data:"):
+            return result
+
+        file_obj = result.pop("file_obj", None)
+        if file_obj is not None:
+            try:
+                result["string"] = file_obj.read()
+            finally:
+                file_obj.close()
+
+        self._fetch_cache[url] = result
+        if len(self._fetch_cache) > self.fetch_cache_size:
+            self._fetch_cache.popitem(last=False)
+        return dict(result)
+
+    def render(self, html: str, base_url: Optional[str] = None, target=None) -> Optional[bytes]:
+        """Returns PDF bytes, or writes them to ``target`` (path or file object)."""
+        document = HTML(string=html, base_url=base_url, url_fetcher=self.url_fetcher)
+        return document.write_pdf(target=target, stylesheets=[self.stylesheet], font_config=self.font_config)
+
+
+_renderer: Optional[WarmRenderer] = None
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_disabled = False
+
+
+def get_renderer() -> WarmRenderer:
+    global _renderer
+    if _renderer is None:
+        _renderer = WarmRenderer()
+    return _renderer
+
+
+def _init_pool_worker() -> None:
+    get_renderer()
+
+
+def _render_in_pool_worker(html: str, base_url: Optional[str], target_path: Optional[str] = None) -> Optional[bytes]:
+    return get_renderer().render(html, base_url, target=target_path)
+
+
+def _can_have_children() -> bool:
+    if multiprocessing.current_process().daemon:
+        return False
+    try:
+        from billiard.process import current_process as billiard_current_process
+    except ImportError:
+        return True
+    return not billiard_current_process().daemon
+
+
+def create_pool(size: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=size,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_pool_worker,
+    )
+
+
+def get_pool() -> Optional[ProcessPoolExecutor]:
+    """Renderer process pool, or None when renders should stay in-process."""
+    global _pool, _pool_disabled
+    if _pool is not None or _pool_disabled:
+        return _pool
+
+    size = getattr(settings, "PDF_RENDER_POOL_SIZE", 0)
+    if size <= 0 or not _can_have_children():
+        _pool_disabled = True
+        return None
+
+    _pool = create_pool(size)
+    logger.info("🖨️ Renderer pool started with %s processes", size)
+    return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+atexit.register(shutdown_pool)
+
+
+def _submit(pool: ProcessPoolExecutor, html: str, base_url: Optional[str], target_path: Optional[str] = None):
+    timeout = getattr(settings, "PDF_RENDER_TIMEOUT", 300)
+    try:
+        return pool.submit(_render_in_pool_worker, html, base_url, target_path).result(timeout=timeout)
+    except BrokenProcessPool:
+        # Процесс рендера упал — следующий вызов поднимет пул заново
+        shutdown_pool()
+        raise
+
+
+def render_pdf(html: str, base_url: Optional[str] = None) -> bytes:
+    """Renders HTML to PDF bytes on a warm renderer."""
+    pool = get_pool()
+    if pool is None:
+        return get_renderer().render(html, base_url)
+    return _submit(pool, html, base_url)
+
+
+@contextmanager
+def rendered_pdf(html: str, base_url: Optional[str] = None) -> Iterator[BinaryIO]:
+    """
+    Renders HTML into a temporary file and yields it rewound to the start.
+
+    In-process renders go to a ``SpooledTemporaryFile`` that moves to disk
+    after ``PDF_SPOOL_MAX_MEMORY`` bytes; pool renders are written by the
+    renderer process straight to a named temp file. Either way the PDF is
+    never held as a second full ``bytes`` copy in the worker.
+    """
+    spool_dir = getattr(settings, "PDF_SPOOL_DIR", None)
+    pool = get_pool()
+
+    if pool is None:
+        max_size = getattr(settings, "PDF_SPOOL_MAX_MEMORY", 8 * 1024 * 1024)
+        with tempfile.SpooledTemporaryFile(max_size=max_size, dir=spool_dir) as spool:
+            with render_phase("weasyprint"):
+                get_renderer().render(html, base_url, target=spool)
+            PDF_SIZE_BYTES.observe(spool.tell())
+            spool.seek(0)
+            yield spool
+        return
+
+    with tempfile.NamedTemporaryFile(dir=spool_dir, suffix=".pdf") as spool:
+        with render_phase("weasyprint"):
+            _submit(pool, html, base_url, spool.name)
+        PDF_SIZE_BYTES.observe(os.path.getsize(spool.name))
+        spool.seek(0)
+        yield spool
+
+
+def render_pdf_to_file(html: str, path: str, base_url: Optional[str] = None) -> int:
+    """Renders HTML straight into the file at ``path`` and returns its size in bytes."""
+    pool = get_pool()
+    with render_phase("weasyprint"):
+        if pool is None:
+            get_renderer().render(html, base_url, target=path)
+        else:
+            _submit(pool, html, base_url, path)
+    size = os.path.getsize(path)
+    PDF_SIZE_BYTES.observe(size)
+    return size
+
+
+def render_to_files(jobs: Iterable[Tuple[str, str]], base_url: Optional[str] = None) -> None:
+    """
+    Renders ``(html, path)`` jobs into files: in parallel on the renderer pool
+    with at most two jobs per pool process in flight, so ``jobs`` can be a
+    generator that builds HTML while earlier jobs render; or one by one
+    in-process when there is no pool.
+    """
+    pool = get_pool()
+    if pool is None:
+        for html, path in jobs:
+            get_renderer().render(html, base_url, target=path)
+        return
+
+    timeout = getattr(settings, "PDF_RENDER_TIMEOUT", 300)
+    limit = 2 * getattr(settings, "PDF_RENDER_POOL_SIZE", 1)
+    in_flight: Deque[Future] = deque()
+    try:
+        for html, path in jobs:
+            in_flight.append(pool.submit(_render_in_pool_worker, html, base_url, path))
+            if len(in_flight) >= limit:
+                in_flight.popleft().result(timeout=timeout)
+        while in_flight:
+            in_flight.popleft().result(timeout=timeout)
+    except BrokenProcessPool:
+        shutdown_pool()
+        raise
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+
+@worker_process_init.connect
+def warm_renderer_on_worker_start(**kwargs) -> None:
+    # Прогреваем шрифты и CSS до первой задачи, а не внутри неё
+    get_renderer()
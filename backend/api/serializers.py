@@ -1,11 +1,15 @@
+from django.db import transaction
 from rest_framework import serializers
 from .models import Customer, Invoice, InvoiceItem
+from .triggers import mark_invoice_dirty
 
 
 class CustomerSerializer(serializers.ModelSerializer):
     class Meta:
         model = Customer
         fields = ['name', 'email', 'phone', 'address']
+        # Существующий email — это апсерт (Customer.upsert_many), а не ошибка валидации
+        extra_kwargs = {'email': {'validators': []}}
 
 
 class InvoiceItemSerializer(serializers.ModelSerializer):
@@ -14,13 +18,45 @@ class InvoiceItemSerializer(serializers.ModelSerializer):
         fields = ['name', 'quantity', 'unit_price']
 
 
+class InvoiceListSerializer(serializers.ListSerializer):
+    """Bulk ingestion: one transaction, customer upsert by email, bulk_create for invoices and items."""
+
+    @transaction.atomic
+    def create(self, validated_data):
+        customers = Customer.upsert_many([data.pop("customer") for data in validated_data])
+        items_per_invoice = [data.pop("items") for data in validated_data]
+
+        invoices = Invoice.objects.bulk_create(
+            Invoice(customer=customer, **data) for customer, data in zip(customers, validated_data)
+        )
+        InvoiceItem.objects.bulk_create(
+            (
+                InvoiceItem(invoice=invoice, **item)
+                for invoice, items in zip(invoices, items_per_invoice)
+                for item in items
+            ),
+            batch_size=1000,
+        )
+        Invoice.refresh_totals(invoice.id for invoice in invoices)
+
+        # bulk_create не шлёт post_save — ставим рендер в очередь явно
+        for invoice in invoices:
+            mark_invoice_dirty(invoice.id)
+        return invoices
+
+
 class InvoiceSerializer(serializers.ModelSerializer):
     customer = CustomerSerializer()
     items = InvoiceItemSerializer(many=True)
 
     class Meta:
         model = Invoice
-        fields = ['id', 'company_name', 'address', 'customer', 'items']
+        fields = [
+            'id', 'company_name', 'address', 'customer', 'items',
+            'item_count', 'total', 'latest_status', 'pdf_url', 'render_hash',
+        ]
+        read_only_fields = ['item_count', 'total', 'latest_status', 'pdf_url', 'render_hash']
+        list_serializer_class = InvoiceListSerializer
 
     def validate_items(self, items):
         if not items:
@@ -32,14 +68,16 @@ class InvoiceSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError("Item unit price cannot be negative.")
         return items
 
+    @transaction.atomic
     def create(self, validated_data):
         customer_data = validated_data.pop("customer")
         items_data = validated_data.pop("items")
 
-        customer, _ = Customer.objects.get_or_create(**customer_data)
+        customer = Customer.upsert_many([customer_data])[0]
         invoice = Invoice.objects.create(customer=customer, **validated_data)
+        InvoiceItem.objects.bulk_create(InvoiceItem(invoice=invoice, **item) for item in items_data)
+        Invoice.refresh_totals([invoice.id])
+        invoice.refresh_from_db(fields=["item_count", "total"])
 
-        for item in items_data:
-            InvoiceItem.objects.create(invoice=invoice, **item)
-
+        mark_invoice_dirty(invoice.id)
         return invoice
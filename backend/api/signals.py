@@ -1,64 +1,46 @@
 import logging
-import os
 
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from django.utils.timezone import now
-from django.conf import settings
 
-from .models import Invoice, InvoiceItem, TaskStatus
-from .tasks import generate_pdf
+from .models import Invoice, InvoiceItem
+from .triggers import mark_invoice_dirty
 
 logger = logging.getLogger(__name__)
 
 
 @receiver(post_save, sender=InvoiceItem)
 def generate_pdf_when_item_added(sender, instance, created, **kwargs):
-    invoice = instance.invoice
-    if not invoice:
+    if not instance.invoice_id:
         logger.warning("[signals] 🧾 InvoiceItem сохранён, но не связан с Invoice.")
         return
 
-    if not invoice.items.exists():
-        logger.info(f"[signals] ⏳ Invoice #{invoice.id} ещё без позиций.")
-        return
+    Invoice.refresh_totals([instance.invoice_id])
+    # Рендер ставится в очередь один раз на инвойс после коммита транзакции
+    mark_invoice_dirty(instance.invoice_id)
 
-    # Проверим: нет ли уже PDF-файла
-    pdf_path = invoice.get_pdf_path()
-    pdf_exists = False
 
-    if getattr(settings, "USE_S3", False):
-        pdf_exists = bool(invoice.pdf_url)
-    else:
-        pdf_exists = os.path.exists(pdf_path)
+@receiver(post_delete, sender=InvoiceItem)
+def refresh_invoice_when_item_deleted(sender, instance, **kwargs):
+    Invoice.refresh_totals([instance.invoice_id])
+    mark_invoice_dirty(instance.invoice_id)
 
-    if pdf_exists:
-        logger.info(f"[signals] ✅ Invoice #{invoice.id}: PDF уже существует.")
-        return
 
-    # Проверим, не запущена ли задача на генерацию
-    latest_task = invoice.tasks.first()
-    if latest_task and latest_task.status in [
-        TaskStatus.Status.QUEUED,
-        TaskStatus.Status.RUNNING,
-        TaskStatus.Status.COMPLETED
-    ]:
-        logger.info(f"[signals] ⏩ Invoice #{invoice.id}: уже есть задача со статусом {latest_task.status}. Пропускаем.")
+@receiver(post_save, sender=Invoice)
+def preprocess_logo_when_uploaded(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and "logo" not in update_fields:
         return
 
-    try:
-        logger.info(f"[signals] 🧾 Invoice #{invoice.id}: добавлена позиция. Запускаем генерацию PDF...")
+    if not instance.logo:
+        if instance.logo_render or instance.logo_render_source:
+            Invoice.objects.filter(pk=instance.pk).update(
+                logo_render=None, logo_render_source="", logo_width=None, logo_height=None
+            )
+        return
 
-        result = generate_pdf.delay(invoice.id)
+    if instance.logo.name != instance.logo_render_source:
+        from .tasks import preprocess_logo
 
-        TaskStatus.objects.update_or_create(
-            invoice=invoice,
-            defaults={
-                "task_id": result.id if result else None,
-                "status": TaskStatus.Status.QUEUED,
-                "started_at": now(),
-                "heartbeat_at": now(),
-            }
-        )
-    except Exception as e:
-        logger.exception(f"[signals] ❌ Ошибка при запуске генерации PDF для Invoice #{invoice.id}")
+        # Уменьшенная копия строится на воркере; до этого рендер построит её сам или возьмёт оригинал
+        transaction.on_commit(lambda: preprocess_logo.delay(instance.pk))
@@ -0,0 +1,123 @@
+"""
+Task status lookup served from ``TaskStatus``.
+
+The Celery result backend is disabled in prod, so ``AsyncResult`` never
+leaves PENDING. Statuses are read from ``TaskStatus`` instead and reported
+with Celery state names, which the frontend already understands. A
+``generate_pdf_batch`` task has one row per invoice (``<batch id>:<invoice id>``);
+its state is aggregated from those rows.
+
+Payloads are cached for ``PDF_STATUS_CACHE_TTL`` seconds, so a burst of
+polling clients costs one query per task per TTL.
+"""
+import hashlib
+import json
+from typing import Any, Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from .models import TaskStatus
+
+CELERY_STATES = {
+    TaskStatus.Status.QUEUED: "PENDING",
+    TaskStatus.Status.RUNNING: "STARTED",
+    TaskStatus.Status.COMPLETED: "SUCCESS",
+    TaskStatus.Status.FAILED: "FAILURE",
+}
+
+CACHE_PREFIX = "pdf-status:"
+
+
+def _report_id(task: TaskStatus) -> Optional[int]:
+    if task.invoice_id is not None:
+        return task.invoice_id
+    # Инвойс не найден — строка без FK, ID берём из "<batch id>:<invoice id>"
+    suffix = task.task_id.rsplit(":", 1)[-1]
+    return int(suffix) if suffix.isdigit() else None
+
+
+def _row_result(task: TaskStatus) -> Dict[str, Any]:
+    return {"report_id": _report_id(task), "status": task.status, "error": task.error_message}
+
+
+def _single_payload(task_id: str, task: TaskStatus) -> Dict[str, Any]:
+    finished = task.status in (TaskStatus.Status.COMPLETED, TaskStatus.Status.FAILED)
+    return {
+        "task_id": task_id,
+        "status": CELERY_STATES[task.status],
+        "result": _row_result(task) if finished else None,
+    }
+
+
+def _batch_payload(task_id: str, tasks: List[TaskStatus]) -> Dict[str, Any]:
+    statuses = {task.status for task in tasks}
+    if statuses == {TaskStatus.Status.QUEUED}:
+        state = "PENDING"
+    elif statuses <= {TaskStatus.Status.COMPLETED}:
+        state = "SUCCESS"
+    elif statuses <= {TaskStatus.Status.COMPLETED, TaskStatus.Status.FAILED}:
+        state = "FAILURE"
+    else:
+        state = "STARTED"
+    return {
+        "task_id": task_id,
+        "status": state,
+        "result": [_row_result(task) for task in sorted(tasks, key=lambda t: _report_id(t) or 0)],
+    }
+
+
+def _pending_payload(task_id: str) -> Dict[str, Any]:
+    # Строки ещё нет — воркер не взял задачу (или ID неизвестен), как PENDING у Celery
+    return {"task_id": task_id, "status": "PENDING", "result": None}
+
+
+def _load(task_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    wanted = set(task_ids)
+    query = Q(task_id__in=task_ids)
+    for task_id in task_ids:
+        query |= Q(task_id__startswith=f"{task_id}:")
+
+    singles: Dict[str, TaskStatus] = {}
+    batches: Dict[str, List[TaskStatus]] = {}
+    fields = ("task_id", "invoice_id", "status", "error_message")
+    for task in TaskStatus.objects.filter(query).only(*fields).order_by():
+        if task.task_id in wanted:
+            singles[task.task_id] = task
+        else:
+            batches.setdefault(task.task_id.rsplit(":", 1)[0], []).append(task)
+
+    payloads = {}
+    for task_id in task_ids:
+        if task_id in singles:
+            payloads[task_id] = _single_payload(task_id, singles[task_id])
+        elif batches.get(task_id):
+            payloads[task_id] = _batch_payload(task_id, batches[task_id])
+        else:
+            payloads[task_id] = _pending_payload(task_id)
+    return payloads
+
+
+def get_statuses(task_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """Status payloads keyed by task ID, served from cache where possible."""
+    task_ids = list(dict.fromkeys(task_ids))
+    cached = cache.get_many([CACHE_PREFIX + task_id for task_id in task_ids])
+    payloads = {task_id: cached[CACHE_PREFIX + task_id] for task_id in task_ids if CACHE_PREFIX + task_id in cached}
+
+    missing = [task_id for task_id in task_ids if task_id not in payloads]
+    if missing:
+        loaded = _load(missing)
+        ttl = getattr(settings, "PDF_STATUS_CACHE_TTL", 2)
+        cache.set_many({CACHE_PREFIX + task_id: payload for task_id, payload in loaded.items()}, ttl)
+        payloads.update(loaded)
+    return payloads
+
+
+def get_status(task_id: str) -> Dict[str, Any]:
+    return get_statuses([task_id])[task_id]
+
+
+def payload_etag(payload: Any) -> str:
+    body = json.dumps(payload, sort_keys=True, default=str)
+    return '"%s"' % hashlib.sha256(body.encode()).hexdigest()[:32]
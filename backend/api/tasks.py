@@ -1,30 +1,214 @@
 import os
-import io
+import shutil
 import logging
-from typing import Any, Dict
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional
 from datetime import timedelta
+from pathlib import Path
 
 from celery import shared_task
-from django.template.loader import render_to_string
-from weasyprint import HTML
+from django.template.loader import get_template
 from django.conf import settings
 from django.utils.timezone import now
-from django.core.files.base import ContentFile
+from django.core.files.base import File
 
+from .chunked_render import is_chunked, render_chunked_to_file, rendered_pdf_chunked
+from .downloads import invalidate_pdf_url
+from .heartbeat import Heartbeat
+from .logo_cache import logo_url
+from .logo_variants import ensure_logo_variant, record_variant_failure
+from .metrics import RENDERS_TOTAL, render_phase
 from .models import Invoice, TaskStatus
+from .render_cache import compute_render_hash, is_cached
+from .render_cost import render_queue_for_ids
+from .renderer import render_pdf_to_file, rendered_pdf
 from backend.storage_backends import PDFStorage
 
 logger = logging.getLogger(__name__)
 
+REPORT_TEMPLATE = "report_template.html"
+INVOICE_NOT_FOUND = "Invoice not found"
+
 
 @shared_task(name="celery.ping")
 def ping() -> str:
     return "pong"
 
 
+def _build_context(invoice: Invoice) -> Dict[str, Any]:
+    items = [
+        {
+            "name": item.name or "",
+            "qty": item.quantity,
+            "price": item.unit_price,
+            "total": item.total(),
+        }
+        for item in invoice.items.all()
+    ]
+
+    logo_path = ""
+    # Вариант логотипа строит только preprocess_logo; пока его нет — в PDF идёт оригинал
+    logo = invoice.render_logo()
+    if logo:
+        # В S3-режиме логотип берёт url_fetcher из кэша воркера, а не по публичному URL
+        logo_path = logo_url(logo.name) if getattr(settings, "USE_S3", False) else logo.url
+
+    return {
+        "invoice_id": invoice.id,
+        "company": invoice.company_name or "",
+        "address": invoice.address or "",
+        "date": invoice.created_at.strftime("%H:%M:%S, %d.%m.%Y"),
+        "items": items,
+        "total": invoice.total,
+        "customer": {
+            "name": invoice.customer.name if invoice.customer else "",
+            "email": invoice.customer.email if invoice.customer else "",
+            "phone": invoice.customer.phone if invoice.customer else "",
+            "address": invoice.customer.address if invoice.customer else "",
+        },
+        "logo_path": logo_path,
+    }
+
+
+def _store_pdf(invoice: Invoice, pdf_file: BinaryIO, render_hash: str) -> str:
+    """Streams rendered PDF to S3 or PDF_OUTPUT_DIR and returns its location."""
+    with render_phase("upload"):
+        return _upload_pdf(invoice, pdf_file, render_hash)
+
+
+def _upload_pdf(invoice: Invoice, pdf_file: BinaryIO, render_hash: str) -> str:
+    filename = invoice.get_pdf_filename()
+    invoice.render_hash = render_hash
+    invoice.has_pdf = True
+
+    if getattr(settings, "USE_S3", False):
+        storage = PDFStorage()
+        # upload_fileobj читает файл частями (multipart), без копии в памяти
+        storage.save(filename, File(pdf_file, name=filename))
+        pdf_url = f"https://{storage.bucket_name}.s3.amazonaws.com/{storage.location}/{filename}"
+        invoice.pdf_url = pdf_url
+        invoice.save(update_fields=["pdf_url", "render_hash", "has_pdf"])
+        # Новая подпись — новый URL, браузер не покажет закэшированную старую версию
+        invalidate_pdf_url(invoice.id)
+        logger.info("✅ PDF сохранён в S3: %s", pdf_url)
+        return pdf_url
+
+    output_dir = getattr(settings, "PDF_OUTPUT_DIR", os.path.join(settings.BASE_DIR, "pdf_output"))
+    os.makedirs(output_dir, exist_ok=True)
+    pdf_path = os.path.join(output_dir, filename)
+    with open(pdf_path, "wb") as f:
+        shutil.copyfileobj(pdf_file, f)
+    invoice.save(update_fields=["render_hash", "has_pdf"])
+    logger.info("✅ PDF сохранён локально: %s", pdf_path)
+    return str(pdf_path)
+
+
+def _cached_result(invoice: Invoice, task_status: TaskStatus) -> Dict[str, Any]:
+    logger.info("♻️ Invoice #%s: контекст не изменился, PDF взят из кэша.", invoice.id)
+    task_status.mark_completed()
+    RENDERS_TOTAL.labels("cached").inc()
+    return {
+        "report_id": invoice.id,
+        "pdf_path": invoice.pdf_url or invoice.get_pdf_path(),
+        "status": "completed",
+        "cached": True,
+    }
+
+
+def pipeline_enabled() -> bool:
+    return getattr(settings, "PDF_PIPELINE", False)
+
+
+def handoff_dir() -> Path:
+    """Directory shared by the render and store workers for PDFs between the two stages."""
+    return Path(getattr(settings, "PDF_HANDOFF_DIR", None) or Path(tempfile.gettempdir()) / "pdf-handoff")
+
+
+def _render_html(template, context: Dict[str, Any]) -> Optional[str]:
+    """HTML of the report, or None for an invoice rendered in parts (see chunked_render.py)."""
+    if is_chunked(context):
+        return None
+    with render_phase("html"):
+        html = template.render(context)
+    if not html:
+        raise ValueError("❌ render_to_string вернул пустую строку")
+    return html
+
+
+@contextmanager
+def _rendered_invoice(template, context: Dict[str, Any], html: Optional[str]) -> Iterator[BinaryIO]:
+    """The rendered PDF as a temp file rewound to the start."""
+    if html is None:
+        with rendered_pdf_chunked(template, context) as pdf_file:
+            yield pdf_file
+    else:
+        with rendered_pdf(html) as pdf_file:
+            yield pdf_file
+
+
+def _hand_off(
+    invoice: Invoice,
+    task_status: TaskStatus,
+    template,
+    context: Dict[str, Any],
+    html: Optional[str],
+    render_hash: str,
+    render_started: float,
+    rerender: int = 0,
+) -> str:
+    """
+    Renders the PDF into the hand-off directory and enqueues store_pdf for it.
+    ``render_started`` is the ``perf_counter()`` taken before the HTML render;
+    ``rerender`` counts how many times store_pdf has already re-enqueued this
+    render because it could not find the file.
+    """
+    directory = handoff_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    name = f"{task_status.task_id.replace(':', '-')}.pdf"
+    partial_path = directory / f".{name}.part"
+    # store_pdf не увидит недописанный файл: переименование атомарно
+    try:
+        if html is None:
+            with open(partial_path, "wb") as f:
+                render_chunked_to_file(template, context, f)
+        else:
+            render_pdf_to_file(html, str(partial_path))
+        os.replace(partial_path, directory / name)
+    except BaseException:
+        partial_path.unlink(missing_ok=True)
+        raise
+
+    # Время в очереди store_pdf не должно выглядеть для check_stuck_tasks как зависание;
+    # render_seconds — без очереди и загрузки, на нём учится render_cost
+    TaskStatus.objects.filter(pk=task_status.pk).update(
+        heartbeat_at=now(), render_seconds=time.perf_counter() - render_started
+    )
+    store_pdf.delay(invoice.id, task_status.pk, name, render_hash, rerender)
+    logger.info("📤 Invoice #%s: PDF отрисован, загрузка передана в очередь store_pdf.", invoice.id)
+    return name
+
+
 @shared_task(bind=True, name="generate_pdf")
 def generate_pdf(self, report_id: int) -> Dict[str, Any]:
-    task_id = self.request.id
+    """Renders and stores the invoice PDF in one task."""
+    return _generate(self, report_id, pipeline=False)
+
+
+@shared_task(bind=True, name="render_pdf")
+def render_pdf(self, report_id: int, rerender: int = 0) -> Dict[str, Any]:
+    """CPU stage of the pipeline: renders the PDF and leaves the upload to store_pdf."""
+    return _generate(self, report_id, pipeline=True, rerender=rerender)
+
+
+def render_task():
+    """Task to enqueue for a single invoice: render_pdf with ``PDF_PIPELINE``, otherwise generate_pdf."""
+    return render_pdf if pipeline_enabled() else generate_pdf
+
+
+def _generate(task, report_id: int, pipeline: bool, rerender: int = 0) -> Dict[str, Any]:
+    task_id = task.request.id
     invoice = None
     task_status = None
 
@@ -38,88 +222,47 @@ def generate_pdf(self, report_id: int) -> Dict[str, Any]:
         task_status = TaskStatus.start_or_update(invoice=invoice, task_id=task_id)
         task_status.mark_started()
 
-        filename = invoice.get_pdf_filename()
-        items = []
-        total = 0
-
-        for idx, item in enumerate(invoice.items.all(), 1):
-            item_total = item.total()
-            items.append({
-                "name": item.name or "",
-                "qty": item.quantity,
-                "price": float(item.unit_price),
-                "total": float(item_total),
-            })
-            total += item_total
-
-            if idx % 3 == 0 or idx == len(invoice.items.all()):
-                task_status.heartbeat_at = now()
-                task_status.save(update_fields=["heartbeat_at"])
-
-        logo_path = invoice.logo.url if invoice.logo and invoice.logo.name else ""
-
-        context = {
-            "invoice_id": invoice.id,
-            "company": invoice.company_name or "",
-            "address": invoice.address or "",
-            "date": invoice.created_at.strftime("%H:%M:%S, %d.%m.%Y"),
-            "items": items,
-            "total": float(total),
-            "customer": {
-                "name": invoice.customer.name if invoice.customer else "",
-                "email": invoice.customer.email if invoice.customer else "",
-                "phone": invoice.customer.phone if invoice.customer else "",
-                "address": invoice.customer.address if invoice.customer else "",
-            },
-            "logo_path": logo_path,
-        }
+        context = _build_context(invoice)
+        render_hash = compute_render_hash(invoice, context, REPORT_TEMPLATE)
+        if is_cached(invoice, render_hash):
+            return _cached_result(invoice, task_status)
 
         logger.info("📦 Rendering context:\n%s", context)
 
         # Генерация PDF
-        pdf_buffer = io.BytesIO()
-        html = render_to_string("report_template.html", context)
-
-        if not html:
-            raise ValueError("❌ render_to_string вернул пустую строку")
+        render_started = time.perf_counter()
+        template = get_template(REPORT_TEMPLATE)
+        html = _render_html(template, context)
 
         # DEBUG: сохранить HTML как файл (при необходимости)
-        if settings.DEBUG:
+        if settings.DEBUG and html is not None:
             with open(f"/tmp/invoice_{invoice.id}.html", "w") as f:
                 f.write(html)
 
-        HTML(string=html).write_pdf(target=pdf_buffer)
-        pdf_buffer.seek(0)
+        if pipeline:
+            with Heartbeat(task_status):
+                _hand_off(invoice, task_status, template, context, html, render_hash, render_started, rerender)
+            return {"report_id": report_id, "status": "rendered", "cached": False}
 
-        pdf_url = None
+        # Heartbeat по времени, пока идут рендер и загрузка
+        with Heartbeat(task_status), _rendered_invoice(template, context, html) as pdf_file:
+            render_seconds = time.perf_counter() - render_started
+            pdf_path = _store_pdf(invoice, pdf_file, render_hash)
 
-        if getattr(settings, "USE_S3", False):
-            storage = PDFStorage()
-            storage.save(filename, ContentFile(pdf_buffer.read()))
-            pdf_url = f"https://{storage.bucket_name}.s3.amazonaws.com/{storage.location}/{filename}"
-            invoice.pdf_url = pdf_url
-            invoice.save(update_fields=["pdf_url"])
-            pdf_path = f"s3://{storage.bucket_name}/{storage.location}/{filename}"
-            logger.info("✅ PDF сохранён в S3: %s", pdf_url)
-        else:
-            output_dir = getattr(settings, "PDF_OUTPUT_DIR", os.path.join(settings.BASE_DIR, "pdf_output"))
-            os.makedirs(output_dir, exist_ok=True)
-            pdf_path = os.path.join(output_dir, filename)
-            with open(pdf_path, "wb") as f:
-                f.write(pdf_buffer.read())
-            logger.info("✅ PDF сохранён локально: %s", pdf_path)
-
-        task_status.mark_completed()
+        task_status.mark_completed(render_seconds)
+        RENDERS_TOTAL.labels("completed").inc()
 
         return {
             "report_id": report_id,
-            "pdf_path": pdf_url or str(pdf_path),
+            "pdf_path": pdf_path,
             "status": "completed",
+            "cached": False,
         }
 
     except Invoice.DoesNotExist:
         msg = f"❌ Invoice ID {report_id} не найден"
         logger.error(msg)
+        RENDERS_TOTAL.labels("failed").inc()
         TaskStatus.objects.create(
             invoice=None,
             task_id=task_id,
@@ -131,6 +274,7 @@ def generate_pdf(self, report_id: int) -> Dict[str, Any]:
 
     except Exception as e:
         logger.exception("❌ Ошибка при генерации PDF")
+        RENDERS_TOTAL.labels("failed").inc()
         if task_status:
             task_status.mark_failed(str(e))
         else:
@@ -144,21 +288,188 @@ def generate_pdf(self, report_id: int) -> Dict[str, Any]:
         return {"report_id": report_id, "status": "failed", "error": str(e)}
 
 
+@shared_task(bind=True, name="generate_pdf_batch")
+def generate_pdf_batch(self, report_ids: List[int], lane: Optional[List[Any]] = None) -> Dict[str, Any]:
+    """
+    Renders many invoices in one worker pass.
+
+    All invoices and their items are fetched with a single query set, the
+    parsed template is shared by the batch and every render goes to the warm
+    renderer (one font configuration and stylesheet per process).
+    Each invoice gets its own TaskStatus row (``<batch task id>:<invoice id>``).
+    With ``PDF_PIPELINE`` the uploads are handed off to store_pdf.
+    ``lane`` holds the batches queued behind this one (see
+    ``triggers.enqueue_pdf_renders``); the next is published when this batch
+    ends, whether it succeeded or not.
+    """
+    try:
+        return _render_batch(self.request.id, report_ids)
+    finally:
+        if lane:
+            from .triggers import start_lane
+
+            start_lane(lane)
+
+
+def _render_batch(batch_id: str, report_ids: List[int]) -> Dict[str, Any]:
+    invoices = (
+        Invoice.objects.select_related("customer")
+        .prefetch_related("items")
+        .filter(id__in=report_ids)
+        .order_by("id")
+    )
+    found = {invoice.id: invoice for invoice in invoices}
+    missing = [report_id for report_id in report_ids if report_id not in found]
+    if missing:
+        logger.error("❌ Invoice IDs не найдены: %s", missing)
+        # Строка FAILED на каждый ненайденный ID — /api/pdf-status/<batch_id> покажет их как ошибки
+        for report_id in missing:
+            TaskStatus.objects.update_or_create(
+                task_id=f"{batch_id}:{report_id}",
+                defaults={
+                    "invoice": None,
+                    "status": TaskStatus.Status.FAILED,
+                    "error_message": INVOICE_NOT_FOUND,
+                    "finished_at": now(),
+                },
+            )
+
+    template = get_template(REPORT_TEMPLATE)
+    pipeline = pipeline_enabled()
+
+    results = []
+    for invoice in found.values():
+        task_status = TaskStatus.start_or_update(invoice=invoice, task_id=f"{batch_id}:{invoice.id}")
+        task_status.mark_started()
+        try:
+            context = _build_context(invoice)
+            render_hash = compute_render_hash(invoice, context, REPORT_TEMPLATE)
+            if is_cached(invoice, render_hash):
+                results.append(_cached_result(invoice, task_status))
+                continue
+
+            render_started = time.perf_counter()
+            html = _render_html(template, context)
+
+            if pipeline:
+                with Heartbeat(task_status):
+                    _hand_off(invoice, task_status, template, context, html, render_hash, render_started)
+                results.append({"report_id": invoice.id, "status": "rendered", "cached": False})
+                continue
+
+            with Heartbeat(task_status), _rendered_invoice(template, context, html) as pdf_file:
+                render_seconds = time.perf_counter() - render_started
+                pdf_path = _store_pdf(invoice, pdf_file, render_hash)
+
+            task_status.mark_completed(render_seconds)
+            RENDERS_TOTAL.labels("completed").inc()
+            results.append({"report_id": invoice.id, "pdf_path": pdf_path, "status": "completed", "cached": False})
+        except Exception as e:
+            logger.exception("❌ Ошибка при генерации PDF для Invoice #%s", invoice.id)
+            RENDERS_TOTAL.labels("failed").inc()
+            task_status.mark_failed(str(e))
+            results.append({"report_id": invoice.id, "status": "failed", "error": str(e)})
+
+    results.extend(
+        {"report_id": report_id, "status": "failed", "error": INVOICE_NOT_FOUND}
+        for report_id in missing
+    )
+    completed = sum(1 for result in results if result["status"] == "completed")
+    logger.info("✅ generate_pdf_batch finished. %s/%s completed.", completed, len(report_ids))
+    return {"batch_id": batch_id, "completed": completed, "results": results}
+
+
+@shared_task(bind=True, name="store_pdf", max_retries=3)
+def store_pdf(self, report_id: int, task_status_id: int, name: str, render_hash: str, rerender: int = 0) -> Dict[str, Any]:
+    """
+    I/O stage of the pipeline: uploads a PDF left by render_pdf in the
+    hand-off directory and completes its TaskStatus. Runs on
+    ``PDF_STORE_QUEUE``, served by a thread-pool worker. A file that is not
+    there (the render ran where this worker cannot see its directory) sends
+    the invoice back to render_pdf, at most ``PDF_HANDOFF_RERENDERS`` times.
+    """
+    path = handoff_dir() / Path(name).name
+    task_status = TaskStatus.objects.select_related("invoice").filter(pk=task_status_id).first()
+    if task_status is None:
+        path.unlink(missing_ok=True)
+        logger.error("❌ store_pdf: TaskStatus #%s не найден (Invoice #%s).", task_status_id, report_id)
+        return {"report_id": report_id, "status": "failed", "error": "TaskStatus not found"}
+
+    if not path.exists() and rerender < getattr(settings, "PDF_HANDOFF_RERENDERS", 2):
+        logger.warning("⚠️ Invoice #%s: файла %s нет в %s, рендер запущен заново.", report_id, name, path.parent)
+        render_pdf.apply_async(
+            args=[report_id], kwargs={"rerender": rerender + 1},
+            task_id=task_status.task_id, queue=render_queue_for_ids([report_id]),
+        )
+        return {"report_id": report_id, "status": "rerendering", "rerender": rerender + 1}
+
+    try:
+        with Heartbeat(task_status), open(path, "rb") as pdf_file:
+            pdf_path = _store_pdf(task_status.invoice, pdf_file, render_hash)
+    except Exception as e:
+        if path.exists() and self.request.retries < self.max_retries:
+            logger.warning("⚠️ Invoice #%s: загрузка не удалась (%s), повтор.", report_id, e)
+            raise self.retry(exc=e, countdown=2 ** self.request.retries)
+        logger.exception("❌ Ошибка при загрузке PDF для Invoice #%s", report_id)
+        path.unlink(missing_ok=True)
+        RENDERS_TOTAL.labels("failed").inc()
+        task_status.mark_failed(str(e))
+        return {"report_id": report_id, "status": "failed", "error": str(e)}
+
+    path.unlink(missing_ok=True)
+    task_status.mark_completed()
+    RENDERS_TOTAL.labels("completed").inc()
+    return {"report_id": report_id, "pdf_path": pdf_path, "status": "completed", "cached": False}
+
+
+@shared_task(name="preprocess_logo")
+def preprocess_logo(invoice_id: int) -> Dict[str, Any]:
+    """Builds the render-ready variant of a freshly uploaded logo (see logo_variants.py)."""
+    invoice = Invoice.objects.filter(id=invoice_id).first()
+    if invoice is None:
+        logger.warning("⚠️ preprocess_logo: Invoice #%s не найден.", invoice_id)
+        return {"invoice_id": invoice_id, "status": "missing"}
+
+    try:
+        built = ensure_logo_variant(invoice)
+    except Exception as e:
+        # Повторять на каждом рендере/сохранении бессмысленно: запоминаем неудачу до смены логотипа
+        logger.exception("⚠️ Invoice #%s: вариант логотипа не построен, в PDF пойдёт оригинал", invoice_id)
+        record_variant_failure(invoice)
+        return {"invoice_id": invoice_id, "status": "failed", "error": str(e)}
+    return {
+        "invoice_id": invoice_id,
+        "status": "built" if built else "skipped",
+        "logo_render": invoice.logo_render.name if invoice.logo_render else "",
+        "width": invoice.logo_width,
+        "height": invoice.logo_height,
+    }
+
+
 @shared_task(name="check_stuck_tasks")
-def check_stuck_tasks():
-    timeout_minutes = 5
+def check_stuck_tasks(requeue: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    Fails every RUNNING task without a heartbeat for ``STALE_TASK_TIMEOUT_MINUTES``
+    in one UPDATE. With ``requeue`` (default ``STALE_TASK_REQUEUE``) the affected
+    invoices are rendered again with at most ``STALE_REQUEUE_CONCURRENCY``
+    batch tasks in flight at a time.
+    """
+    timeout_minutes = getattr(settings, "STALE_TASK_TIMEOUT_MINUTES", 5)
     threshold = now() - timedelta(minutes=timeout_minutes)
 
-    stuck_tasks = TaskStatus.objects.filter(
-        status=TaskStatus.Status.RUNNING,
-        heartbeat_at__lt=threshold
-    )
+    stale_tasks, invoice_ids = TaskStatus.sweep_stale(threshold)
+    RENDERS_TOTAL.labels("stale").inc(stale_tasks)
+    logger.info(f"✅ check_stuck_tasks finished. {stale_tasks} stale, {len(invoice_ids)} invoice(s) affected.")
+
+    result = {"stale_tasks": stale_tasks, "stale_invoices": len(invoice_ids), "requeued": 0}
+    if requeue is None:
+        requeue = getattr(settings, "STALE_TASK_REQUEUE", False)
+    if not requeue or not invoice_ids:
+        return result
 
-    count = 0
-    for task in stuck_tasks:
-        task.mark_stale()
-        logger.warning(f"📛 Marked as stale: {task.task_id}")
-        count += 1
+    from .triggers import enqueue_pdf_renders
 
-    logger.info(f"✅ check_stuck_tasks finished. {count} stale.")
-    return {"stale_tasks": count}
+    # Не больше N batch-задач одновременно: остальные ждут в «полосах», а не в брокере
+    task_ids = enqueue_pdf_renders(invoice_ids, lanes=getattr(settings, "STALE_REQUEUE_CONCURRENCY", 4))
+    logger.warning(f"🔁 Повторно запущено {len(invoice_ids)} инвойсов ({len(task_ids)} задач).")
+    return {**result, "requeued": len(invoice_ids), "task_ids": task_ids}
@@ -1,3 +1,1387 @@
-from django.test import TestCase
+import tempfile
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import Customer, Invoice, InvoiceItem, TaskStatus
+
+
+class InvoiceListQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for n in range(30):
+            customer = Customer.objects.create(name=f"Customer {n}", email=f"c{n}@example.com")
+            invoice = Invoice.objects.create(customer=customer, company_name="ACME", address="Street 1")
+            InvoiceItem.objects.bulk_create(
+                InvoiceItem(invoice=invoice, name=f"Item {i}", quantity=1, unit_price=Decimal("9.99"))
+                for i in range(3)
+            )
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        url = reverse("invoice_list_create")
+        for page_size in (1, 10, 30):
+            # invoices + customers (JOIN) и один prefetch для items
+            with self.assertNumQueries(2):
+                response = self.client.get(url, {"page_size": page_size})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()["results"]), page_size)
+
+    def test_cursor_walks_all_invoices_newest_first(self):
+        url = reverse("invoice_list_create") + "?page_size=7"
+        seen = []
+        while url:
+            data = self.client.get(url).json()
+            seen.extend(invoice["id"] for invoice in data["results"])
+            url = data["next"]
+        self.assertEqual(seen, list(Invoice.objects.order_by("-created_at", "-id").values_list("id", flat=True)))
+
+
+class InvoiceAdminChangelistTests(TestCase):
+    def setUp(self):
+        self.client.force_login(
+            get_user_model().objects.create_superuser("admin", "admin@example.com", "password")
+        )
+
+    def _add_invoices(self, count):
+        for n in range(count):
+            customer = Customer.objects.create(name=f"Customer {n}")
+            invoice = Invoice.objects.create(customer=customer, company_name="ACME", address="Street 1")
+            TaskStatus.objects.create(invoice=invoice, task_id=f"task-{invoice.id}", duration_seconds=1.5)
+
+    def _changelist_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("admin:api_invoice_changelist"))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_depend_on_row_count(self):
+        self._add_invoices(5)
+        small_page = self._changelist_queries()
+        self._add_invoices(95)
+        self.assertEqual(self._changelist_queries(), small_page)
+
+    def test_generate_action_enqueues_once_with_queued_rows(self):
+        from .tasks import generate_pdf_batch
+
+        invoices = [Invoice.objects.create(company_name="ACME", address="Street 1", item_count=1) for _ in range(2)]
+        data = {"action": "generate_pdf_action", "_selected_action": [invoice.id for invoice in invoices]}
+        with mock.patch.object(generate_pdf_batch, "apply_async") as apply_async:
+            for _ in range(2):
+                self.client.post(reverse("admin:api_invoice_changelist"), data)
+
+        self.assertEqual(apply_async.call_count, 1)
+        self.assertEqual(set(Invoice.objects.values_list("latest_status", flat=True)), {TaskStatus.Status.QUEUED})
+
+
+class PDFStatusViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        customer = Customer.objects.create(name="Customer")
+        cls.invoices = [
+            Invoice.objects.create(customer=customer, company_name="ACME", address="Street 1") for _ in range(2)
+        ]
+        TaskStatus.objects.create(invoice=cls.invoices[0], task_id="single", status=TaskStatus.Status.COMPLETED)
+        for invoice in cls.invoices:
+            TaskStatus.objects.create(invoice=invoice, task_id=f"group:{invoice.id}", status=TaskStatus.Status.RUNNING)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_status_comes_from_task_status(self):
+        data = self.client.get(reverse("pdf_status", args=["single"])).json()
+        self.assertEqual(data["status"], "SUCCESS")
+        self.assertEqual(data["result"]["report_id"], self.invoices[0].id)
+        self.assertEqual(self.client.get(reverse("pdf_status", args=["unknown"])).json()["status"], "PENDING")
+
+    def test_etag_returns_304_until_status_changes(self):
+        url = reverse("pdf_status", args=["group"])
+        response = self.client.get(url)
+        self.assertEqual(response.json()["status"], "STARTED")
+
+        etag = response["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        TaskStatus.objects.filter(task_id__startswith="group:").update(status=TaskStatus.Status.COMPLETED)
+        cache.clear()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "SUCCESS")
+
+    def test_long_poll_returns_changes_and_304_on_timeout(self):
+        url = reverse("pdf_status_wait", args=["single"])
+        response = self.client.get(url, {"timeout": 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "SUCCESS")
+
+        response = self.client.get(url, {"timeout": 0}, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def _stream(self, payloads, changes):
+        """Drains ``_status_events`` with scripted statuses and subscription wake-ups."""
+        from contextlib import asynccontextmanager
+
+        from asgiref.sync import async_to_sync
+
+        from .views import _status_events
+
+        timeouts = []
+
+        class Subscription:
+            async def wait(self, timeout):
+                timeouts.append(timeout)
+                return changes.pop(0)
+
+        @asynccontextmanager
+        async def subscribe(task_id):
+            yield Subscription()
+
+        async def drain():
+            return [chunk async for chunk in _status_events("task")]
+
+        with mock.patch("backend.api.views.events.subscribe", subscribe), \
+                mock.patch("backend.api.views.get_status", side_effect=payloads):
+            return async_to_sync(drain)(), timeouts
+
+    @override_settings(PDF_EVENTS_MAX_SECONDS=300, PDF_EVENTS_KEEPALIVE=15)
+    def test_events_stream_changes_and_keepalives_until_terminal_state(self):
+        started = {"task_id": "task", "status": "STARTED"}
+        chunks, timeouts = self._stream(
+            [started, dict(started), {"task_id": "task", "status": "SUCCESS"}],
+            [False, True, True],
+        )
+        self.assertEqual([chunk.split("\n")[0] for chunk in chunks], ["event: status", ": keepalive", "event: status"])
+        self.assertIn('"status": "STARTED"', chunks[0])
+        self.assertIn('"status": "SUCCESS"', chunks[2])
+        # Повтор того же статуса не шлётся; между событиями ждём не дольше keepalive
+        self.assertEqual(timeouts, [15, 15, 15])
+
+    @override_settings(PDF_EVENTS_MAX_SECONDS=0)
+    def test_events_stream_ends_at_deadline(self):
+        chunks, timeouts = self._stream([{"task_id": "task", "status": "STARTED"}], [])
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(timeouts, [])
+
+    def test_batch_lookup_uses_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("pdf_status_batch"), {"task_ids": "single,group,unknown"})
+        self.assertEqual([row["status"] for row in response.json()["results"]], ["SUCCESS", "STARTED", "PENDING"])
+
+
+@override_settings(USE_S3=False, PDF_PIPELINE=False, PDF_BATCH_SIZE=2)
+class GeneratePDFBatchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_endpoint_validates_and_enqueues_in_batches(self):
+        from .tasks import generate_pdf_batch
+
+        url = reverse("generate_pdf_batch")
+        for body in ({}, {"report_ids": []}, {"report_ids": "1,2"}, {"report_ids": [1, "x"]}):
+            self.assertEqual(self.client.post(url, body, content_type="application/json").status_code, 400)
+
+        ids = [Invoice.objects.create(company_name="Acme", address="Main st", item_count=1).id for _ in range(5)]
+        empty = Invoice.objects.create(company_name="Acme", address="Main st").id
+        with mock.patch.object(generate_pdf_batch, "apply_async") as apply_async:
+            body = [ids[2], ids[0], ids[2], str(ids[1]), ids[4], ids[3], empty]
+            response = self.client.post(url, {"report_ids": body}, content_type="application/json")
+            # Уже стоящие в очереди инвойсы второй раз не ставятся
+            again = self.client.post(url, {"report_ids": ids}, content_type="application/json")
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()["count"], 6)
+        chunks = [call.kwargs["args"][0] for call in apply_async.call_args_list]
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual(sorted(sum(chunks, [])), ids)
+        self.assertEqual(response.json()["task_ids"], [call.kwargs["task_id"] for call in apply_async.call_args_list])
+        self.assertEqual(again.json()["task_ids"], [])
+        self.assertEqual(
+            sorted(TaskStatus.objects.filter(status=TaskStatus.Status.QUEUED).values_list("invoice_id", flat=True)), ids
+        )
+
+    def test_task_writes_a_row_per_invoice_including_missing_ones(self):
+        import io
+        from contextlib import contextmanager
+
+        from .status_lookup import get_status
+        from .tasks import generate_pdf_batch
+
+        invoices = [Invoice.objects.create(company_name="Acme", address="Main st") for _ in range(2)]
+        for invoice in invoices:
+            InvoiceItem.objects.create(invoice=invoice, name="Widget", quantity=1, unit_price=Decimal("2.50"))
+        missing = invoices[-1].id + 100
+
+        @contextmanager
+        def rendered_pdf(html):
+            yield io.BytesIO(b"%PDF-1.4")
+
+        output = tempfile.TemporaryDirectory()
+        self.addCleanup(output.cleanup)
+        with override_settings(PDF_OUTPUT_DIR=output.name), mock.patch("backend.api.tasks.rendered_pdf", rendered_pdf):
+            result = generate_pdf_batch.apply(args=[[invoices[0].id, missing, invoices[1].id]], task_id="batch-1").result
+
+        self.assertEqual(result["completed"], 2)
+        rows = dict(TaskStatus.objects.filter(task_id__startswith="batch-1:").values_list("task_id", "status"))
+        self.assertEqual(rows, {
+            f"batch-1:{invoices[0].id}": TaskStatus.Status.COMPLETED,
+            f"batch-1:{invoices[1].id}": TaskStatus.Status.COMPLETED,
+            f"batch-1:{missing}": TaskStatus.Status.FAILED,
+        })
+        self.assertTrue(Path(output.name, invoices[0].get_pdf_filename()).exists())
+
+        payload = get_status("batch-1")
+        self.assertEqual(payload["status"], "FAILURE")
+        self.assertEqual(
+            [(row["report_id"], row["status"], row["error"]) for row in payload["result"]],
+            [(invoices[0].id, "completed", None), (invoices[1].id, "completed", None), (missing, "failed", "Invoice not found")],
+        )
+
+
+@override_settings(USE_S3=False)
+class RenderCacheTests(TestCase):
+    def setUp(self):
+        output = tempfile.TemporaryDirectory()
+        self.addCleanup(output.cleanup)
+        self.enterContext(override_settings(PDF_OUTPUT_DIR=output.name))
+        customer = Customer.objects.create(name="Jan", email="jan@example.com")
+        self.invoice = Invoice.objects.create(customer=customer, company_name="Acme", address="Main st")
+        self.item = InvoiceItem.objects.create(invoice=self.invoice, name="Widget", quantity=2, unit_price=Decimal("2.50"))
+
+    def render_hash(self):
+        from .render_cache import compute_render_hash
+        from .tasks import REPORT_TEMPLATE, _build_context
+
+        invoice = Invoice.objects.select_related("customer").prefetch_related("items").get(pk=self.invoice.pk)
+        return compute_render_hash(invoice, _build_context(invoice), REPORT_TEMPLATE)
+
+    def test_hash_changes_only_with_rendered_content(self):
+        original = self.render_hash()
+        self.assertEqual(self.render_hash(), original)
+
+        self.item.quantity = 3
+        self.item.save()
+        edited = self.render_hash()
+        self.assertNotEqual(edited, original)
+
+        Customer.objects.filter(pk=self.invoice.customer_id).update(name="Jan Kowalski")
+        renamed = self.render_hash()
+        self.assertNotEqual(renamed, edited)
+
+        with mock.patch("backend.api.render_cache.template_version", return_value="edited-template"):
+            self.assertNotEqual(self.render_hash(), renamed)
+
+    def test_cached_only_with_matching_hash_and_stored_pdf(self):
+        from .render_cache import is_cached
+
+        render_hash = self.render_hash()
+        self.invoice.render_hash = render_hash
+        self.assertFalse(is_cached(self.invoice, render_hash))
+
+        Path(self.invoice.get_pdf_path()).write_bytes(b"%PDF-1.4")
+        self.assertTrue(is_cached(self.invoice, render_hash))
+        self.assertFalse(is_cached(self.invoice, "0" * 64))
+
+    def test_item_save_renders_invoice_that_already_has_pdf(self):
+        Invoice.objects.filter(pk=self.invoice.pk).update(has_pdf=True, render_hash=self.render_hash())
+        Path(self.invoice.get_pdf_path()).write_bytes(b"%PDF-1.4")
+
+        with mock.patch("backend.api.tasks.render_task") as render_task, self.captureOnCommitCallbacks(execute=True):
+            # Своя транзакция: позиция из setUp ждёт коммита внешней, которого в TestCase не будет
+            with transaction.atomic():
+                InvoiceItem.objects.create(invoice=self.invoice, name="Gadget", quantity=1, unit_price=Decimal("1.00"))
+        self.assertEqual(render_task.return_value.apply_async.call_args.kwargs["args"], [self.invoice.id])
+
+
+class WarmRendererTests(TestCase):
+    def test_fetch_cache_is_lru_and_returns_copies(self):
+        import io
+
+        from .renderer import WarmRenderer
+
+        renderer = WarmRenderer(fetch_cache_size=2)
+        fetched = []
+
+        def fetch(url, *args, **kwargs):
+            fetched.append(url)
+            return {"file_obj": io.BytesIO(url.encode()), "mime_type": "text/css"}
+
+        with mock.patch("backend.api.renderer.default_url_fetcher", side_effect=fetch):
+            for url in ("http://a", "http://b", "http://a", "http://c", "http://a", "http://b"):
+                result = renderer.url_fetcher(url)
+            # c вытеснил b (a был использован позже), b скачан заново и вытеснил c
+            self.assertEqual(fetched, ["http://a", "http://b", "http://c", "http://b"])
+            self.assertEqual(list(renderer._fetch_cache), ["http://a", "http://b"])
+
+            result["string"] = b"changed"
+            self.assertEqual(renderer.url_fetcher("http://b")["string"], b"http://b")
+
+    @override_settings(PDF_RENDER_POOL_SIZE=2)
+    def test_pool_only_outside_daemonic_processes(self):
+        import billiard.process
+
+        from . import renderer
+
+        for mp_daemon, billiard_daemon, expect_pool in ((False, False, True), (True, False, False), (False, True, False)):
+            with mock.patch.object(renderer, "_pool", None), mock.patch.object(renderer, "_pool_disabled", False), \
+                    mock.patch.object(renderer, "create_pool") as create_pool, \
+                    mock.patch("multiprocessing.current_process", return_value=mock.Mock(daemon=mp_daemon)), \
+                    mock.patch.object(billiard.process, "current_process", return_value=mock.Mock(daemon=billiard_daemon)):
+                pool = renderer.get_pool()
+                # Решение запоминается: второй вызов не проверяет процесс заново
+                self.assertIs(renderer.get_pool(), pool)
+            self.assertEqual(pool is not None, expect_pool)
+            self.assertEqual(create_pool.call_count, int(expect_pool))
+
+
+class PDFStreamingTests(TestCase):
+    PDF = b"%PDF-1.4 " + b"x" * 100
+
+    def write_pdf(self, target):
+        if isinstance(target, str):
+            Path(target).write_bytes(self.PDF)
+        else:
+            target.write(self.PDF)
+
+    @override_settings(PDF_SPOOL_MAX_MEMORY=16)
+    def test_rendered_pdf_spools_in_process_render(self):
+        from .renderer import rendered_pdf
+
+        renderer = mock.Mock()
+        renderer.render.side_effect = lambda html, base_url, target: self.write_pdf(target)
+        with mock.patch("backend.api.renderer.get_pool", return_value=None), \
+                mock.patch("backend.api.renderer.get_renderer", return_value=renderer):
+            with rendered_pdf("<html></html>") as pdf_file:
+                # Больше PDF_SPOOL_MAX_MEMORY — уже на диске, а не в памяти
+                self.assertTrue(pdf_file._rolled)
+                self.assertEqual(pdf_file.read(), self.PDF)
+
+    def test_rendered_pdf_from_pool_is_written_by_renderer_process(self):
+        from .renderer import rendered_pdf
+
+        def submit(fn, html, base_url, target_path):
+            self.write_pdf(target_path)
+            return mock.Mock(result=lambda timeout: None)
+
+        pool = mock.Mock(submit=mock.Mock(side_effect=submit))
+        with mock.patch("backend.api.renderer.get_pool", return_value=pool):
+            with rendered_pdf("<html></html>") as pdf_file:
+                self.assertEqual(pdf_file.read(), self.PDF)
+                path = pdf_file.name
+        self.assertFalse(Path(path).exists())
+
+    def test_store_pdf_copies_the_file_locally(self):
+        import io
+
+        from .tasks import _store_pdf
+
+        invoice = Invoice.objects.create(company_name="Acme", address="Main st")
+        output = tempfile.TemporaryDirectory()
+        self.addCleanup(output.cleanup)
+        with override_settings(USE_S3=False, PDF_OUTPUT_DIR=output.name):
+            path = _store_pdf(invoice, io.BytesIO(self.PDF), "hash")
+
+        self.assertEqual(Path(path).read_bytes(), self.PDF)
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.has_pdf, invoice.render_hash), (True, "hash"))
+
+    @override_settings(USE_S3=True)
+    def test_store_pdf_streams_the_file_object_to_s3(self):
+        import io
+
+        from .tasks import _store_pdf
+
+        invoice = Invoice.objects.create(company_name="Acme", address="Main st")
+        pdf_file = io.BytesIO(self.PDF)
+        storage = mock.Mock(bucket_name="pdfs", location="invoices/pdfs")
+        with mock.patch("backend.api.tasks.PDFStorage", return_value=storage), \
+                mock.patch("backend.api.tasks.invalidate_pdf_url") as invalidate:
+            url = _store_pdf(invoice, pdf_file, "hash")
+
+        name, content = storage.save.call_args.args
+        self.assertEqual(name, invoice.get_pdf_filename())
+        # В storage уходит сам файл, без чтения в bytes
+        self.assertIs(content.file, pdf_file)
+        self.assertEqual(url, f"https://pdfs.s3.amazonaws.com/invoices/pdfs/{invoice.get_pdf_filename()}")
+        invalidate.assert_called_once_with(invoice.id)
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.pdf_url, invoice.has_pdf, invoice.render_hash), (url, True, "hash"))
+
+
+class RenderTriggerTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch("backend.api.triggers.enqueue_pdf_renders")
+        self.enqueue = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def enqueued(self):
+        return [call.args[0] for call in self.enqueue.call_args_list]
+
+    def test_one_enqueue_per_commit_with_deduplicated_ids(self):
+        from .triggers import mark_invoice_dirty
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for invoice_id in (2, 1, 2, 1):
+                mark_invoice_dirty(invoice_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            mark_invoice_dirty(3)
+        self.assertEqual(self.enqueued(), [[1, 2], [3]])
+
+    def test_rolled_back_changes_are_not_rendered(self):
+        from .triggers import mark_invoice_dirty
+
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    mark_invoice_dirty(1)
+                    raise RuntimeError("rollback")
+            except RuntimeError:
+                pass
+            mark_invoice_dirty(2)
+        self.assertEqual(self.enqueued(), [[2]])
+
+
+class InvoiceBulkCreateTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch("backend.api.triggers.enqueue_pdf_renders")
+        self.enqueue = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def invoice(self, email, name="Ann", items=1):
+        return {
+            "company_name": "Acme",
+            "address": "Main st",
+            "customer": {"name": name, "email": email, "phone": "", "address": ""},
+            "items": [{"name": f"Widget {n}", "quantity": 2, "unit_price": "1.50"} for n in range(items)],
+        }
+
+    def test_bulk_endpoint_creates_invoices_and_upserts_customers(self):
+        Customer.objects.create(name="Old name", email="ann@example.com")
+
+        url = reverse("invoice_bulk_create")
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, [
+                self.invoice("ann@example.com", name="Ann", items=2),
+                self.invoice("bob@example.com", name="Bob"),
+                self.invoice("ann@example.com", name="Ann B."),
+                self.invoice("", name="Nobody"),
+            ], content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        ids = response.json()["ids"]
+        self.assertEqual(response.json()["count"], 4)
+
+        invoices = Invoice.objects.in_bulk(ids)
+        self.assertEqual((invoices[ids[0]].item_count, invoices[ids[0]].total), (2, Decimal("6.00")))
+        self.assertEqual(invoices[ids[0]].customer_id, invoices[ids[2]].customer_id)
+        self.assertEqual(Customer.objects.get(email="ann@example.com").name, "Ann B.")
+        self.assertEqual(Customer.objects.filter(email="ann@example.com").count(), 1)
+        self.assertIsNone(invoices[ids[3]].customer.email)
+        self.assertEqual(self.enqueue.call_args.args[0], sorted(ids))
+
+    def test_bulk_endpoint_rejects_bad_payloads(self):
+        url = reverse("invoice_bulk_create")
+        for body in ({}, [], [self.invoice("ann@example.com", items=0)]):
+            self.assertEqual(self.client.post(url, body, content_type="application/json").status_code, 400)
+
+        with override_settings(INVOICE_BULK_MAX=2):
+            response = self.client.post(url, [self.invoice(f"{n}@example.com") for n in range(3)], content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("At most 2", response.json()["error"])
+        self.assertFalse(Invoice.objects.exists())
+
+    def test_upsert_many_matches_by_email(self):
+        existing = Customer.objects.create(name="Old", email="ann@example.com", phone="1")
+        rendered = Invoice.objects.create(customer=existing, company_name="Acme", address="Main st")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            customers = Customer.upsert_many([
+                {"name": "Ann", "email": "ann@example.com", "phone": "2", "address": ""},
+                {"name": "Bob", "email": "bob@example.com", "phone": "", "address": ""},
+                {"name": "Nobody", "email": "", "phone": "", "address": ""},
+                {"name": "Nobody", "email": None, "phone": "", "address": ""},
+            ])
+
+        self.assertEqual(customers[0].pk, existing.pk)
+        existing.refresh_from_db()
+        self.assertEqual((existing.name, existing.phone), ("Ann", "2"))
+        self.assertIsNotNone(customers[1].pk)
+        self.assertEqual(customers[2].pk, customers[3].pk)
+        self.assertIsNone(customers[2].email)
+        self.assertEqual(Customer.objects.count(), 3)
+        # Данные клиента изменились — его старый инвойс рендерится заново; без изменений — нет
+        self.assertEqual(self.enqueue.call_args.args[0], [rendered.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            Customer.upsert_many([{"name": "Ann", "email": "ann@example.com", "phone": "2", "address": ""}])
+        self.assertEqual(self.enqueue.call_count, 1)
+
+    def test_blank_emails_do_not_collide(self):
+        Customer.objects.create(name="A", email="")
+        Customer.objects.create(name="B", email="")
+        self.assertEqual(Customer.objects.filter(email__isnull=True).count(), 2)
+
+
+class InvoiceDenormTests(TestCase):
+    def setUp(self):
+        self.invoice = Invoice.objects.create(company_name="Acme", address="Main st")
+
+    def stored(self):
+        return Invoice.objects.values_list("item_count", "total", "latest_task", "latest_status").get(pk=self.invoice.pk)
+
+    def test_refresh_totals_recomputes_counts_and_exact_totals(self):
+        InvoiceItem.objects.bulk_create([
+            InvoiceItem(invoice=self.invoice, name="A", quantity=3, unit_price=Decimal("0.10")),
+            InvoiceItem(invoice=self.invoice, name="B", quantity=1, unit_price=Decimal("2.25")),
+        ])
+        self.assertEqual(self.stored()[:2], (0, Decimal("0.00")))
+
+        Invoice.refresh_totals([self.invoice.pk])
+        self.assertEqual(self.stored()[:2], (2, Decimal("2.55")))
+
+        InvoiceItem.objects.filter(name="A").delete()
+        Invoice.refresh_totals([self.invoice.pk])
+        self.assertEqual(self.stored()[:2], (1, Decimal("2.25")))
+
+    def test_mark_transitions_sync_only_the_latest_task(self):
+        old = TaskStatus.start_or_update(self.invoice, "old")
+        self.assertEqual(self.stored()[2:], (old.pk, TaskStatus.Status.QUEUED))
+        old.mark_started()
+        self.assertEqual(self.stored()[3], TaskStatus.Status.RUNNING)
+
+        new = TaskStatus.start_or_update(self.invoice, "new")
+        old.mark_failed("boom")
+        self.assertEqual(self.stored()[2:], (new.pk, TaskStatus.Status.QUEUED))
+
+        new.mark_started()
+        new.mark_completed()
+        self.assertEqual(self.stored()[2:], (new.pk, TaskStatus.Status.COMPLETED))
+
+    def test_sync_command_verifies_and_repairs(self):
+        import io
+
+        from django.core.management import call_command
+
+        InvoiceItem.objects.create(invoice=self.invoice, name="A", quantity=2, unit_price=Decimal("1.50"))
+        task = TaskStatus.start_or_update(self.invoice, "t1")
+        Invoice.objects.filter(pk=self.invoice.pk).update(
+            item_count=0, total=Decimal("0.00"), latest_task=None, latest_status=None
+        )
+
+        out = io.StringIO()
+        call_command("sync_invoice_denorm", "--verify-only", stdout=out)
+        self.assertIn("1 invoice(s) out of sync", out.getvalue())
+        self.assertEqual(self.stored(), (0, Decimal("0.00"), None, None))
+
+        out = io.StringIO()
+        call_command("sync_invoice_denorm", "--batch-size", "1", stdout=out)
+        self.assertIn("Updated 1 invoice(s); 0 still out of sync", out.getvalue())
+        self.assertEqual(self.stored(), (1, Decimal("3.00"), task.pk, TaskStatus.Status.QUEUED))
+
+
+class HeartbeatTests(TestCase):
+    def test_beat_only_touches_running_rows(self):
+        from .heartbeat import Heartbeat
+
+        invoice = Invoice.objects.create(company_name="Acme", address="Main st")
+        task = TaskStatus.objects.create(invoice=invoice, task_id="t1", status=TaskStatus.Status.QUEUED)
+        heartbeat = Heartbeat(task, interval=60)
+
+        self.assertEqual(heartbeat.beat(), 0)
+        task.mark_started()
+        before = task.heartbeat_at
+        self.assertEqual(heartbeat.beat(), 1)
+        task.refresh_from_db()
+        self.assertGreaterEqual(task.heartbeat_at, before)
+
+        task.mark_stale()
+        stale_at = task.heartbeat_at
+        self.assertEqual(heartbeat.beat(), 0)
+        task.refresh_from_db()
+        self.assertEqual(task.heartbeat_at, stale_at)
+
+    def test_thread_beats_until_exit_and_survives_errors(self):
+        import threading
+
+        from .heartbeat import Heartbeat
+
+        beats = threading.Semaphore(0)
+
+        def beat(self):
+            beats.release()
+            raise RuntimeError("db down")
+
+        with mock.patch.object(Heartbeat, "beat", beat):
+            with Heartbeat(TaskStatus(pk=1), interval=0.01) as heartbeat:
+                # Ошибка в beat() не останавливает поток
+                for _ in range(3):
+                    self.assertTrue(beats.acquire(timeout=5))
+            self.assertFalse(heartbeat._thread.is_alive())
+
+
+class StaleTaskSweepTests(TestCase):
+    def running(self, invoice, task_id, heartbeat_minutes_ago):
+        from datetime import timedelta
+
+        from django.utils.timezone import now
+
+        task = TaskStatus.start_or_update(invoice, task_id)
+        TaskStatus.objects.filter(pk=task.pk).update(
+            status=TaskStatus.Status.RUNNING,
+            started_at=now() - timedelta(minutes=heartbeat_minutes_ago + 1),
+            heartbeat_at=now() - timedelta(minutes=heartbeat_minutes_ago),
+        )
+        return task
+
+    def invoice(self):
+        invoice = Invoice.objects.create(company_name="Acme", address="Main st")
+        InvoiceItem.objects.create(invoice=invoice, name="Widget", quantity=1, unit_price=Decimal("1.00"))
+        return invoice
+
+    def test_epoch_matches_python_timestamp(self):
+        from datetime import datetime, timezone
+
+        from .models import Epoch
+
+        started = datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+        TaskStatus.objects.create(task_id="t", started_at=started)
+        value = TaskStatus.objects.annotate(epoch=Epoch("started_at")).get().epoch
+        self.assertAlmostEqual(value, started.timestamp(), places=2)
+
+    def test_sweep_fails_only_silent_running_tasks(self):
+        from datetime import timedelta
+
+        from django.utils.timezone import now
+
+        stale, fresh, superseded = self.invoice(), self.invoice(), self.invoice()
+        stale_task = self.running(stale, "stale", heartbeat_minutes_ago=10)
+        self.running(fresh, "fresh", heartbeat_minutes_ago=0)
+        self.running(superseded, "old", heartbeat_minutes_ago=10)
+        TaskStatus.start_or_update(superseded, "new")
+
+        count, invoice_ids = TaskStatus.sweep_stale(now() - timedelta(minutes=5))
+
+        self.assertEqual((count, invoice_ids), (2, [stale.id]))
+        stale_task.refresh_from_db()
+        self.assertEqual((stale_task.status, stale_task.error_message), (TaskStatus.Status.FAILED, TaskStatus.STALE_MESSAGE))
+        self.assertAlmostEqual(stale_task.duration_seconds, (stale_task.finished_at - stale_task.started_at).total_seconds(), places=1)
+        # Инвойсы, чья последняя задача не тронута, сохраняют свой статус
+        statuses = dict(Invoice.objects.values_list("id", "latest_status"))
+        self.assertEqual(statuses, {
+            stale.id: TaskStatus.Status.FAILED,
+            fresh.id: TaskStatus.Status.QUEUED,
+            superseded.id: TaskStatus.Status.QUEUED,
+        })
+        self.assertEqual(TaskStatus.sweep_stale(now() - timedelta(minutes=5)), (0, []))
+
+    @override_settings(STALE_TASK_REQUEUE=True, STALE_REQUEUE_CONCURRENCY=2, PDF_BATCH_SIZE=1)
+    def test_requeue_keeps_at_most_n_batches_in_flight(self):
+        from .tasks import check_stuck_tasks, generate_pdf_batch
+
+        invoices = [self.invoice() for _ in range(5)]
+        for invoice in invoices:
+            self.running(invoice, f"t{invoice.id}", heartbeat_minutes_ago=10)
+
+        with mock.patch.object(generate_pdf_batch, "apply_async") as apply_async:
+            result = check_stuck_tasks()
+
+        self.assertEqual((result["stale_tasks"], result["stale_invoices"], result["requeued"]), (5, 5, 5))
+        self.assertEqual(len(result["task_ids"]), 5)
+        # Две полосы: первые батчи опубликованы, остальные едут в kwargs["lane"]
+        self.assertEqual(apply_async.call_count, 2)
+        first_lane = apply_async.call_args_list[0].kwargs
+        self.assertEqual(first_lane["args"], [[invoices[0].id]])
+        self.assertEqual([chunk for chunk, _, _ in first_lane["kwargs"]["lane"]], [[invoices[2].id], [invoices[4].id]])
+        self.assertEqual(len(apply_async.call_args_list[1].kwargs["kwargs"]["lane"]), 1)
+
+        # Следующий батч полосы публикуется, даже если текущий упал
+        lane = first_lane["kwargs"]["lane"]
+        with mock.patch("backend.api.tasks._render_batch", side_effect=RuntimeError("boom")), \
+                mock.patch.object(generate_pdf_batch, "apply_async") as apply_async:
+            generate_pdf_batch.apply(args=first_lane["args"], kwargs={"lane": lane}, task_id=first_lane["task_id"])
+        self.assertEqual(apply_async.call_args.kwargs["args"], [lane[0][0]])
+        self.assertEqual(apply_async.call_args.kwargs["task_id"], lane[0][1])
+        self.assertEqual(apply_async.call_args.kwargs["kwargs"], {"lane": lane[1:]})
+
+
+class HealthProbeTests(TestCase):
+    def test_probe_db_drops_broken_connection_and_releases_it(self):
+        from . import probes
+
+        with mock.patch.object(probes, "connection") as conn:
+            execute = conn.cursor.return_value.__enter__.return_value.execute
+            execute.side_effect = RuntimeError("server closed the connection")
+            with self.assertRaises(RuntimeError):
+                probes.probe_db()
+            execute.side_effect = None
+            probes.probe_db()
+
+        self.assertEqual(conn.close_if_unusable_or_obsolete.call_count, 2)
+        self.assertEqual(conn.close.call_count, 2)
+
+    def test_snapshot_reports_results_errors_and_unchecked_probes(self):
+        from .probes import ProbeRunner
+
+        def broken():
+            raise ConnectionError("refused")
+
+        runner = ProbeRunner({"db": lambda: None, "broker": broken, "redis": lambda: "skipped"}, interval=10)
+        snapshot = runner.snapshot()
+        self.assertFalse(snapshot["ok"])
+        self.assertEqual(snapshot["probes"]["db"], {"ok": False, "error": "not checked yet", "stale": True})
+
+        runner.run_once()
+        probes = runner.snapshot()["probes"]
+        self.assertEqual((probes["db"]["ok"], probes["db"]["stale"]), (True, False))
+        self.assertEqual((probes["broker"]["ok"], probes["broker"]["error"]), (False, "refused"))
+        self.assertEqual(probes["redis"]["note"], "skipped")
+
+        runner.probes.pop("broker")
+        self.assertTrue(runner.snapshot()["ok"])
+
+    @override_settings(HEALTH_PROBE_STALE_AFTER=30)
+    def test_old_results_are_stale(self):
+        from .probes import ProbeRunner
+
+        runner = ProbeRunner({"db": lambda: None}, interval=10)
+        with mock.patch("backend.api.probes.time.time", return_value=1000.0):
+            runner.run_once()
+        with mock.patch("backend.api.probes.time.time", return_value=1031.0):
+            snapshot = runner.snapshot()
+        self.assertEqual((snapshot["probes"]["db"]["age_seconds"], snapshot["probes"]["db"]["stale"]), (31.0, True))
+        self.assertFalse(snapshot["ok"])
+
+
+@override_settings(AWS_STORAGE_BUCKET_NAME="pdfs", PDFFILES_LOCATION="invoices/pdfs", PDF_URL_EXPIRES=3600, PDF_URL_CACHE_MARGIN=300)
+class PresignedURLCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.invoice = Invoice.objects.create(company_name="Acme", address="Main st", has_pdf=True)
+        patcher = mock.patch("backend.api.downloads.pdf_s3_client")
+        self.sign = patcher.start().return_value.generate_presigned_url
+        self.sign.side_effect = lambda *args, **kwargs: f"https://signed/{self.sign.call_count}"
+        self.addCleanup(patcher.stop)
+
+    def test_url_is_cached_until_the_margin_before_expiry(self):
+        from .downloads import presigned_pdf_url
+
+        with mock.patch("time.time", return_value=1000.0):
+            self.assertEqual(presigned_pdf_url(self.invoice.id), "https://signed/1")
+        self.assertEqual(self.sign.call_args.kwargs["ExpiresIn"], 3600)
+        self.assertEqual(self.sign.call_args.kwargs["Params"]["Key"], f"invoices/pdfs/{self.invoice.get_pdf_filename()}")
+
+        with mock.patch("time.time", return_value=1000.0 + 3299), self.assertNumQueries(0):
+            self.assertEqual(presigned_pdf_url(self.invoice.id), "https://signed/1")
+        with mock.patch("time.time", return_value=1000.0 + 3301):
+            self.assertEqual(presigned_pdf_url(self.invoice.id), "https://signed/2")
+
+    @override_settings(PDF_URL_CACHE_MARGIN=3600)
+    def test_url_is_not_cached_when_margin_covers_expiry(self):
+        from .downloads import presigned_pdf_url
+
+        presigned_pdf_url(self.invoice.id)
+        presigned_pdf_url(self.invoice.id)
+        self.assertEqual(self.sign.call_count, 2)
+
+    def test_missing_pdf_is_not_signed(self):
+        from .downloads import presigned_pdf_url
+
+        Invoice.objects.filter(pk=self.invoice.pk).update(has_pdf=False)
+        self.assertIsNone(presigned_pdf_url(self.invoice.id))
+        self.sign.assert_not_called()
+
+    @override_settings(USE_S3=True)
+    def test_re_render_drops_the_cached_url(self):
+        import io
+
+        from .downloads import presigned_pdf_url
+        from .tasks import _store_pdf
+
+        self.assertEqual(presigned_pdf_url(self.invoice.id), "https://signed/1")
+        storage = mock.Mock(bucket_name="pdfs", location="invoices/pdfs")
+        with mock.patch("backend.api.tasks.PDFStorage", return_value=storage):
+            _store_pdf(self.invoice, io.BytesIO(b"%PDF-1.4"), "hash")
+        self.assertEqual(presigned_pdf_url(self.invoice.id), "https://signed/2")
+
+
+class DatabasePoolSettingsTests(TestCase):
+    def load_settings(self, **env):
+        import os
+        import runpy
+
+        from django.conf import settings
+
+        # base.py настраивает logging при импорте — здесь это не нужно
+        with mock.patch.dict(os.environ, env), mock.patch("logging.config.dictConfig"):
+            for name in ("DB_POOL", "DB_ROLE", "GUNICORN_THREADS", "DB_POOL_MAX_SIZE_WEB"):
+                if name not in env:
+                    os.environ.pop(name, None)
+            return runpy.run_path(str(settings.BASE_DIR / "settings" / "base.py"))
+
+    def test_web_pool_covers_request_threads_and_probe(self):
+        self.assertEqual(self.load_settings()["POSTGRES_CONNECTION"]["OPTIONS"]["pool"]["max_size"], 6)
+        self.assertEqual(self.load_settings(GUNICORN_THREADS="8")["DB_POOL_MAX_SIZE"], 10)
+        self.assertEqual(self.load_settings(GUNICORN_THREADS="8", DB_POOL_MAX_SIZE_WEB="3")["DB_POOL_MAX_SIZE"], 3)
+        self.assertEqual(self.load_settings(DB_ROLE="worker")["DB_POOL_MAX_SIZE"], 2)
+
+    def test_db_pool_false_falls_back_to_persistent_connections(self):
+        connection_settings = self.load_settings(DB_POOL="FALSE", DB_CONN_MAX_AGE="30")["POSTGRES_CONNECTION"]
+        self.assertNotIn("pool", connection_settings["OPTIONS"])
+        self.assertEqual(connection_settings["CONN_MAX_AGE"], 30)
+        self.assertTrue(connection_settings["CONN_HEALTH_CHECKS"])
+        self.assertEqual(connection_settings["OPTIONS"]["application_name"], "invoices-web")
+
+        pooled = self.load_settings()["POSTGRES_CONNECTION"]
+        self.assertEqual(pooled["CONN_MAX_AGE"], 0)
+
+
+class DBStatusViewTests(TestCase):
+    def test_reports_postgres_activity_and_pool_stats(self):
+        with mock.patch("backend.api.views.connection") as conn:
+            cursor = conn.cursor.return_value.__enter__.return_value
+            cursor.fetchone.side_effect = [("PostgreSQL 17.5",), (7,)]
+            cursor.fetchall.return_value = [("invoices-web", "idle", 4), ("invoices-worker", "active", 2), (None, None, 1)]
+            conn.pool.get_stats.return_value = {"pool_size": 3, "pool_available": 2}
+            conn.settings_dict = {"CONN_MAX_AGE": 0}
+            response = self.client.get(reverse("db_status"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            "ok": True,
+            "postgres_version": "PostgreSQL 17.5",
+            "active_connections": 7,
+            "connections_by_application": {
+                "invoices-web": {"idle": 4}, "invoices-worker": {"active": 2}, "": {"unknown": 1},
+            },
+            "role": "web",
+            "conn_max_age": 0,
+            "pool": {"pool_size": 3, "pool_available": 2},
+        })
+
+    def test_errors_are_reported_as_500(self):
+        with mock.patch("backend.api.views.connection") as conn:
+            conn.cursor.side_effect = RuntimeError("pool timeout")
+            response = self.client.get(reverse("db_status"))
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json(), {"ok": False, "error": "pool timeout"})
+
+
+class LocalPDFDownloadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.invoice = Invoice.objects.create(company_name="ACME", address="Street 1", has_pdf=True)
+
+    def setUp(self):
+        output_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(output_dir.cleanup)
+        Path(output_dir.name, self.invoice.get_pdf_filename()).write_bytes(b"%PDF-1.7 0123456789")
+        self.enterContext(override_settings(USE_S3=False, PDF_OUTPUT_DIR=output_dir.name))
+        self.url = reverse("download_pdf", args=[self.invoice.id])
+
+    def test_conditional_get_returns_304(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"%PDF-1.7 0123456789")
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]).status_code, 304)
+
+    def test_range_request(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=9-12")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 9-12/19")
+        self.assertEqual(b"".join(response.streaming_content), b"0123")
+
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE="bytes=100-").status_code, 416)
+
+    @override_settings(PDF_ACCEL_REDIRECT_LOCATION="/protected-pdfs/")
+    def test_accel_redirect_hands_file_to_nginx(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response["X-Accel-Redirect"], f"/protected-pdfs/{self.invoice.get_pdf_filename()}")
+        self.assertEqual(response.content, b"")
+
+        Invoice.objects.filter(pk=self.invoice.pk).update(has_pdf=False)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class QueryMetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        customer = Customer.objects.create(name="Metrics")
+        invoice = Invoice.objects.create(customer=customer, company_name="ACME", address="Street 1")
+        InvoiceItem.objects.create(invoice=invoice, name="Item", quantity=1, unit_price=Decimal("1.00"))
+
+    def test_request_metrics_in_log_and_server_timing(self):
+        with self.assertLogs("backend.api.instrumentation", "INFO") as logs:
+            response = self.client.get(reverse("invoice_list_create"))
+        record = logs.records[-1]
+        self.assertEqual(record.view, "invoice_list_create")
+        self.assertEqual(record.db_queries, 2)
+        self.assertIn("invoice", record.db_slowest_sql.lower())
+        self.assertIn('db;dur=', response["Server-Timing"])
+        self.assertIn('desc="2 queries"', response["Server-Timing"])
+
+    @override_settings(SLOW_REQUEST_MS=0, QUERY_METRICS_DUMP_SAMPLE_RATE=1.0)
+    def test_slow_request_dumps_sampled_query_list(self):
+        with self.assertLogs("backend.api.instrumentation", "WARNING") as logs:
+            self.client.get(reverse("invoice_list_create"))
+        self.assertEqual(len(logs.records[-1].queries), 2)
+
+    def test_task_metrics(self):
+        from .tasks import check_stuck_tasks
+
+        with self.assertLogs("backend.api.instrumentation", "INFO") as logs:
+            check_stuck_tasks.apply()
+        record = logs.records[-1]
+        self.assertEqual(record.task, "check_stuck_tasks")
+        self.assertGreaterEqual(record.db_queries, 1)
+
+
+@override_settings(METRICS_TOKEN="scrape-secret")
+class MetricsEndpointTests(TestCase):
+    def test_refused_without_valid_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer wrong").status_code, 403)
+        self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="scrape-secret").status_code, 403)
+        with override_settings(METRICS_TOKEN=""):
+            self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer ").status_code, 403)
+
+    def test_task_counts_and_celery_durations(self):
+        from .tasks import check_stuck_tasks
+
+        customer = Customer.objects.create(name="Metrics")
+        invoice = Invoice.objects.create(customer=customer, company_name="ACME", address="Street 1")
+        TaskStatus.create_queued({invoice.id: "queued-1"})
+        check_stuck_tasks.apply()
+
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer scrape-secret")
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('pdf_tasks{status="queued"} 1.0', body)
+        self.assertIn('pdf_tasks{status="failed"} 0.0', body)
+        self.assertIn('celery_task_duration_seconds_count{state="SUCCESS",task="check_stuck_tasks"}', body)
+
+    def test_stale_renders_count_swept_tasks(self):
+        from datetime import timedelta
+
+        from django.utils.timezone import now
+        from prometheus_client import REGISTRY
+
+        from .tasks import check_stuck_tasks
+
+        def stale_total():
+            return REGISTRY.get_sample_value("pdf_renders_total", {"outcome": "stale"}) or 0
+
+        invoice = Invoice.objects.create(company_name="ACME", address="Street 1")
+        silent = now() - timedelta(hours=1)
+        for task_id in ("stale-1", "stale-2"):
+            TaskStatus.objects.create(
+                invoice=invoice, task_id=task_id, status=TaskStatus.Status.RUNNING, started_at=silent, heartbeat_at=silent,
+            )
+        before = stale_total()
+        result = check_stuck_tasks.apply().result
+
+        # Строки не последние у инвойса (latest_task не указывает на них) — в счётчике всё равно обе, как и в логе
+        self.assertEqual((result["stale_tasks"], result["stale_invoices"]), (2, 0))
+        self.assertEqual(stale_total() - before, 2)
+
+
+@override_settings(AWS_STORAGE_BUCKET_NAME="logos")
+class LogoCacheTests(TestCase):
+    def setUp(self):
+        from .logo_cache import LogoCache
+
+        self.directory = Path(tempfile.mkdtemp())
+        self.s3 = mock.Mock()
+        self.s3.get_object.side_effect = lambda **params: {
+            "Body": mock.Mock(read=lambda: b"\x89PNG" + params["Key"].encode()),
+            "ETag": '"v1"',
+            "ContentType": "image/png",
+        }
+        patcher = mock.patch("backend.api.logo_cache.pdf_s3_client", return_value=self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.make_cache = lambda **kwargs: LogoCache(
+            self.directory, **{"max_bytes": 1024, "memory_items": 8, "revalidate_after": 3600, **kwargs}
+        )
+
+    def test_memory_then_disk_hits(self):
+        from .logo_cache import logo_url
+
+        cache = self.make_cache()
+        first = cache.fetch(logo_url("acme.png"))
+        self.assertEqual(first["mime_type"], "image/png")
+        self.assertEqual(cache.fetch(logo_url("acme.png"))["string"], first["string"])
+
+        # Другой процесс на том же хосте — попадание в дисковый кэш
+        other = self.make_cache()
+        self.assertEqual(other.fetch(logo_url("acme.png"))["string"], first["string"])
+        self.assertEqual(self.s3.get_object.call_count, 1)
+        self.assertEqual((cache.stats["download"], cache.stats["memory"], other.stats["disk"]), (1, 1, 1))
+        self.assertEqual(other.stats["bytes_saved"], len(first["string"]))
+
+    def test_stale_entry_is_revalidated_by_etag(self):
+        from botocore.exceptions import ClientError
+
+        self.make_cache().get("acme.png")
+        self.s3.get_object.side_effect = ClientError({"Error": {"Code": "304"}}, "GetObject")
+        cache = self.make_cache(revalidate_after=-1)
+        cache.get("acme.png")
+        self.assertEqual(self.s3.get_object.call_args.kwargs["IfNoneMatch"], '"v1"')
+        self.assertEqual(cache.stats["revalidated"], 1)
+
+    def test_lru_eviction_by_size(self):
+        cache = self.make_cache(max_bytes=100)
+        for n in range(10):
+            cache.get(f"logo-{n}.png")
+        stored = sum(path.stat().st_size for path in self.directory.glob("*.bin"))
+        self.assertLessEqual(stored, 100)
+        self.assertIsNotNone(cache._from_disk("logo-9.png"))
+        self.assertIsNone(cache._from_disk("logo-0.png"))
+
+
+class LogoVariantTests(TestCase):
+    @staticmethod
+    def encode(image, fmt):
+        import io
+
+        buffer = io.BytesIO()
+        image.save(buffer, fmt)
+        return buffer.getvalue()
+
+    def test_large_raster_is_downscaled_and_keeps_alpha(self):
+        import io
+
+        from PIL import Image
+
+        from .logo_variants import build_variant
+
+        photo = Image.effect_noise((3000, 1500), 64).convert("RGB")
+        data, ext, width, height = build_variant(self.encode(photo, "JPEG"), "acme.jpg")
+        self.assertEqual((ext, width, height), ("jpg", 320, 160))
+        self.assertEqual(Image.open(io.BytesIO(data)).size, (320, 160))
+
+        transparent = Image.new("RGBA", (2400, 600), (10, 20, 30, 0))
+        data, ext, width, height = build_variant(self.encode(transparent, "PNG"), "acme.png")
+        self.assertEqual((ext, width, height), ("png", 640, 160))
+        self.assertLess(len(data), len(self.encode(transparent, "PNG")))
+
+        # Маленькие логотипы не увеличиваются
+        _, _, width, height = build_variant(self.encode(Image.new("RGB", (40, 20), "red"), "PNG"), "tiny.png")
+        self.assertEqual((width, height), (40, 20))
+
+    def test_variant_is_stored_and_used_for_render(self):
+        from django.core.files.base import ContentFile
+        from PIL import Image
+
+        from .logo_variants import ensure_logo_variant
+
+        invoice = Invoice.objects.create(company_name="Acme", address="Main st", logo="acme.png")
+        self.assertEqual(invoice.render_logo().name, "acme.png")
+
+        original = self.encode(Image.new("RGB", (1600, 800), "navy"), "PNG")
+        logo_storage = Invoice._meta.get_field("logo").storage
+        render_storage = Invoice._meta.get_field("logo_render").storage
+        with mock.patch.object(logo_storage, "open", return_value=ContentFile(original)), mock.patch.object(
+            render_storage, "save", side_effect=lambda name, content: name
+        ) as save:
+            self.assertTrue(ensure_logo_variant(invoice))
+            self.assertFalse(ensure_logo_variant(invoice))
+        self.assertEqual(save.call_count, 1)
+
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.render_logo().name, save.call_args.args[0])
+        self.assertTrue(invoice.logo_render.name.startswith("render/acme-160h."))
+        self.assertEqual((invoice.logo_width, invoice.logo_height), (320, 160))
+
+        # Новый логотип — старый вариант больше не используется, новый строится на воркере
+        invoice.logo = "other.png"
+        with mock.patch("backend.api.tasks.preprocess_logo.delay") as delay, self.captureOnCommitCallbacks(execute=True):
+            invoice.save()
+        delay.assert_called_once_with(invoice.pk)
+        self.assertEqual(invoice.render_logo().name, "other.png")
+
+    def test_failed_variant_is_recorded_and_not_built_on_render(self):
+        from .tasks import _build_context, preprocess_logo
+
+        invoice = Invoice.objects.create(company_name="Acme", address="Main st", logo="broken.png")
+        with override_settings(USE_S3=True), mock.patch("backend.api.tasks.logo_url", side_effect=str), \
+                mock.patch("backend.api.tasks.ensure_logo_variant") as ensure:
+            self.assertEqual(_build_context(invoice)["logo_path"], "broken.png")
+        ensure.assert_not_called()
+
+        logo_storage = Invoice._meta.get_field("logo").storage
+        with mock.patch.object(logo_storage, "open", side_effect=OSError("corrupt upload")) as open_logo:
+            self.assertEqual(preprocess_logo(invoice.pk)["status"], "failed")
+            self.assertEqual(preprocess_logo(invoice.pk)["status"], "skipped")
+        self.assertEqual(open_logo.call_count, 1)
+
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.logo_render.name, invoice.logo_render_source), ("", "broken.png"))
+        self.assertEqual(invoice.render_logo().name, "broken.png")
+
+
+@override_settings(PDF_PIPELINE=True, USE_S3=False)
+class PDFPipelineTests(TestCase):
+    def test_render_stage_hands_pdf_to_store_stage(self):
+        from .tasks import render_task, store_pdf
+
+        handoff, output = Path(tempfile.mkdtemp()), Path(tempfile.mkdtemp())
+        invoice = Invoice.objects.create(company_name="Acme", address="Main st")
+        InvoiceItem.objects.create(invoice=invoice, name="Widget", quantity=2, unit_price=Decimal("2.50"))
+
+        with override_settings(PDF_HANDOFF_DIR=handoff, PDF_OUTPUT_DIR=output), mock.patch(
+            "backend.api.tasks.render_pdf_to_file", side_effect=lambda html, path: Path(path).write_bytes(b"%PDF-1.4")
+        ), mock.patch("backend.api.tasks.store_pdf.delay") as delay:
+            self.assertEqual(render_task().apply(args=[invoice.id]).result["status"], "rendered")
+            task_status = TaskStatus.objects.get(invoice=invoice)
+            self.assertEqual(task_status.status, TaskStatus.Status.RUNNING)
+            self.assertEqual([path.name for path in handoff.iterdir()], [delay.call_args.args[2]])
+
+            result = store_pdf.apply(args=delay.call_args.args).result
+
+        self.assertEqual(result["status"], "completed")
+        self.assertEqual((output / invoice.get_pdf_filename()).read_bytes(), b"%PDF-1.4")
+        self.assertEqual(list(handoff.iterdir()), [])
+        task_status.refresh_from_db()
+        self.assertEqual(task_status.status, TaskStatus.Status.COMPLETED)
+        # Время рендера записано на стадии render_pdf, очередь и загрузка в него не входят
+        self.assertIsNotNone(task_status.render_seconds)
+        self.assertLessEqual(task_status.render_seconds, task_status.duration_seconds)
+
+
+    def test_missing_handoff_file_re_enqueues_the_render(self):
+        from .tasks import render_pdf, store_pdf
+
+        invoice = Invoice.objects.create(company_name="Acme", address="Main st")
+        task_status = TaskStatus.start_or_update(invoice, "render-1")
+        task_status.mark_started()
+
+        # Файл отрисован в другой задаче ECS — здесь его нет
+        with override_settings(PDF_HANDOFF_DIR=tempfile.mkdtemp(), PDF_HANDOFF_RERENDERS=2), \
+                mock.patch.object(render_pdf, "apply_async") as apply_async:
+            result = store_pdf.apply(args=[invoice.id, task_status.pk, "render-1.pdf", "hash", 1]).result
+            self.assertEqual(result["status"], "rerendering")
+            apply_async.assert_called_once_with(args=[invoice.id], kwargs={"rerender": 2}, task_id="render-1", queue=None)
+            task_status.refresh_from_db()
+            self.assertEqual(task_status.status, TaskStatus.Status.RUNNING)
+
+            apply_async.reset_mock()
+            result = store_pdf.apply(args=[invoice.id, task_status.pk, "render-1.pdf", "hash", 2]).result
+        self.assertEqual(result["status"], "failed")
+        apply_async.assert_not_called()
+        task_status.refresh_from_db()
+        self.assertEqual(task_status.status, TaskStatus.Status.FAILED)
+
+
+class RenderCostTests(TestCase):
+    def setUp(self):
+        from .render_cost import reset_cost_model
+
+        reset_cost_model()
+        self.addCleanup(reset_cost_model)
+
+    def test_fit_recovers_cost_coefficients(self):
+        from .render_cost import fit_cost_model
+
+        rows = [(items, items % 2 == 0, 0.5 + 0.02 * items + (0.3 if items % 2 == 0 else 0)) for items in range(1, 60)]
+        model = fit_cost_model(rows)
+        self.assertAlmostEqual(model.per_item, 0.02, places=3)
+        self.assertAlmostEqual(model.logo, 0.3, places=2)
+        self.assertAlmostEqual(model.estimate(1000, False), 20.5, delta=0.5)
+        self.assertIsNone(fit_cost_model(rows[:5]))
+
+    @override_settings(PDF_COST_MIN_SAMPLES=5)
+    def test_cache_hits_do_not_change_the_model(self):
+        from .render_cost import _history, fit_cost_model
+
+        for items in range(1, 11):
+            invoice = Invoice.objects.create(company_name="Acme", address="Main st", item_count=items * 100)
+            rendered = TaskStatus.start_or_update(invoice, f"render-{items}")
+            rendered.mark_started()
+            rendered.mark_completed(render_seconds=0.5 + 0.02 * items * 100)
+        model = fit_cost_model(_history())
+
+        # Кэш-хиты (и pipeline-задачи, где duration включает очередь store_pdf) — без render_seconds
+        for invoice in Invoice.objects.all():
+            cached = TaskStatus.start_or_update(invoice, f"cached-{invoice.id}")
+            cached.mark_started()
+            cached.mark_completed()
+            self.assertIsNone(cached.render_seconds)
+        refitted = fit_cost_model(_history())
+        self.assertEqual(refitted.samples, model.samples)
+        for field in ("base", "per_item", "logo"):
+            self.assertAlmostEqual(getattr(refitted, field), getattr(model, field), places=9)
+        self.assertAlmostEqual(model.per_item, 0.02, places=6)
+
+    def test_render_seconds_are_recorded_for_renders_only(self):
+        import io
+        from contextlib import contextmanager
+
+        from .tasks import generate_pdf
+
+        invoice = Invoice.objects.create(company_name="Acme", address="Main st")
+        InvoiceItem.objects.create(invoice=invoice, name="Widget", quantity=1, unit_price=Decimal("2.50"))
+
+        @contextmanager
+        def rendered_pdf(html):
+            yield io.BytesIO(b"%PDF-1.4")
+
+        output = tempfile.TemporaryDirectory()
+        self.addCleanup(output.cleanup)
+        with override_settings(PDF_OUTPUT_DIR=output.name, USE_S3=False), \
+                mock.patch("backend.api.tasks.rendered_pdf", rendered_pdf):
+            generate_pdf.apply(args=[invoice.id], task_id="first")
+            generate_pdf.apply(args=[invoice.id], task_id="second")
+
+        rows = dict(TaskStatus.objects.values_list("task_id", "render_seconds"))
+        self.assertIsNotNone(rows["first"])
+        self.assertIsNone(rows["second"])
+
+    @override_settings(PDF_SIZE_ROUTING=True, PDF_FAST_MAX_SECONDS=10, PDF_BULK_QUEUE="pdf-bulk")
+    def test_large_invoice_goes_to_bulk_queue(self):
+        small = Invoice.objects.create(company_name="Small", address="Main st", item_count=5)
+        large = Invoice.objects.create(company_name="Large", address="Main st", item_count=3000)
+
+        task = mock.Mock()
+        with mock.patch("backend.api.tasks.render_task", return_value=task):
+            responses = [
+                self.client.post(reverse("generate_pdf"), {"report_id": invoice.id}, content_type="application/json")
+                for invoice in (small, large, small)
+            ]
+            missing = self.client.post(reverse("generate_pdf"), {"report_id": large.id + 1}, content_type="application/json")
+        self.assertEqual([response.status_code for response in responses], [202, 202, 202])
+        self.assertEqual([call.kwargs["queue"] for call in task.apply_async.call_args_list], [None, "pdf-bulk"])
+        # Повторный запрос отдаёт задачу из очереди, а не ставит вторую
+        self.assertEqual(responses[2].json(), {"task_id": responses[0].json()["task_id"], "status": "queued"})
+        self.assertEqual(missing.status_code, 404)
+
+
+class ChunkedRenderTests(TestCase):
+    def test_parts_are_merged_with_continuous_page_numbers(self):
+        import io
+
+        from django.template.loader import get_template
+        from pypdf import PdfReader
+        from reportlab.pdfgen import canvas
+
+        from .chunked_render import is_chunked, render_chunked_to_file
+        from .tasks import REPORT_TEMPLATE
+
+        context = {
+            "invoice_id": 1, "company": "Acme", "address": "Main st", "date": "12:00:00, 01.01.2025",
+            "items": [{"name": f"Item {n}", "qty": 1, "price": 1, "total": 1} for n in range(45)],
+            "total": 45, "customer": {"name": "Jan"}, "logo_path": "",
+        }
+        rendered = []
+
+        def render_to_files(jobs):
+            # Вместо WeasyPrint: страница на каждые 20 строк таблицы
+            for html, path in jobs:
+                rendered.append(html)
+                pdf = canvas.Canvas(path)
+                for _ in range(html.count("<tr>") // 20 + 1):
+                    pdf.drawString(72, 720, "part")
+                    pdf.showPage()
+                pdf.save()
+
+        output = io.BytesIO()
+        with override_settings(PDF_CHUNK_MIN_ITEMS=30, PDF_CHUNK_ITEMS=20), mock.patch(
+            "backend.api.chunked_render.render_to_files", side_effect=render_to_files
+        ):
+            self.assertTrue(is_chunked(context))
+            pages = render_chunked_to_file(get_template(REPORT_TEMPLATE), context, output)
+
+        self.assertEqual(len(rendered), 3)
+        self.assertEqual([html.count("<h1>Acme</h1>") for html in rendered], [1, 0, 0])
+        self.assertEqual([html.count("Gross Total: 45 PLN") for html in rendered], [0, 0, 1])
+        self.assertFalse(any("counter(page)" in html for html in rendered))
+        self.assertEqual(sum(html.count("<td>Item ") for html in rendered), 45)
+
+        reader = PdfReader(output)
+        self.assertEqual((pages, len(reader.pages)), (5, 5))
+        self.assertIn("Page 4 of 5", reader.pages[3].extract_text())
+        self.assertIn("counter(page)", get_template(REPORT_TEMPLATE).render(context))
+
+    def test_streamed_merge_keeps_shared_resources_and_links(self):
+        import io
+
+        from PIL import Image
+        from pypdf import PdfReader
+        from reportlab.lib.utils import ImageReader
+        from reportlab.pdfgen import canvas
+
+        from .chunked_render import merge_parts
+
+        logo = io.BytesIO()
+        Image.new("RGB", (200, 80), "navy").save(logo, "PNG")
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        paths = []
+        for part in range(2):
+            paths.append(str(Path(directory.name, f"part-{part}.pdf")))
+            pdf = canvas.Canvas(paths[-1])
+            for page in range(3):
+                # Одно изображение на все страницы части — общий XObject
+                pdf.drawImage(ImageReader(io.BytesIO(logo.getvalue())), 40, 700, 200, 80)
+                pdf.linkURL("https://example.com", (40, 700, 240, 780))
+                pdf.drawString(40, 600, f"part {part} page {page}")
+                pdf.showPage()
+            pdf.save()
+
+        output = io.BytesIO()
+        self.assertEqual(merge_parts(paths, output), 6)
+
+        reader = PdfReader(output, strict=True)
+        self.assertEqual(len(reader.pages), 6)
+        for number, page in enumerate(reader.pages, start=1):
+            text = page.extract_text()
+            self.assertIn(f"part {(number - 1) // 3} page {(number - 1) % 3}", text)
+            self.assertIn(f"Page {number} of 6", text)
+            image = next(iter(page["/Resources"]["/XObject"].values())).get_object()
+            self.assertEqual((image["/Width"], image["/Height"]), (200, 80))
+            self.assertEqual(page["/Annots"][0].get_object()["/A"]["/URI"], "https://example.com")
+
+    def test_merge_keeps_bookmarks_and_named_destinations(self):
+        import io
+
+        from pypdf import PdfReader, PdfWriter
+        from reportlab.pdfgen import canvas
+
+        from .chunked_render import merge_parts
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        paths = [str(Path(directory.name, f"part-{part}.pdf")) for part in range(3)]
+
+        # Как WeasyPrint для <h1>/<h2>: закладки в первой части
+        pdf = canvas.Canvas(paths[0])
+        for title in ("Header", "Items"):
+            pdf.bookmarkPage(title)
+            pdf.addOutlineEntry(title, title, level=0)
+            pdf.showPage()
+        pdf.save()
+        pdf = canvas.Canvas(paths[1])
+        pdf.showPage()
+        pdf.showPage()
+        pdf.save()
+        # Последняя часть: закладка и именованная цель из дерева имён
+        single = io.BytesIO()
+        pdf = canvas.Canvas(single)
+        pdf.showPage()
+        pdf.save()
+        writer = PdfWriter(clone_from=PdfReader(single))
+        writer.add_outline_item("Total", 0)
+        writer.add_named_destination("total", 0)
+        writer.write(paths[2])
+
+        output = io.BytesIO()
+        self.assertEqual(merge_parts(paths, output), 5)
+
+        reader = PdfReader(output, strict=True)
+        self.assertEqual([item.title for item in reader.outline], ["Header", "Items", "Total"])
+        self.assertEqual([reader.get_destination_page_number(item) for item in reader.outline], [0, 1, 4])
+        self.assertEqual(reader.get_destination_page_number(reader.named_destinations["total"]), 4)
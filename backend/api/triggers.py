@@ -0,0 +1,132 @@
+"""
+Transaction-aware PDF render trigger.
+
+Item writes only mark their invoice as dirty. Dirty invoice IDs are collected
+per transaction in a ``_DirtyInvoices`` set whose ``flush`` is registered with
+``transaction.on_commit``: one render is enqueued per invoice no matter how
+many of its items were saved in the transaction. A rollback discards the
+callback and with it the set, so rolled-back changes never trigger a render.
+Outside an atomic block ``on_commit`` fires immediately, so every write
+flushes on its own.
+"""
+import logging
+import threading
+from typing import Any, Iterable, List, Optional, Set, Tuple
+
+from celery.utils import uuid
+from django.conf import settings
+from django.db import transaction
+
+from .models import Invoice, TaskStatus
+from .render_cost import render_queue
+
+logger = logging.getLogger(__name__)
+
+_state = threading.local()
+
+
+class _DirtyInvoices:
+    """Invoice IDs dirtied in one transaction (at one savepoint level)."""
+
+    def __init__(self, savepoint_ids: Tuple[str, ...]):
+        self.ids: Set[int] = set()
+        self.savepoint_ids = savepoint_ids
+        self.flushed = False
+
+    def is_pending(self, connection) -> bool:
+        # Откат (транзакции или savepoint, где набор создан) выбрасывает его колбэк из run_on_commit
+        return (
+            not self.flushed
+            and self.savepoint_ids == tuple(connection.savepoint_ids)
+            and any(func == self.flush for _, func, _ in connection.run_on_commit)
+        )
+
+    def flush(self) -> None:
+        self.flushed = True
+        if not self.ids:
+            return
+        invoice_ids = sorted(self.ids)
+        try:
+            enqueue_pdf_renders(invoice_ids)
+        except Exception:
+            logger.exception(f"[signals] ❌ Ошибка при запуске генерации PDF для Invoice {invoice_ids}")
+
+
+def mark_invoice_dirty(invoice_id: int) -> None:
+    """Schedules a PDF render for ``invoice_id`` after the current transaction commits."""
+    connection = transaction.get_connection()
+    dirty = getattr(_state, "dirty", None)
+    if dirty is None or not dirty.is_pending(connection):
+        dirty = _state.dirty = _DirtyInvoices(tuple(connection.savepoint_ids))
+        dirty.ids.add(invoice_id)
+        # Вне atomic колбэк выполняется сразу — ID должен быть в наборе до регистрации
+        transaction.on_commit(dirty.flush)
+        return
+    dirty.ids.add(invoice_id)
+
+
+def enqueue_pdf_renders(invoice_ids: Iterable[int], lanes: Optional[int] = None) -> List[str]:
+    """
+    Enqueues renders for invoices that have items and no render waiting in
+    the queue, and returns the Celery task IDs. A single invoice goes to
+    ``generate_pdf`` (``render_pdf`` with ``PDF_PIPELINE``); several are
+    grouped into ``generate_pdf_batch`` tasks. With ``PDF_SIZE_ROUTING`` every
+    task goes to the fast or the bulk queue by its estimated render time.
+    With ``lanes`` at most that many batch tasks are in the broker or running
+    at once: the batches are split into lanes and each lane publishes its next
+    batch only when the previous one has finished (see ``start_lane``).
+    """
+    from .tasks import generate_pdf_batch, render_task
+
+    invoices = Invoice.objects.filter(id__in=list(invoice_ids)).values_list("id", "item_count", "logo", "latest_status")
+
+    to_render = []
+    cost = {}
+    for invoice_id, item_count, logo, status in invoices:
+        if not item_count:
+            logger.info(f"[signals] ⏳ Invoice #{invoice_id} ещё без позиций.")
+        elif status == TaskStatus.Status.QUEUED:
+            # Запущенную (RUNNING) задачу не считаем: она могла прочитать позиции до изменения
+            logger.info(f"[signals] ⏩ Invoice #{invoice_id}: задача уже в очереди. Пропускаем.")
+        else:
+            to_render.append(invoice_id)
+            cost[invoice_id] = (item_count, bool(logo))
+
+    if not to_render:
+        return []
+
+    if len(to_render) == 1:
+        task_id = uuid()
+        TaskStatus.create_queued({to_render[0]: task_id})
+        render_task().apply_async(args=[to_render[0]], task_id=task_id, queue=render_queue([cost[to_render[0]]]))
+        logger.info(f"[signals] 🧾 Invoice #{to_render[0]}: запускаем генерацию PDF...")
+        return [task_id]
+
+    batch_size = getattr(settings, "PDF_BATCH_SIZE", 100)
+    batches = []
+    for start in range(0, len(to_render), batch_size):
+        chunk = to_render[start:start + batch_size]
+        task_id = uuid()
+        # Строки QUEUED создаём заранее, generate_pdf_batch обновит их по task_id
+        TaskStatus.create_queued({invoice_id: f"{task_id}:{invoice_id}" for invoice_id in chunk})
+        batches.append([chunk, task_id, render_queue(cost[invoice_id] for invoice_id in chunk)])
+
+    if lanes:
+        for lane in range(min(lanes, len(batches))):
+            start_lane(batches[lane::lanes])
+    else:
+        for chunk, task_id, queue in batches:
+            generate_pdf_batch.apply_async(args=[chunk], task_id=task_id, queue=queue)
+    logger.info(f"[signals] 🧾 Запущена генерация PDF для {len(to_render)} инвойсов ({len(batches)} batch).")
+    return [task_id for _, task_id, _ in batches]
+
+
+def start_lane(lane: List[Any]) -> None:
+    """
+    Publishes the first ``[chunk, task_id, queue]`` batch of ``lane`` and hands
+    it the rest; ``generate_pdf_batch`` calls this again when it finishes.
+    """
+    from .tasks import generate_pdf_batch
+
+    (chunk, task_id, queue), rest = lane[0], lane[1:]
+    generate_pdf_batch.apply_async(args=[chunk], kwargs={"lane": rest}, task_id=task_id, queue=queue)
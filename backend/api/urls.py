@@ -2,21 +2,31 @@ from django.urls import path
 from .views import (
     index,
     GeneratePDFView,
+    GenerateBatchPDFView,
     PDFStatusView,
+    PDFStatusBatchView,
+    pdf_status_events_view,
+    pdf_status_wait_view,
     download_pdf_view,
     health_check_view,
     db_status_view,
     InvoiceListCreateView,
+    InvoiceBulkCreateView,
     InvoiceDetailView
 )
 
 urlpatterns = [
     path("", index),
     path("generate-pdf/", GeneratePDFView.as_view(), name="generate_pdf"),
+    path("generate-pdf/batch/", GenerateBatchPDFView.as_view(), name="generate_pdf_batch"),
+    path("pdf-status/batch/", PDFStatusBatchView.as_view(), name="pdf_status_batch"),
     path("pdf-status/<task_id>/", PDFStatusView.as_view(), name="pdf_status"),
+    path("pdf-status/<task_id>/events/", pdf_status_events_view, name="pdf_status_events"),
+    path("pdf-status/<task_id>/wait/", pdf_status_wait_view, name="pdf_status_wait"),
     path("download-pdf/<int:report_id>/", download_pdf_view, name="download_pdf"),
     path("health/", health_check_view, name="health_check"),
     path("db-status/", db_status_view, name="db_status"),
     path("invoices/", InvoiceListCreateView.as_view(), name="invoice_list_create"),
+    path("invoices/bulk/", InvoiceBulkCreateView.as_view(), name="invoice_bulk_create"),
     path("invoices/<int:pk>/", InvoiceDetailView.as_view(), name="invoice_detail"),
 ]
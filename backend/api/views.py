@@ -3,20 +3,28 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, generics
 from rest_framework.exceptions import ValidationError
-from celery.result import AsyncResult
 
-from django.http import FileResponse, Http404, JsonResponse
+from django.http import Http404, HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.http import parse_etags
 from django.conf import settings
 from django.db import connection
-import redis
 import os
+import asyncio
+import hmac
+import json
 
-from backend.celery import app as celery_app
-from .models import Invoice
-from .tasks import generate_pdf
+from asgiref.sync import sync_to_async
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from . import events, metrics, probes
+from .models import Invoice, TaskStatus
 from .serializers import InvoiceSerializer
+from .pagination import InvoiceCursorPagination
+from .downloads import presigned_pdf_url
+from .local_files import accel_redirect_response, file_response
+from .status_lookup import get_status, get_statuses, payload_etag
+from .triggers import enqueue_pdf_renders
 
-from backend.storage_backends import PDFStorage
 from django.http import HttpResponseRedirect
 
 from datetime import datetime, timezone
@@ -31,62 +39,196 @@ class GeneratePDFView(APIView):
         if not report_id:
             return Response({"error": "Missing report_id"}, status=status.HTTP_400_BAD_REQUEST)
 
-        task = generate_pdf.delay(report_id)
-        return Response({"task_id": task.id, "status": "started"}, status=status.HTTP_202_ACCEPTED)
+        try:
+            report_id = int(report_id)
+        except (TypeError, ValueError):
+            return Response({"error": "report_id must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Строка QUEUED, Invoice.latest_status и очередь по стоимости — как у триггеров сохранения
+        task_ids = enqueue_pdf_renders([report_id])
+        if task_ids:
+            return Response({"task_id": task_ids[0], "status": "started"}, status=status.HTTP_202_ACCEPTED)
+
+        invoice = Invoice.objects.select_related("latest_task").filter(pk=report_id).first()
+        if invoice is None:
+            return Response({"error": "Invoice not found"}, status=status.HTTP_404_NOT_FOUND)
+        if invoice.latest_status == TaskStatus.Status.QUEUED and invoice.latest_task:
+            # Повторный клик не ставит вторую задачу — отдаём ту, что уже в очереди
+            return Response({"task_id": invoice.latest_task.task_id, "status": "queued"}, status=status.HTTP_202_ACCEPTED)
+        return Response({"error": "Invoice has no items"}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class GenerateBatchPDFView(APIView):
+    def post(self, request):
+        report_ids = request.data.get("report_ids")
+        if not isinstance(report_ids, list) or not report_ids:
+            return Response({"error": "report_ids must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            report_ids = list(dict.fromkeys(int(report_id) for report_id in report_ids))
+        except (TypeError, ValueError):
+            return Response({"error": "report_ids must contain integers"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Инвойсы без позиций и те, что уже в очереди, пропускаются; остальные — батчами по PDF_BATCH_SIZE
+        task_ids = enqueue_pdf_renders(report_ids)
+        return Response(
+            {"task_ids": task_ids, "count": len(report_ids), "status": "started"},
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+
+def _conditional_response(request, payload) -> Response:
+    """200 with an ETag, or 304 when the client already has this payload."""
+    etag = payload_etag(payload)
+    if etag in parse_etags(request.headers.get("If-None-Match", "")):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = Response(payload, status=status.HTTP_200_OK)
+    response["ETag"] = etag
+    # Браузер перепроверяет каждый раз, но тело не скачивает, если статус не изменился
+    response["Cache-Control"] = "no-cache"
+    return response
 
 
 class PDFStatusView(APIView):
     def get(self, request, task_id):
-        result = AsyncResult(task_id)
-        response = {
-            "task_id": task_id,
-            "status": result.status,
-            "result": result.result if result.ready() else None
-        }
-        return Response(response, status=status.HTTP_200_OK)
+        return _conditional_response(request, get_status(task_id))
+
+
+class PDFStatusBatchView(APIView):
+    """``GET pdf-status/batch/?task_ids=a,b,c`` — statuses of many tasks at once."""
+
+    def get(self, request):
+        task_ids = [task_id for task_id in request.query_params.get("task_ids", "").split(",") if task_id]
+        if not task_ids:
+            return Response({"error": "task_ids is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        max_size = getattr(settings, "PDF_STATUS_BATCH_MAX", 100)
+        if len(task_ids) > max_size:
+            return Response({"error": f"At most {max_size} task_ids per request"}, status=status.HTTP_400_BAD_REQUEST)
+
+        statuses = get_statuses(task_ids)
+        return _conditional_response(request, {"results": [statuses[task_id] for task_id in dict.fromkeys(task_ids)]})
+
+
+TERMINAL_STATES = ("SUCCESS", "FAILURE")
+
+
+async def _status_events(task_id: str):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + getattr(settings, "PDF_EVENTS_MAX_SECONDS", 300)
+    keepalive = getattr(settings, "PDF_EVENTS_KEEPALIVE", 15)
+    last_etag = None
+
+    async with events.subscribe(task_id) as subscription:
+        changed = True
+        while True:
+            if changed:
+                payload = await sync_to_async(get_status)(task_id)
+                etag = payload_etag(payload)
+                if etag != last_etag:
+                    last_etag = etag
+                    yield f"event: status\nid: {etag}\ndata: {json.dumps(payload)}\n\n"
+                if payload["status"] in TERMINAL_STATES:
+                    return
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                # Браузерный EventSource переподключится сам
+                return
+            changed = await subscription.wait(min(remaining, keepalive))
+            if not changed:
+                yield ": keepalive\n\n"
+
+
+async def pdf_status_events_view(request, task_id):
+    """Server-sent events: one ``status`` event per change until the task finishes."""
+    response = StreamingHttpResponse(_status_events(task_id), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # nginx не должен буферизовать поток
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+async def pdf_status_wait_view(request, task_id):
+    """
+    Long-poll fallback for clients without SSE. Returns at once if the status
+    differs from ``If-None-Match``; otherwise waits up to ``timeout`` seconds
+    for a change and answers 304 if nothing happened.
+    """
+    max_timeout = getattr(settings, "PDF_LONGPOLL_TIMEOUT", 25)
+    try:
+        timeout = min(float(request.GET.get("timeout", max_timeout)), max_timeout)
+    except ValueError:
+        return JsonResponse({"error": "timeout must be a number"}, status=400)
+    known = parse_etags(request.headers.get("If-None-Match", ""))
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    async with events.subscribe(task_id) as subscription:
+        while True:
+            payload = await sync_to_async(get_status)(task_id)
+            etag = payload_etag(payload)
+            remaining = deadline - loop.time()
+            if etag not in known or remaining <= 0:
+                break
+            await subscription.wait(remaining)
+
+    if etag in known:
+        response = HttpResponseNotModified()
+    else:
+        response = JsonResponse(payload)
+    response["ETag"] = etag
+    response["Cache-Control"] = "no-cache"
+    return response
 
 
 def download_pdf_view(request, report_id):
     filename = f"report_{report_id}.pdf"
 
     if getattr(settings, "USE_S3", False):
-        storage = PDFStorage()
-        if not storage.exists(filename):
+        # Наличие PDF берём из Invoice.has_pdf, URL — из кэша: без HEAD-запросов к S3
+        url = presigned_pdf_url(report_id)
+        if url is None:
             raise Http404("PDF not found in S3")
-        url = storage.url(filename)
         return HttpResponseRedirect(url)
 
     # local
+    accel_location = getattr(settings, "PDF_ACCEL_REDIRECT_LOCATION", None)
+    if accel_location:
+        # Django только проверяет доступ, файл отдаёт nginx (sendfile, Range, 304)
+        if not Invoice.objects.filter(pk=report_id, has_pdf=True).exists():
+            raise Http404("PDF not found")
+        return accel_redirect_response(accel_location, filename)
+
     output_dir = getattr(settings, "PDF_OUTPUT_DIR", "/tmp")
     pdf_path = os.path.join(output_dir, filename)
     if not os.path.exists(pdf_path):
         raise Http404("PDF not found")
-    return FileResponse(open(pdf_path, 'rb'), content_type='application/pdf')
+    return file_response(request, pdf_path, filename)
 
 
 def health_check_view(request):
-    status_flags = {
-        "redis": False,
-        "celery": False,
-    }
+    """Latest background probe results; never touches Redis, the broker or the DB itself."""
+    snapshot = probes.get_runner().snapshot()
+    flags = {name: result["ok"] for name, result in snapshot["probes"].items()}
+    return JsonResponse({"ok": snapshot["ok"], **flags, "probes": snapshot["probes"]})
 
-    try:
-        redis_url = settings.CELERY_BROKER_URL
-        r = redis.Redis.from_url(redis_url)
-        r.ping()
-        status_flags["redis"] = True
-    except Exception as e:
-        status_flags["redis_error"] = str(e)
 
-    try:
-        result = celery_app.send_task("celery.ping")
-        result.get(timeout=5)
-        status_flags["celery"] = True
-    except Exception as e:
-        status_flags["celery_error"] = str(e)
+def _metrics_authorized(request) -> bool:
+    # Без METRICS_TOKEN /metrics закрыт: ALB ходит в gunicorn напрямую, мимо allow-list nginx
+    token = getattr(settings, "METRICS_TOKEN", "")
+    if not token:
+        return False
+    supplied = request.headers.get("Authorization", "")
+    return hmac.compare_digest(supplied.encode(), f"Bearer {token}".encode())
+
 
-    overall = status_flags["redis"] and status_flags["celery"]
-    return JsonResponse({"ok": overall, **status_flags})
+def metrics_view(request):
+    """Prometheus exposition: render pipeline metrics of all worker processes plus TaskStatus counts."""
+    if not _metrics_authorized(request):
+        return JsonResponse({"error": "Forbidden"}, status=403)
+    return HttpResponse(generate_latest(metrics.registry()), content_type=CONTENT_TYPE_LATEST)
 
 
 def db_status_view(request):
@@ -98,10 +240,25 @@ def db_status_view(request):
             cursor.execute("SELECT count(*) FROM pg_stat_activity WHERE datname = current_database();")
             active_conn = cursor.fetchone()[0]
 
+            # application_name = invoices-<DB_ROLE>: сколько соединений держат web и celery
+            cursor.execute(
+                "SELECT application_name, state, count(*) FROM pg_stat_activity "
+                "WHERE datname = current_database() GROUP BY application_name, state;"
+            )
+            by_role = {}
+            for application_name, state, count in cursor.fetchall():
+                by_role.setdefault(application_name or "", {})[state or "unknown"] = count
+
+        # Пул — свой в каждом процессе; статистика этого процесса (None — пул выключен)
+        pool = getattr(connection, "pool", None)
         return JsonResponse({
             "ok": True,
             "postgres_version": version,
-            "active_connections": active_conn
+            "active_connections": active_conn,
+            "connections_by_application": by_role,
+            "role": getattr(settings, "DB_ROLE", "web"),
+            "conn_max_age": connection.settings_dict.get("CONN_MAX_AGE"),
+            "pool": pool.get_stats() if pool is not None else None,
         })
 
     except Exception as e:
@@ -112,8 +269,10 @@ def db_status_view(request):
 
 
 class InvoiceListCreateView(generics.ListCreateAPIView):
-    queryset = Invoice.objects.all().order_by("-id")
+    # customer и items сериализуются вложенными — грузим их сразу, без N+1
+    queryset = Invoice.objects.select_related("customer").prefetch_related("items")
     serializer_class = InvoiceSerializer
+    pagination_class = InvoiceCursorPagination
 
     def create(self, request, *args, **kwargs):
         try:
@@ -122,6 +281,34 @@ class InvoiceListCreateView(generics.ListCreateAPIView):
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
+class InvoiceBulkCreateView(generics.CreateAPIView):
+    """Accepts an array of invoices and ingests them in one transaction."""
+    serializer_class = InvoiceSerializer
+
+    def create(self, request, *args, **kwargs):
+        if not isinstance(request.data, list) or not request.data:
+            return Response({"error": "Expected a non-empty list of invoices"}, status=status.HTTP_400_BAD_REQUEST)
+
+        max_size = getattr(settings, "INVOICE_BULK_MAX", 5000)
+        if len(request.data) > max_size:
+            return Response(
+                {"error": f"At most {max_size} invoices per request"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        serializer = self.get_serializer(data=request.data, many=True)
+        try:
+            serializer.is_valid(raise_exception=True)
+        except ValidationError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        invoices = serializer.save()
+        return Response(
+            {"count": len(invoices), "ids": [invoice.id for invoice in invoices]},
+            status=status.HTTP_201_CREATED,
+        )
+
+
 class InvoiceDetailView(generics.RetrieveAPIView):
     queryset = Invoice.objects.all()
     serializer_class = InvoiceSerializer
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_asgi_application()
+
+# Фоновые health-проверки стартуют вместе с процессом, а не на первом запросе
+from backend.api.probes import get_runner  # noqa: E402
+
+get_runner()
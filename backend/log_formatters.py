@@ -0,0 +1,27 @@
+"""
+Logging formatters referenced from the ``dictConfig`` in ``settings/base.py``.
+
+Kept free of Django imports: the module is loaded while settings are still
+being configured.
+"""
+import json
+import logging
+
+# Атрибуты самой LogRecord; всё остальное в __dict__ пришло через extra=
+_RECORD_ATTRS = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: timestamp, level, logger, message and every ``extra`` field."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        payload.update((key, value) for key, value in record.__dict__.items() if key not in _RECORD_ATTRS)
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str, ensure_ascii=False)
@@ -13,6 +13,7 @@ import os
 import environ
 from pathlib import Path
 from storages.backends.s3boto3 import S3Boto3Storage
+from corsheaders.defaults import default_headers
 
 env = environ.Env()
 
@@ -56,6 +57,8 @@ from django.utils.log import DEFAULT_LOGGING
 LOGGING_CONFIG = None
 
 LOGLEVEL = os.getenv('LOGLEVEL', 'INFO').upper()
+# Метрики запросов к БД по view / задачам (backend.api.instrumentation) — JSON-строками
+QUERY_METRICS_LOGLEVEL = os.getenv('QUERY_METRICS_LOGLEVEL', 'INFO').upper()
 
 logging.config.dictConfig({
     'version': 1,
@@ -65,6 +68,9 @@ logging.config.dictConfig({
             'format': '%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
         },
         'django.server': DEFAULT_LOGGING['formatters']['django.server'],
+        'json': {
+            '()': 'backend.log_formatters.JsonFormatter',
+        },
     },
     'handlers': {
         'console': {
@@ -72,6 +78,10 @@ logging.config.dictConfig({
             'formatter': 'default',
         },
         'django.server': DEFAULT_LOGGING['handlers']['django.server'],
+        'json_console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json',
+        },
     },
     'loggers': {
         # Базовый логгер
@@ -87,6 +97,12 @@ logging.config.dictConfig({
         },
         # Стандартный логгер сервера Django
         'django.server': DEFAULT_LOGGING['loggers']['django.server'],
+        # Число запросов, время SQL и самый медленный запрос на каждый view и задачу
+        'backend.api.instrumentation': {
+            'level': QUERY_METRICS_LOGLEVEL,
+            'handlers': ['json_console'],
+            'propagate': False,
+        },
     },
 })
 
@@ -108,6 +124,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Первым — чтобы wall time и запросы к БД учитывали всю цепочку middleware
+    'backend.api.instrumentation.QueryMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -122,6 +140,10 @@ CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000","http://localhost:5173"
 ]
 
+# Long-poll (/api/pdf-status/<id>/wait/) передаёт ETag туда и обратно
+CORS_ALLOW_HEADERS = (*default_headers, "if-none-match")
+CORS_EXPOSE_HEADERS = ["ETag"]
+
 ROOT_URLCONF = 'backend.urls'
 
 TEMPLATES = [
@@ -189,6 +211,167 @@ PDF_OUTPUT_DIR = BASE_DIR / "pdf_output"
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Сколько инвойсов рендерит одна задача generate_pdf_batch
+PDF_BATCH_SIZE = int(os.getenv("PDF_BATCH_SIZE", "100"))
+
+# Максимум инвойсов в одном запросе POST /api/invoices/bulk/
+INVOICE_BULK_MAX = int(os.getenv("INVOICE_BULK_MAX", "5000"))
+
+# Пул процессов WeasyPrint (0 — рендер в текущем процессе с тёплым состоянием).
+# Celery prefork-воркеры не могут порождать процессы, пул работает с -P threads/solo.
+PDF_RENDER_POOL_SIZE = int(os.getenv("PDF_RENDER_POOL_SIZE", "0"))
+PDF_RENDER_TIMEOUT = int(os.getenv("PDF_RENDER_TIMEOUT", "300"))
+
+# Готовый PDF держим в памяти до этого размера, дальше — во временном файле
+PDF_SPOOL_MAX_MEMORY = int(os.getenv("PDF_SPOOL_MAX_MEMORY", str(8 * 1024 * 1024)))
+PDF_SPOOL_DIR = os.getenv("PDF_SPOOL_DIR") or None
+
+# Инвойсы от PDF_CHUNK_MIN_ITEMS позиций (0 — никогда) рендерятся частями по PDF_CHUNK_ITEMS
+# на пуле PDF_RENDER_POOL_SIZE и склеиваются (chunked_render.py)
+PDF_CHUNK_MIN_ITEMS = int(os.getenv("PDF_CHUNK_MIN_ITEMS", "5000"))
+PDF_CHUNK_ITEMS = int(os.getenv("PDF_CHUNK_ITEMS", "2000"))
+
+# Конвейер: render_pdf (CPU, очередь по умолчанию, prefork) кладёт PDF в PDF_HANDOFF_DIR,
+# store_pdf (I/O, очередь PDF_STORE_QUEUE, воркер -P threads) загружает его.
+# Каталог должен быть общим для обоих воркеров (один хост или общий том)
+PDF_PIPELINE = os.getenv("PDF_PIPELINE", "FALSE").upper() == "TRUE"
+PDF_STORE_QUEUE = os.getenv("PDF_STORE_QUEUE", "pdf-store")
+PDF_HANDOFF_DIR = os.getenv("PDF_HANDOFF_DIR") or None
+# Сколько раз store_pdf перезапускает рендер, если файла передачи нет (каталог оказался не общим)
+PDF_HANDOFF_RERENDERS = int(os.getenv("PDF_HANDOFF_RERENDERS", "2"))
+CELERY_TASK_ROUTES = {"store_pdf": {"queue": PDF_STORE_QUEUE}}
+
+# Маршрутизация по оценке времени рендера (render_cost.py): задачи дольше PDF_FAST_MAX_SECONDS
+# идут в PDF_BULK_QUEUE со своим воркером, остальные — в PDF_FAST_QUEUE (пусто — очередь по умолчанию).
+# Оценка: base + per_item * позиции + логотип, коэффициенты по истории TaskStatus, пока её мало — эти
+PDF_SIZE_ROUTING = os.getenv("PDF_SIZE_ROUTING", "FALSE").upper() == "TRUE"
+PDF_FAST_QUEUE = os.getenv("PDF_FAST_QUEUE") or None
+PDF_BULK_QUEUE = os.getenv("PDF_BULK_QUEUE", "pdf-bulk")
+PDF_FAST_MAX_SECONDS = float(os.getenv("PDF_FAST_MAX_SECONDS", "10"))
+PDF_COST_BASE_SECONDS = float(os.getenv("PDF_COST_BASE_SECONDS", "0.5"))
+PDF_COST_PER_ITEM_SECONDS = float(os.getenv("PDF_COST_PER_ITEM_SECONDS", "0.02"))
+PDF_COST_LOGO_SECONDS = float(os.getenv("PDF_COST_LOGO_SECONDS", "0.2"))
+PDF_COST_HISTORY = int(os.getenv("PDF_COST_HISTORY", "2000"))
+PDF_COST_MIN_SAMPLES = int(os.getenv("PDF_COST_MIN_SAMPLES", "20"))
+PDF_COST_MODEL_TTL = int(os.getenv("PDF_COST_MODEL_TTL", "600"))
+
+# Как часто (сек) фоновый поток обновляет heartbeat_at во время рендера.
+# Должно быть заметно меньше порога check_stuck_tasks (STALE_TASK_TIMEOUT_MINUTES).
+PDF_HEARTBEAT_INTERVAL = int(os.getenv("PDF_HEARTBEAT_INTERVAL", "30"))
+
+# check_stuck_tasks: через сколько минут без heartbeat задача считается зависшей
+# и перезапускать ли такие инвойсы (не больше N batch-задач одновременно)
+STALE_TASK_TIMEOUT_MINUTES = int(os.getenv("STALE_TASK_TIMEOUT_MINUTES", "5"))
+STALE_TASK_REQUEUE = os.getenv("STALE_TASK_REQUEUE", "FALSE").upper() == "TRUE"
+STALE_REQUEUE_CONCURRENCY = int(os.getenv("STALE_REQUEUE_CONCURRENCY", "4"))
+
+# Кэш Django: Redis, если задан REDIS_URL, иначе память процесса
+REDIS_URL = os.getenv("REDIS_URL")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# /api/pdf-status/: сколько секунд кэшировать ответ и сколько task_id в одном batch-запросе
+PDF_STATUS_CACHE_TTL = int(os.getenv("PDF_STATUS_CACHE_TTL", "2"))
+PDF_STATUS_BATCH_MAX = int(os.getenv("PDF_STATUS_BATCH_MAX", "100"))
+
+# SSE (/events/) и long-poll (/wait/) для статуса PDF, обслуживаются через ASGI.
+# Без REDIS_URL ждущие перечитывают статус раз в PDF_EVENTS_POLL_INTERVAL секунд.
+PDF_EVENTS_MAX_SECONDS = int(os.getenv("PDF_EVENTS_MAX_SECONDS", "300"))
+PDF_EVENTS_KEEPALIVE = int(os.getenv("PDF_EVENTS_KEEPALIVE", "15"))
+PDF_EVENTS_POLL_INTERVAL = int(os.getenv("PDF_EVENTS_POLL_INTERVAL", "2"))
+PDF_LONGPOLL_TIMEOUT = int(os.getenv("PDF_LONGPOLL_TIMEOUT", "25"))
+
+# /api/health/: фоновые проверки БД, брокера и Redis раз в N секунд;
+# результат старше HEALTH_PROBE_STALE_AFTER считается устаревшим
+HEALTH_PROBE_INTERVAL = int(os.getenv("HEALTH_PROBE_INTERVAL", "10"))
+HEALTH_PROBE_TIMEOUT = int(os.getenv("HEALTH_PROBE_TIMEOUT", "2"))
+HEALTH_PROBE_STALE_AFTER = int(os.getenv("HEALTH_PROBE_STALE_AFTER", "30"))
+
+# Presigned-ссылка на PDF живёт PDF_URL_EXPIRES секунд; в кэше — на PDF_URL_CACHE_MARGIN меньше
+PDF_URL_EXPIRES = int(os.getenv("PDF_URL_EXPIRES", "3600"))
+PDF_URL_CACHE_MARGIN = int(os.getenv("PDF_URL_CACHE_MARGIN", "300"))
+
+# Локальный режим за nginx: путь internal-location, из которой nginx сам отдаёт PDF
+# (X-Accel-Redirect). Пусто — файл отдаёт Django.
+PDF_ACCEL_REDIRECT_LOCATION = os.getenv("PDF_ACCEL_REDIRECT_LOCATION") or None
+
+# Инструментирование БД: QueryMetricsMiddleware и хуки task_prerun/task_postrun
+QUERY_METRICS_ENABLED = os.getenv("QUERY_METRICS_ENABLED", "TRUE").upper() == "TRUE"
+SERVER_TIMING_HEADER = os.getenv("SERVER_TIMING_HEADER", "TRUE").upper() == "TRUE"
+# Доля запросов/задач, для которых запоминается весь список SQL (и не больше QUERY_METRICS_DUMP_MAX);
+# он попадает в лог, только если запрос дольше SLOW_REQUEST_MS / задача дольше SLOW_TASK_MS
+QUERY_METRICS_DUMP_SAMPLE_RATE = float(os.getenv("QUERY_METRICS_DUMP_SAMPLE_RATE", "0.1"))
+QUERY_METRICS_DUMP_MAX = int(os.getenv("QUERY_METRICS_DUMP_MAX", "200"))
+SLOW_REQUEST_MS = int(os.getenv("SLOW_REQUEST_MS", "500"))
+SLOW_TASK_MS = int(os.getenv("SLOW_TASK_MS", "60000"))
+
+# Prometheus: веб отдаёт /metrics, родительский процесс celery worker — на этом порту (0 — выключено).
+# Под gunicorn / prefork нужен PROMETHEUS_MULTIPROC_DIR (общий каталог процессов одного сервера).
+CELERY_METRICS_PORT = int(os.getenv("CELERY_METRICS_PORT", "0"))
+# /metrics веба отдаётся только с заголовком "Authorization: Bearer <METRICS_TOKEN>"; пустой — всегда 403
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Кэш логотипов на воркере: LRU в памяти процесса, затем файлы в LOGO_CACHE_DIR (общие для процессов
+# хоста, не больше LOGO_CACHE_MAX_BYTES); старше LOGO_CACHE_REVALIDATE_SECONDS — условный GET по ETag
+LOGO_CACHE_DIR = os.getenv("LOGO_CACHE_DIR") or None
+LOGO_CACHE_MAX_BYTES = int(os.getenv("LOGO_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+LOGO_CACHE_MEMORY_ITEMS = int(os.getenv("LOGO_CACHE_MEMORY_ITEMS", "32"))
+LOGO_CACHE_REVALIDATE_SECONDS = int(os.getenv("LOGO_CACHE_REVALIDATE_SECONDS", "86400"))
+
+# Вариант логотипа для рендера (logo_variants.py): в шаблоне max-height 80px, храним 2x для печати
+LOGO_RENDER_HEIGHT = int(os.getenv("LOGO_RENDER_HEIGHT", "160"))
+LOGO_RENDER_MAX_WIDTH = int(os.getenv("LOGO_RENDER_MAX_WIDTH", "640"))
+LOGO_RENDER_JPEG_QUALITY = int(os.getenv("LOGO_RENDER_JPEG_QUALITY", "85"))
+
+# --- Соединения с PostgreSQL (подмешиваются в DATABASES["default"] в prod.py / test.py) ---
+# Роль процесса: "web" (gunicorn / uvicorn) или "worker" (celery) — пулы разного размера
+DB_ROLE = os.getenv("DB_ROLE", "web")
+# Нативный пул psycopg3; при DB_POOL=FALSE — постоянные соединения на DB_CONN_MAX_AGE секунд
+DB_POOL = os.getenv("DB_POOL", "TRUE").upper() == "TRUE"
+DB_POOL_SIZES = {
+    # gthread-воркер gunicorn: по соединению на поток запросов + поток health-проб + запас,
+    # чтобы запросы не ждали DB_POOL_TIMEOUT, пока проба держит соединение
+    "web": (
+        int(os.getenv("DB_POOL_MIN_SIZE_WEB", "2")),
+        int(os.getenv("DB_POOL_MAX_SIZE_WEB", str(int(os.getenv("GUNICORN_THREADS", "4")) + 2))),
+    ),
+    # prefork-потомок celery выполняет одну задачу: сама задача + поток heartbeat
+    # (heartbeat берёт соединение только на время UPDATE)
+    "worker": (int(os.getenv("DB_POOL_MIN_SIZE_WORKER", "1")), int(os.getenv("DB_POOL_MAX_SIZE_WORKER", "2"))),
+    # celery -P threads для store_pdf: поток на задачу и её heartbeat
+    "io": (int(os.getenv("DB_POOL_MIN_SIZE_IO", "2")), int(os.getenv("DB_POOL_MAX_SIZE_IO", "20"))),
+}
+DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE = DB_POOL_SIZES.get(DB_ROLE, DB_POOL_SIZES["web"])
+
+POSTGRES_CONNECTION = {
+    # Пул и CONN_MAX_AGE несовместимы: с пулом соединение после запроса возвращается в пул
+    "CONN_MAX_AGE": 0 if DB_POOL else int(os.getenv("DB_CONN_MAX_AGE", "60")),
+    "CONN_HEALTH_CHECKS": True,
+    "OPTIONS": {
+        # Видно в pg_stat_activity — db_status_view группирует соединения по ролям
+        "application_name": f"invoices-{DB_ROLE}",
+        **({"pool": {
+            "min_size": DB_POOL_MIN_SIZE,
+            "max_size": DB_POOL_MAX_SIZE,
+            # Сколько секунд ждать свободное соединение, прежде чем упасть с ошибкой
+            "timeout": int(os.getenv("DB_POOL_TIMEOUT", "10")),
+            "max_idle": int(os.getenv("DB_POOL_MAX_IDLE", "300")),
+            "max_lifetime": int(os.getenv("DB_POOL_MAX_LIFETIME", "1800")),
+        }} if DB_POOL else {}),
+    },
+}
+
 CELERY_BEAT_SCHEDULE = {
     "check-stuck-tasks-every-15-mins": {
         "task": "check_stuck_tasks",
@@ -15,6 +15,7 @@ CORS_ALLOWED_ORIGINS = [
     "https://app.projectnext.uk",
 ]
 
+# SQLite без пула: у runserver свой поток на запрос, постоянные соединения там не переиспользуются
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
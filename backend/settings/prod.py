@@ -21,6 +21,7 @@ DATABASES = {
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', 'postgres'),
         'HOST': os.getenv('POSTGRES_HOST', 'postgres'),
         'PORT': os.getenv('POSTGRES_PORT', '5432'),
+        **POSTGRES_CONNECTION,
     }
 }
 
@@ -46,7 +47,15 @@ BROKER_TRANSPORT_OPTIONS = {
     "predefined_queues": {
         "celery-prod-queue.fifo": {
             "url": "https://sqs.us-east-1.amazonaws.com/272509770066/celery-prod-queue.fifo"
-        }
+        },
+        # store_pdf (PDF_PIPELINE=TRUE): загрузка PDF на I/O-воркере
+        PDF_STORE_QUEUE: {
+            "url": f"https://sqs.us-east-1.amazonaws.com/272509770066/{PDF_STORE_QUEUE}"
+        },
+        # Большие инвойсы (PDF_SIZE_ROUTING=TRUE) на отдельном воркере
+        PDF_BULK_QUEUE: {
+            "url": f"https://sqs.us-east-1.amazonaws.com/272509770066/{PDF_BULK_QUEUE}"
+        },
     },
 }
 
@@ -1,7 +1,24 @@
+import threading
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from django.conf import settings
 from storages.backends.s3boto3 import S3Boto3Storage
 
 
+def _bounded_transfer_config() -> TransferConfig:
+    # Multipart-загрузка частями по 8 МБ, в памяти не больше двух частей:
+    # пик памяти не зависит от размера файла
+    config = TransferConfig(
+        multipart_threshold=8 * 1024 * 1024,
+        multipart_chunksize=8 * 1024 * 1024,
+        max_concurrency=2,
+    )
+    config.max_in_memory_upload_chunks = 2
+    return config
+
+
 class StaticStorage(S3Boto3Storage):
     location = settings.STATICFILES_LOCATION
     default_acl = 'public-read'
@@ -26,6 +43,31 @@ class LogoStorage(S3Boto3Storage):
 class PDFStorage(S3Boto3Storage):
     location = settings.PDFFILES_LOCATION
     default_acl = 'public-read'
-    file_overwrite = False
+    # report_<id>.pdf перезаписывается при повторном рендере, иначе pdf_url указывает на старую версию
+    file_overwrite = True
     querystring_auth = True
     custom_domain = False
+    transfer_config = _bounded_transfer_config()
+
+
+_pdf_client = None
+_pdf_client_lock = threading.Lock()
+
+
+def pdf_s3_client():
+    """
+    S3 client shared by the whole process. Building a session and a client
+    costs milliseconds, and clients are thread-safe, so it is created once.
+    """
+    global _pdf_client
+    if _pdf_client is None:
+        with _pdf_client_lock:
+            if _pdf_client is None:
+                session = boto3.session.Session()
+                _pdf_client = session.client(
+                    "s3",
+                    region_name=getattr(settings, "AWS_S3_REGION_NAME", None),
+                    endpoint_url=getattr(settings, "AWS_S3_ENDPOINT_URL", None),
+                    config=Config(signature_version="s3v4"),
+                )
+    return _pdf_client
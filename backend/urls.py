@@ -17,10 +17,11 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
-from backend.api.views import index
+from backend.api.views import index, metrics_view
 
 urlpatterns = [
     path("", index),
+    path("metrics", metrics_view, name="metrics"),
     path('admin/', admin.site.urls),
     path('api/', include('backend.api.urls')),
 ]
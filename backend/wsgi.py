@@ -14,3 +14,6 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_wsgi_application()
+
+# Health-пробы запускает gunicorn.conf.py в post_fork каждого воркера:
+# при preload_app этот модуль импортируется в мастере, где они не нужны.
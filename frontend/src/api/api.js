@@ -34,14 +34,36 @@ export const generatePDF = (reportId) =>
     body: JSON.stringify({ report_id: reportId }),
   });
 
-export const checkStatus = (taskId) =>
-  request(`${BASE_URL}/pdf-status/${taskId}/`);
+async function fetchStatus(url, etag) {
+  const res = await fetch(url, {
+    headers: etag ? { "If-None-Match": etag } : {},
+  });
+  if (res.status === 304) return { result: null, etag };
+  const result = await handleResponse(res);
+  return { result, etag: res.headers.get("ETag") };
+}
+
+// ETag polling: resolves with { result: null } while the status is unchanged (304)
+export const checkStatus = (taskId, etag) =>
+  fetchStatus(`${BASE_URL}/pdf-status/${taskId}/`, etag);
+
+// SSE and long-poll need the ASGI service (uvicorn); without it they tie up gunicorn threads
+export const statusPushEnabled = import.meta.env.VITE_STATUS_PUSH === "true";
+
+// Server-sent events: one "status" event per change (use with EventSource)
+export const statusEventsUrl = (taskId) =>
+  `${BASE_URL}/pdf-status/${taskId}/events/`;
+
+// Long-poll fallback: resolves on the next change, or with { result: null } after the timeout
+export const waitForStatus = (taskId, etag) =>
+  fetchStatus(`${BASE_URL}/pdf-status/${taskId}/wait/`, etag);
 
 export const getInvoice = (id) =>
   request(`${BASE_URL}/invoices/${id}/`);
 
-export const listInvoices = () =>
-  request(`${BASE_URL}/invoices/`);
+// Cursor-paginated: pass `next`/`previous` from the previous page to move on
+export const listInvoices = (cursorUrl) =>
+  request(cursorUrl || `${BASE_URL}/invoices/`);
 
 export const downloadPDF = (reportId) => {
   window.open(`${BASE_URL}/download-pdf/${reportId}/`, "_blank", "noopener,noreferrer");
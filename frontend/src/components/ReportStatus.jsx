@@ -1,5 +1,13 @@
 import React, { useEffect, useState, useCallback, useMemo } from "react";
-import { checkStatus, downloadPDF } from "../api/api";
+import {
+  checkStatus,
+  downloadPDF,
+  statusEventsUrl,
+  statusPushEnabled,
+  waitForStatus,
+} from "../api/api";
+
+const TERMINAL_STATES = ["SUCCESS", "FAILURE"];
 
 function ReportStatus({ taskId, reportId }) {
   const [status, setStatus] = useState("PENDING");
@@ -7,21 +15,63 @@ function ReportStatus({ taskId, reportId }) {
   useEffect(() => {
     if (!taskId) return;
 
-    const interval = setInterval(async () => {
-      try {
-        const result = await checkStatus(taskId);
-        setStatus(result.status);
-        if (["SUCCESS", "FAILURE"].includes(result.status)) {
+    // ETag polling: an unchanged status comes back as an empty 304
+    if (!statusPushEnabled) {
+      let etag = null;
+      const interval = setInterval(async () => {
+        try {
+          const { result, etag: nextEtag } = await checkStatus(taskId, etag);
+          etag = nextEtag;
+          if (!result) return;
+          setStatus(result.status);
+          if (TERMINAL_STATES.includes(result.status)) {
+            clearInterval(interval);
+          }
+        } catch (error) {
           clearInterval(interval);
+          setStatus("FAILURE");
+          console.error("Status check error:", error);
+        }
+      }, 2000);
+
+      return () => clearInterval(interval);
+    }
+
+    // SSE: the server pushes every status change
+    if (window.EventSource) {
+      const source = new EventSource(statusEventsUrl(taskId));
+      source.addEventListener("status", (event) => {
+        const result = JSON.parse(event.data);
+        setStatus(result.status);
+        if (TERMINAL_STATES.includes(result.status)) {
+          source.close();
+        }
+      });
+      return () => source.close();
+    }
+
+    // Long-poll for clients without EventSource
+    let cancelled = false;
+    (async () => {
+      let etag = null;
+      while (!cancelled) {
+        try {
+          const { result, etag: nextEtag } = await waitForStatus(taskId, etag);
+          etag = nextEtag;
+          if (!result || cancelled) continue;
+          setStatus(result.status);
+          if (TERMINAL_STATES.includes(result.status)) return;
+        } catch (error) {
+          setStatus("FAILURE");
+          console.error("Status check error:", error);
+          return;
         }
-      } catch (error) {
-        clearInterval(interval);
-        setStatus("FAILURE");
-        console.error("Status check error:", error);
       }
-    }, 2000);
+    })();
 
-    return () => clearInterval(interval);
+    return () => {
+      cancelled = true;
+    };
   }, [taskId]);
 
   const handleDownload = useCallback(() => {
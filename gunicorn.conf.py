@@ -0,0 +1,88 @@
+"""
+Production gunicorn profile:  gunicorn -c gunicorn.conf.py backend.wsgi:application
+
+Every value can be overridden with the GUNICORN_* environment variables.
+Worker count follows the CPU quota of the container (cgroup), not the host's
+core count, which on Fargate/ECS is usually much larger than the task's share.
+"""
+import math
+import os
+import shutil
+
+
+def _available_cpus() -> int:
+    # cgroup v2: "<quota> <period>" или "max <period>"
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return max(1, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    # cgroup v1
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0:
+            return max(1, math.ceil(quota / period))
+    except (OSError, ValueError):
+        pass
+    return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+
+
+cpus = _available_cpus()
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", 2 * cpus + 1))
+# gthread держит keep-alive соединения от nginx; sync-воркер закрывает их после каждого ответа
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+
+# Django и зависимости импортируются один раз в мастере, воркеры получают их через fork
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+# Перезапуск воркеров после N запросов (со случайным сдвигом) — против роста памяти
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "100"))
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+# Дольше, чем keepalive_timeout upstream-а в nginx (60s): соединение закрывает nginx,
+# а не gunicorn посреди повторного использования
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "75"))
+
+# Heartbeat-файлы воркеров в памяти, а не на overlay-диске контейнера
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+accesslog = os.getenv("GUNICORN_ACCESSLOG", "-")
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOGLEVEL", "info")
+
+
+def on_starting(server):
+    # Файлы метрик прошлого запуска сбили бы счётчики (см. backend/api/metrics.py)
+    path = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    # Соединения, открытые в мастере при preload, не должны делиться между воркерами
+    from django.db import connections
+
+    connections.close_all()
+
+    # Health-пробы — свои в каждом воркере (см. backend/wsgi.py)
+    from backend.api.probes import get_runner
+
+    get_runner()
@@ -0,0 +1,113 @@
+# ============================
+# ASGI (uvicorn) для SSE / long-poll статуса PDF
+# ============================
+# django-service — gunicorn (WSGI, gthread): async StreamingHttpResponse там собирается целиком,
+# keepalive не уходит, а каждое открытое соединение держит поток до PDF_EVENTS_MAX_SECONDS.
+# Поэтому /api/pdf-status/<id>/events|wait/ ALB отправляет в отдельный сервис под uvicorn.
+# Фронтенд включает SSE только с VITE_STATUS_PUSH=true — после того как этот сервис поднят
+
+resource "aws_ecs_task_definition" "django-asgi" {
+  family                   = "django-asgi"
+  network_mode             = "awsvpc"
+  requires_compatibilities = ["FARGATE"]
+  cpu                      = "512"
+  memory                   = "1024"
+  execution_role_arn       = aws_iam_role.ecs_task_execution_role.arn
+  task_role_arn            = aws_iam_role.celery_execution_role.arn
+
+  container_definitions = jsonencode([
+    {
+      name      = "django-asgi"
+      image     = "272509770066.dkr.ecr.us-east-1.amazonaws.com/django-backend:latest"
+      essential = true
+      # keep-alive дольше idle timeout ALB (60s), иначе ALB получит закрытое соединение
+      command = ["uvicorn", "backend.asgi:application", "--host", "0.0.0.0", "--port", "8000",
+      "--workers", "2", "--timeout-keep-alive", "75"]
+      portMappings = [{ containerPort = 8000, protocol = "tcp" }]
+      environment = [
+        { name = "DJANGO_ENV", value = "prod" },
+        { name = "DJANGO_SETTINGS_MODULE", value = "backend.settings.prod" },
+        { name = "ALLOWED_HOSTS", value = "*" },
+        { name = "USE_S3", value = "TRUE" },
+        { name = "DEBUG", value = "false" },
+        { name = "AWS_STORAGE_BUCKET_NAME", value = "django-invoice-d4aa5bee" }
+      ],
+      secrets = [
+        { name = "SECRET_KEY", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/SECRET_KEY" },
+        { name = "POSTGRES_DB", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/POSTGRES_DB" },
+        { name = "POSTGRES_USER", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/POSTGRES_USER" },
+        { name = "POSTGRES_PASSWORD", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/POSTGRES_PASSWORD" },
+        { name = "POSTGRES_HOST", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/POSTGRES_HOST" },
+        { name = "POSTGRES_PORT", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/POSTGRES_PORT" }
+      ],
+      logConfiguration = {
+        logDriver = "awslogs",
+        options = {
+          awslogs-group         = "/ecs/django",
+          awslogs-region        = "us-east-1",
+          awslogs-stream-prefix = "django-asgi"
+        }
+      }
+    }
+  ])
+  tags = {
+    environment = "development"
+  }
+}
+
+resource "aws_alb_target_group" "asgi_tg" {
+  name        = "asgi-target-group"
+  port        = 8000
+  protocol    = "HTTP"
+  vpc_id      = aws_vpc.main.id
+  target_type = "ip"
+
+  health_check {
+    path                = "/"
+    interval            = 30
+    timeout             = 5
+    healthy_threshold   = 2
+    unhealthy_threshold = 2
+    matcher             = "200"
+  }
+}
+
+# Только потоки статуса; всё остальное по-прежнему уходит в django-service (default_action)
+resource "aws_alb_listener_rule" "pdf_status_push" {
+  listener_arn = aws_alb_listener.nginx_https.arn
+  priority     = 10
+
+  action {
+    type             = "forward"
+    target_group_arn = aws_alb_target_group.asgi_tg.arn
+  }
+
+  condition {
+    path_pattern {
+      values = ["/api/pdf-status/*/events/", "/api/pdf-status/*/wait/"]
+    }
+  }
+}
+
+resource "aws_ecs_service" "asgi_service" {
+  name                   = "django-asgi-service"
+  cluster                = aws_ecs_cluster.django-cluster.id
+  task_definition        = aws_ecs_task_definition.django-asgi.arn
+  launch_type            = "FARGATE"
+  desired_count          = 1
+  enable_execute_command = true
+
+  network_configuration {
+    subnets          = [aws_subnet.private1.id, aws_subnet.private2.id]
+    assign_public_ip = false
+    security_groups  = [aws_security_group.celery_sg.id]
+  }
+  load_balancer {
+    target_group_arn = aws_alb_target_group.asgi_tg.arn
+    container_name   = "django-asgi"
+    container_port   = 8000
+  }
+  depends_on = [
+    aws_alb_listener_rule.pdf_status_push
+  ]
+}
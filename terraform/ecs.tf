@@ -23,7 +23,7 @@ resource "aws_ecs_task_definition" "django-worker" {
       name         = "django"
       image        = "272509770066.dkr.ecr.us-east-1.amazonaws.com/django-backend:latest"
       essential    = true
-      command      = ["gunicorn", "backend.wsgi:application", "--bind", "0.0.0.0:8000", "--workers=3", "--threads=2", "--timeout=120", "--log-level=info"]
+      command      = ["gunicorn", "-c", "gunicorn.conf.py", "backend.wsgi:application"]
       portMappings = [{ containerPort = 8000, protocol = "tcp" }]
       environment = [
         { name = "DJANGO_ENV", value = "prod" },
@@ -32,13 +32,20 @@ resource "aws_ecs_task_definition" "django-worker" {
         { name = "ALLOWED_HOSTS", value = "*" },
         { name = "USE_S3", value = "TRUE" }, 
         { name = "DEBUG", value = "true" }, 
-        { name = "AWS_STORAGE_BUCKET_NAME", value = "django-invoice-d4aa5bee" }
+        { name = "AWS_STORAGE_BUCKET_NAME", value = "django-invoice-d4aa5bee" },
+        { name = "PROMETHEUS_MULTIPROC_DIR", value = "/tmp/prometheus" },
+        { name = "PDF_PIPELINE", value = "TRUE" },
+        { name = "PDF_STORE_QUEUE", value = aws_sqs_queue.pdf_store_queue.name },
+        { name = "PDF_SIZE_ROUTING", value = "TRUE" },
+        { name = "PDF_BULK_QUEUE", value = aws_sqs_queue.pdf_bulk_queue.name }
       ],
       secrets = [
         { name = "SECRET_KEY", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/SECRET_KEY" },
         { name = "DJANGO_SU_NAME", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/SU_NAME" },
         { name = "DJANGO_SU_EMAIL", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/SU_EMAIL" },
         { name = "DJANGO_SU_PASSWORD", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/SU_PASSWORD" },
+        # /metrics доступен только с "Authorization: Bearer <METRICS_TOKEN>" (ALB не фильтрует по IP)
+        { name = "METRICS_TOKEN", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/METRICS_TOKEN" },
         { name = "POSTGRES_DB", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/POSTGRES_DB" },
         { name = "POSTGRES_USER", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/POSTGRES_USER" },
         { name = "POSTGRES_PASSWORD", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/POSTGRES_PASSWORD" },
@@ -107,42 +114,72 @@ resource "aws_ecs_task_definition" "django_migrate" {
 
 ###
 
+locals {
+  celery_environment = [
+    { name = "DJANGO_ENV", value = "prod" },
+    { name = "DJANGO_SETTINGS_MODULE", value = "backend.settings.prod" },
+    { name = "AWS_SQS_REGION", value = "us-east-1" },
+    { name = "AWS_ACCOUNT_ID", value = "272509770066" },
+    { name = "SQS_QUEUE_NAME", value = "celery-prod-queue.fifo" },
+    { name = "PDF_PIPELINE", value = "TRUE" },
+    { name = "PDF_STORE_QUEUE", value = aws_sqs_queue.pdf_store_queue.name },
+    { name = "PDF_HANDOFF_DIR", value = "/pdf-handoff" },
+    { name = "PDF_SIZE_ROUTING", value = "TRUE" },
+    { name = "PDF_BULK_QUEUE", value = aws_sqs_queue.pdf_bulk_queue.name },
+    { name = "PROMETHEUS_MULTIPROC_DIR", value = "/tmp/prometheus" },
+    { name = "AWS_CELERY_ROLE_ARN", value = aws_iam_role.celery_worker_role.arn },
+    { name = "DEBUG", value = "true" }, 
+    { name = "AWS_STORAGE_BUCKET_NAME", value = "django-invoice-d4aa5bee" },
+    { name = "USE_S3", value = "TRUE" }
+  ]
+  celery_secrets = [
+    { name = "AWS_ACCESS_KEY_ID", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/AWS_ACCESS_KEY_ID" },
+    { name = "AWS_SECRET_ACCESS_KEY", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/AWS_SECRET_ACCESS_KEY" },
+    { name = "POSTGRES_DB", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/POSTGRES_DB" },
+    { name = "POSTGRES_USER", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/POSTGRES_USER" },
+    { name = "POSTGRES_PASSWORD", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/POSTGRES_PASSWORD" },
+    { name = "POSTGRES_HOST", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/POSTGRES_HOST" },
+    { name = "POSTGRES_PORT", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/POSTGRES_PORT" }
+  ]
+}
+
+# Конвейер PDF: "celery" рендерит (prefork, CPU), "celery-store" загружает в S3 (threads, I/O).
+# PDF между ними передаётся через /pdf-handoff на EFS (efs.tf): store_pdf может взять сообщение
+# в другой задаче сервиса, поэтому том задачи (без EFS) годится только при desired_count = 1.
+# "celery-bulk" рендерит большие инвойсы из своей очереди одним процессом — мелкие их не ждут
 resource "aws_ecs_task_definition" "celery-worker" {
   family                   = "celery-worker"
   network_mode             = "awsvpc"
   requires_compatibilities = ["FARGATE"]
-  cpu                      = "512"
-  memory                   = "1024"
+  cpu                      = "1024"
+  memory                   = "2048"
   execution_role_arn       = aws_iam_role.ecs_task_execution_role.arn
   task_role_arn            = aws_iam_role.celery_execution_role.arn
 
+  volume {
+    name = "pdf-handoff"
+    efs_volume_configuration {
+      file_system_id     = aws_efs_file_system.pdf_handoff.id
+      transit_encryption = "ENABLED"
+      authorization_config {
+        access_point_id = aws_efs_access_point.pdf_handoff.id
+      }
+    }
+  }
+
   container_definitions = jsonencode([
     {
       name         = "celery"
       image        = "272509770066.dkr.ecr.us-east-1.amazonaws.com/django-backend:latest"
       essential    = true
-      command      = ["celery", "-A", "backend", "worker", "--loglevel=info"]
-      portMappings = [{ containerPort = 8000, protocol = "tcp" }]
-      environment = [
-        { name = "DJANGO_ENV", value = "prod" },
-        { name = "DJANGO_SETTINGS_MODULE", value = "backend.settings.prod" },
-        { name = "AWS_SQS_REGION", value = "us-east-1" },
-        { name = "AWS_ACCOUNT_ID", value = "272509770066" },
-        { name = "SQS_QUEUE_NAME", value = "celery-prod-queue.fifo" },
-        { name = "AWS_CELERY_ROLE_ARN", value = aws_iam_role.celery_worker_role.arn },
-        { name = "DEBUG", value = "true" }, 
-        { name = "AWS_STORAGE_BUCKET_NAME", value = "django-invoice-d4aa5bee" },
-        { name = "USE_S3", value = "TRUE" }
-      ],
-      secrets = [
-        { name = "AWS_ACCESS_KEY_ID", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/AWS_ACCESS_KEY_ID" },
-        { name = "AWS_SECRET_ACCESS_KEY", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/AWS_SECRET_ACCESS_KEY" },
-        { name = "POSTGRES_DB", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/POSTGRES_DB" },
-        { name = "POSTGRES_USER", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/POSTGRES_USER" },
-        { name = "POSTGRES_PASSWORD", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/POSTGRES_PASSWORD" },
-        { name = "POSTGRES_HOST", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/POSTGRES_HOST" },
-        { name = "POSTGRES_PORT", valueFrom = "arn:aws:ssm:us-east-1:${data.aws_caller_identity.current.account_id}:parameter/django/dev/POSTGRES_PORT" }
-      ],
+      command      = ["celery", "-A", "backend", "worker", "--loglevel=info", "-Q", "celery-prod-queue.fifo", "--concurrency", "2"]
+      portMappings = [{ containerPort = 8000, protocol = "tcp" }, { containerPort = 9808, protocol = "tcp" }]
+      environment = concat(local.celery_environment, [
+        { name = "DB_ROLE", value = "worker" },
+        { name = "CELERY_METRICS_PORT", value = "9808" }
+      ]),
+      secrets     = local.celery_secrets,
+      mountPoints = [{ sourceVolume = "pdf-handoff", containerPath = "/pdf-handoff" }],
       logConfiguration = {
         logDriver = "awslogs",
         options = {
@@ -151,6 +188,53 @@ resource "aws_ecs_task_definition" "celery-worker" {
           awslogs-stream-prefix = "celery"
         }
       }
+    },
+    {
+      name      = "celery-bulk"
+      image     = "272509770066.dkr.ecr.us-east-1.amazonaws.com/django-backend:latest"
+      essential = true
+      # solo, а не prefork: процесс задачи может запустить пул рендера и рендерить части инвойса параллельно
+      command = ["celery", "-A", "backend", "worker", "--loglevel=info", "-Q", aws_sqs_queue.pdf_bulk_queue.name,
+      "--pool", "solo", "--prefetch-multiplier", "1", "--hostname", "bulk@%h"]
+      portMappings = [{ containerPort = 9810, protocol = "tcp" }]
+      environment = concat(local.celery_environment, [
+        { name = "DB_ROLE", value = "worker" },
+        { name = "PDF_RENDER_POOL_SIZE", value = "2" },
+        { name = "CELERY_METRICS_PORT", value = "9810" }
+      ]),
+      secrets     = local.celery_secrets,
+      mountPoints = [{ sourceVolume = "pdf-handoff", containerPath = "/pdf-handoff" }],
+      logConfiguration = {
+        logDriver = "awslogs",
+        options = {
+          awslogs-group         = "/ecs/celery",
+          awslogs-region        = "us-east-1",
+          awslogs-stream-prefix = "celery-bulk"
+        }
+      }
+    },
+    {
+      name      = "celery-store"
+      image     = "272509770066.dkr.ecr.us-east-1.amazonaws.com/django-backend:latest"
+      essential = true
+      # Загрузка ждёт сеть, а не CPU: много потоков на одном ядре
+      command = ["celery", "-A", "backend", "worker", "--loglevel=info", "-Q", aws_sqs_queue.pdf_store_queue.name,
+      "--pool", "threads", "--concurrency", "16", "--hostname", "store@%h"]
+      portMappings = [{ containerPort = 9809, protocol = "tcp" }]
+      environment = concat(local.celery_environment, [
+        { name = "DB_ROLE", value = "io" },
+        { name = "CELERY_METRICS_PORT", value = "9809" }
+      ]),
+      secrets     = local.celery_secrets,
+      mountPoints = [{ sourceVolume = "pdf-handoff", containerPath = "/pdf-handoff" }],
+      logConfiguration = {
+        logDriver = "awslogs",
+        options = {
+          awslogs-group         = "/ecs/celery",
+          awslogs-region        = "us-east-1",
+          awslogs-stream-prefix = "celery-store"
+        }
+      }
     }
   ])
   tags = {
@@ -210,6 +294,7 @@ resource "aws_ecs_service" "celery_service" {
   cluster                = aws_ecs_cluster.django-cluster.id
   task_definition        = aws_ecs_task_definition.celery-worker.arn
   launch_type            = "FARGATE"
+  # desired_count > 1 допустим, только пока /pdf-handoff — общий EFS (efs.tf); с томом задачи — строго 1
   desired_count          = 1
   enable_execute_command = true
 
@@ -226,6 +311,8 @@ resource "aws_ecs_service" "celery_service" {
   # depends_on = [
   #   aws_alb_listener.nginx_https
   # ]
+  # Задача не стартует, пока в подсетях нет точек монтирования EFS
+  depends_on = [aws_efs_mount_target.pdf_handoff_private1, aws_efs_mount_target.pdf_handoff_private2]
 }
 
 resource "aws_alb" "nginx_alb" {
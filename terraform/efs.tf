@@ -0,0 +1,75 @@
+# ============================
+# EFS для конвейера PDF (/pdf-handoff)
+# ============================
+# render_pdf и store_pdf могут оказаться в разных задачах celery-service (desired_count > 1):
+# файл передачи должен лежать на общем томе, а не на томе одной задачи
+
+resource "aws_efs_file_system" "pdf_handoff" {
+  creation_token = "pdf-handoff"
+  encrypted      = true
+
+  # Файлы живут секунды: store_pdf удаляет их после загрузки
+  lifecycle_policy {
+    transition_to_ia = "AFTER_1_DAY"
+  }
+
+  tags = {
+    Name        = "pdf-handoff"
+    environment = "development"
+  }
+}
+
+# Владелец каталога — appuser (uid 1000 из Dockerfile), контейнеры работают не от root
+resource "aws_efs_access_point" "pdf_handoff" {
+  file_system_id = aws_efs_file_system.pdf_handoff.id
+
+  posix_user {
+    uid = 1000
+    gid = 1000
+  }
+
+  root_directory {
+    path = "/pdf-handoff"
+    creation_info {
+      owner_uid   = 1000
+      owner_gid   = 1000
+      permissions = "0750"
+    }
+  }
+}
+
+resource "aws_security_group" "pdf_handoff_efs" {
+  name        = "pdf-handoff-efs"
+  description = "NFS from celery tasks"
+  vpc_id      = aws_vpc.main.id
+
+  ingress {
+    from_port       = 2049
+    to_port         = 2049
+    protocol        = "tcp"
+    security_groups = [aws_security_group.celery_sg.id]
+  }
+
+  egress {
+    from_port   = 0
+    to_port     = 0
+    protocol    = "-1"
+    cidr_blocks = ["0.0.0.0/0"]
+  }
+
+  tags = {
+    Name = "pdf-handoff-efs"
+  }
+}
+
+resource "aws_efs_mount_target" "pdf_handoff_private1" {
+  file_system_id  = aws_efs_file_system.pdf_handoff.id
+  subnet_id       = aws_subnet.private1.id
+  security_groups = [aws_security_group.pdf_handoff_efs.id]
+}
+
+resource "aws_efs_mount_target" "pdf_handoff_private2" {
+  file_system_id  = aws_efs_file_system.pdf_handoff.id
+  subnet_id       = aws_subnet.private2.id
+  security_groups = [aws_security_group.pdf_handoff_efs.id]
+}
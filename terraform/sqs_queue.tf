@@ -24,12 +24,48 @@ resource "aws_sqs_queue" "celery_queue" {
   }
 }
 
+# Очередь store_pdf — загрузка готовых PDF в S3 (PDF_PIPELINE)
+resource "aws_sqs_queue" "pdf_store_queue" {
+  name                        = "pdf-store-queue.fifo"
+  fifo_queue                  = true
+  content_based_deduplication = true
+
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.celery_dlq.arn,
+    maxReceiveCount     = 5
+  })
+
+  tags = {
+    Environment = "prod"
+    App         = "celery"
+  }
+}
+
+# Очередь больших инвойсов (PDF_SIZE_ROUTING): рендер на отдельном воркере
+resource "aws_sqs_queue" "pdf_bulk_queue" {
+  name                        = "pdf-bulk-queue.fifo"
+  fifo_queue                  = true
+  content_based_deduplication = true
+  # Рендер тысяч позиций идёт минутами — сообщение не должно вернуться в очередь раньше
+  visibility_timeout_seconds = 3600
+
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.celery_dlq.arn,
+    maxReceiveCount     = 5
+  })
+
+  tags = {
+    Environment = "prod"
+    App         = "celery"
+  }
+}
+
 resource "aws_sqs_queue_redrive_allow_policy" "allow_redrive" {
   queue_url = aws_sqs_queue.celery_dlq.id
 
   redrive_allow_policy = jsonencode({
     redrivePermission = "byQueue",
-    sourceQueueArns   = [aws_sqs_queue.celery_queue.arn]
+    sourceQueueArns   = [aws_sqs_queue.celery_queue.arn, aws_sqs_queue.pdf_store_queue.arn, aws_sqs_queue.pdf_bulk_queue.arn]
   })
 }
 
@@ -124,6 +160,8 @@ resource "aws_iam_policy" "celery_sqs_policy" {
         ],
         Resource = [
           aws_sqs_queue.celery_queue.arn,
+          aws_sqs_queue.pdf_store_queue.arn,
+          aws_sqs_queue.pdf_bulk_queue.arn,
           aws_sqs_queue.celery_dlq.arn
         ]
       }